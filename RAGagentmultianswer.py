@@ -1,12 +1,54 @@
-import json
 import os
-from sentence_transformers import SentenceTransformer
-from dotenv import load_dotenv
-from openai import OpenAI
-import chromadb
+from modelregistry import get_model, registry, release_model
+from synthesis import ChromaSynthesisMixin
+from bm25 import BM25Index
+from chromasync import open_collection, sync_collection
+from dedup import collapse_records
+from indexartifact import ChromaArtifactMixin
+from kbstream import iter_kb_rows
+from parallelbuild import ParallelEncoder
+from metrics import metrics
+
+
+def iter_records(rows, mode="single", answer_fields=None, urls=None):
+    """Yield (document, metadata) for each KB row according to mode."""
+    if answer_fields is None:
+        answer_fields = ["answer_chatgpt"]
+
+    for row in rows:
+        q = row.get("input", "").strip()
+        if not q:
+            continue
+
+        if mode == "single":
+            a = row.get(answer_fields[0], "").strip()
+            if a:
+                yield f"Q: {q}\nA: {a}", {"source": "json"}
+
+        elif mode == "concat":
+            answers = [row.get(f, "").strip() for f in answer_fields if row.get(f)]
+            if answers:
+                a = " | ".join(answers)
+                yield f"Q: {q}\nA: {a}", {"source": "json"}
+
+        elif mode == "multi":
+            for f in answer_fields:
+                a = row.get(f, "").strip()
+                if a:
+                    yield f"Q: {q}\nA ({f}): {a}", {"source": f}
+
+    # Add URLs as extra entries
+    if urls:
+        for text, url in urls:
+            yield f"{text} (Source: {url})", {"source": url}
+
 
+class JSONRAGChroma(ChromaSynthesisMixin, ChromaArtifactMixin):
+    # from_artifact() serves dense search only; the BM25 index lives beside a Chroma store
+    _artifact_defaults = {"max_tokens": 250, "search_mode": "dense", "score_kind": "distance", "bm25": None,
+                          "lexical_cutoff": None, "candidates": 50, "prefilter": False, "rrf_k": 60,
+                          "dedup_report": None}
 
-class JSONRAGChroma:
     def __init__(
         self,
         kb_file: str,
@@ -18,115 +60,205 @@ class JSONRAGChroma:
         use_llm: bool = False,
         llm_model: str = "gpt-4o-mini",
         collection_name: str = "rag_collection",
-        persist_path: str = "./multianswer"
+        persist_path: str = "./multianswer",
+        answer_cache=None,  # SemanticAnswerCache shared across agents
+        batch_size: int = 1000,  # records per encode + upsert
+        progress=None,  # e.g. kbstream.ProgressPrinter()
+        search_mode: str = "dense",  # "dense", "lexical" (BM25 only), "hybrid"
+        lexical_cutoff: float | None = 0.8,  # hybrid: skip the dense query if lexical top_k all cover this much of the query
+        candidates: int = 50,  # hybrid: hits taken from each side before fusion
+        prefilter: bool = False,  # hybrid: dense-rank only the lexical candidates
+        rrf_k: int = 60,
+        build_workers: int = 0,  # > 1: embed new records in that many worker processes
+        dedup_threshold: float | None = None  # collapse records with MinHash Jaccard >= this (e.g. 0.8)
     ):
         if answer_fields is None:
             answer_fields = ["answer_chatgpt"]
-
-        # Load KB from JSON
-        with open(kb_file, "r", encoding="utf-8") as f:
-            raw = json.load(f)
-
-        records, sources = [], []
-
-        for row in raw:
-            q = row.get("input", "").strip()
-            if not q:
-                continue
-
-            if mode == "single":
-                a = row.get(answer_fields[0], "").strip()
-                if a:
-                    records.append(f"Q: {q}\nA: {a}")
-                    sources.append("json")
-
-            elif mode == "concat":
-                answers = [row.get(f, "").strip() for f in answer_fields if row.get(f)]
-                if answers:
-                    a = " | ".join(answers)
-                    records.append(f"Q: {q}\nA: {a}")
-                    sources.append("json")
-
-            elif mode == "multi":
-                for f in answer_fields:
-                    a = row.get(f, "").strip()
-                    if a:
-                        records.append(f"Q: {q}\nA ({f}): {a}")
-                        sources.append(f)
-
-        # Add URLs as extra entries
-        if urls:
-            for text, url in urls:
-                records.append(f"{text} (Source: {url})")
-                sources.append(url)
+        if search_mode not in ("dense", "lexical", "hybrid"):
+            raise ValueError(f"unknown search_mode: {search_mode!r}")
+
+        # KB rows are streamed from disk straight into the sync, batch by batch.
+        # Dedup reads the KB twice: signatures first, then the surviving records
+        make_records = lambda: iter_records(iter_kb_rows(kb_file), mode, answer_fields, urls)
+        self.dedup_report = None
+        if dedup_threshold is not None:
+            records, self.dedup_report, _ = collapse_records(make_records, dedup_threshold)
+            metrics.gauge("rag_dedup_removed", self.dedup_report.removed, agent="JSONRAGChroma")
+        else:
+            records = make_records()
 
         # Embedding model
-        self.model = SentenceTransformer(model_name)
+        self.model_name = model_name
+        self.model = get_model(model_name, lazy=True)
 
         # Init Chroma
+        import chromadb
         self.client = chromadb.PersistentClient(path=persist_path)
-        self.collection = self.client.get_or_create_collection(name=collection_name)
-
-        # Only populate once
-        if self.collection.count() == 0:
-            embeddings = self.model.encode(records, convert_to_numpy=True).tolist()
-            self.collection.add(
-                documents=records,
-                embeddings=embeddings,
-                metadatas=[{"source": s} for s in sources],
-                ids=[str(i) for i in range(len(records))]
+        self.collection = open_collection(self.client, collection_name, registry.variant(model_name))
+
+        # BM25 index lives next to the collection and follows every sync write;
+        # an existing one is kept current even in dense mode so it never goes stale
+        bm25_path = os.path.join(persist_path, f"{collection_name}.bm25.json")
+        self.bm25 = BM25Index(bm25_path) if search_mode != "dense" or os.path.exists(bm25_path) else None
+        on_upsert = on_delete = None
+        if self.bm25 is not None:
+            on_upsert = lambda batch: self.bm25.add((rid, doc) for rid, doc, _ in batch)
+            on_delete = self.bm25.remove
+
+        # Embed/upsert only new or changed records, drop ones no longer in the source.
+        # With build_workers each batch is split across worker processes, so
+        # batches grow to give every worker a few hundred records.
+        encoder = self.model
+        if build_workers > 1:
+            encoder = ParallelEncoder(model_name, workers=build_workers,
+                                      work_dir=os.path.join(persist_path, "shards"))
+            batch_size = max(batch_size, build_workers * 256)
+        try:
+            self.sync_report = sync_collection(
+                self.collection, encoder, records,
+                batch_size=min(batch_size, self.client.get_max_batch_size()), progress=progress,
+                on_upsert=on_upsert, on_delete=on_delete
             )
+        finally:
+            if encoder is not self.model:
+                encoder.close()
+        if self.bm25 is not None:
+            # First build over an existing collection, or a sync that died midway
+            if len(self.bm25) != self.collection.count():
+                self.bm25.reconcile(self.collection)
+            self.bm25.save()
+
+        self.search_mode = search_mode
+        self.lexical_cutoff = lexical_cutoff
+        self.candidates = candidates
+        self.prefilter = prefilter
+        self.rrf_k = rrf_k
+        # Third element of every hit: Chroma distance (dense) or a [0, 1] score
+        self.score_kind = "distance" if search_mode == "dense" else "score"
 
         self.top_k = top_k
         self.use_llm = use_llm
         self.llm_model = llm_model
+        self.answer_cache = answer_cache
+        self.max_tokens = 250
+        metrics.gauge("rag_kb_entries", self.collection.count(), agent="JSONRAGChroma")
 
-        if use_llm:
-            load_dotenv()
-            self.client_llm = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    def close(self):
+        """Hand the shared embedding model back to the registry."""
+        if self.model is not None:
+            release_model(self.model_name)
+            self.model = None
 
-    def retrieve(self, query: str):
-        """Retrieve top_k relevant docs for a single query."""
-        q_vec = self.model.encode([query], convert_to_numpy=True)[0].tolist()
-        results = self.collection.query(query_embeddings=[q_vec], n_results=self.top_k)
+    def _dense(self, q_vec, n, ids=None):
+        with metrics.timer("search", agent="JSONRAGChroma"):
+            results = self.collection.query(query_embeddings=[q_vec.tolist()], n_results=n, ids=ids)
 
         docs = results["documents"][0] # type: ignore
         metas = results["metadatas"][0] # type: ignore
         sims = results["distances"][0] # type: ignore
-        return list(zip(docs, metas, sims))
+        return results["ids"][0], list(zip(docs, metas, sims))
+
+    def _lexical(self, query: str, n: int):
+        """BM25 (id, score in [0, 1], coverage) triples; score 1.0 ~ every query term present once."""
+        with metrics.timer("lexical", agent="JSONRAGChroma"):
+            found = self.bm25.search(query, n)
+        full = self.bm25.full_match_score(query) or 1.0
+        return [(rid, min(score / full, 1.0), cover) for rid, score, cover in found]
+
+    def _fetch(self, scored):
+        """Hits for (id, score) pairs, looked up by id without touching the embedding model."""
+        if not scored:
+            return [], []
+        ids = [rid for rid, _ in scored]
+        got = self.collection.get(ids=ids, include=["documents", "metadatas"])
+        by_id = {rid: (doc, meta) for rid, doc, meta in zip(got["ids"], got["documents"], got["metadatas"])}  # type: ignore
+        pairs = [(rid, s) for rid, s in scored if rid in by_id]
+        return [rid for rid, _ in pairs], [(*by_id[rid], s) for rid, s in pairs]
+
+    def _lookup(self, query: str):
+        """Query embedding (None if never computed), hits and hit ids for a single query."""
+        if self.search_mode == "dense":
+            return self._lookup_batch([query])[0]
+        q_vec, hits, ids = self._lookup_mixed(query)
+        if not hits:
+            metrics.inc("rag_empty_results_total", agent="JSONRAGChroma")
+        return q_vec, hits, ids
+
+    def _lookup_mixed(self, query: str):
+        if self.search_mode == "lexical":
+            ids, hits = self._fetch([(rid, s) for rid, s, _ in self._lexical(query, self.top_k)])
+            return None, hits, ids
+
+        # Hybrid: when the top lexical hits contain (nearly) every query term -
+        # exact drug names and the like - skip the embedding forward pass
+        lexical = self._lexical(query, max(self.candidates, self.top_k))
+        if (self.lexical_cutoff is not None and len(lexical) >= self.top_k
+                and min(cover for _, _, cover in lexical[:self.top_k]) >= self.lexical_cutoff):
+            metrics.inc("rag_lexical_short_circuit_total", agent="JSONRAGChroma")
+            ids, hits = self._fetch([(rid, s) for rid, s, _ in lexical[:self.top_k]])
+            return None, hits, ids
+
+        with metrics.timer("encode", agent="JSONRAGChroma"):
+            q_vec = self._encode_queries([query])[0]
+        if self.prefilter and lexical:
+            dense_ids, _ = self._dense(q_vec, min(self.top_k, len(lexical)), ids=[rid for rid, _, _ in lexical])
+        else:
+            dense_ids, _ = self._dense(q_vec, self.candidates)
+
+        # Reciprocal rank fusion, rescaled so a top hit on both sides scores 1.0
+        fused = {}
+        for ranked in (dense_ids, [rid for rid, _, _ in lexical]):
+            for rank, rid in enumerate(ranked):
+                fused[rid] = fused.get(rid, 0.0) + (self.rrf_k + 1) / (2 * (self.rrf_k + rank + 1))
+        best = sorted(fused.items(), key=lambda kv: kv[1], reverse=True)[:self.top_k]
+        ids, hits = self._fetch(best)
+        return q_vec, hits, ids
+
+    def retrieve(self, query: str):
+        """Retrieve top_k relevant docs for a single query."""
+        return self._lookup(query)[1]
+
+    def _lookup_batch(self, queries: list[str]):
+        """(query embedding, hits, hit ids) per query; dense mode encodes and queries once."""
+        if self.search_mode != "dense":
+            return [self._lookup(q) for q in queries]
+        return super()._lookup_batch(queries)
 
     def retrieve_batch(self, queries: list[str]):
         """Retrieve results for multiple queries at once."""
-        q_vecs = self.model.encode(queries, convert_to_numpy=True).tolist()
-        results = self.collection.query(query_embeddings=q_vecs, n_results=self.top_k)
-        all_hits = []
-        for i, q in enumerate(queries):
-            docs = results["documents"][i] # pyright: ignore[reportOptionalSubscript]
-            metas = results["metadatas"][i] # pyright: ignore[reportOptionalSubscript]
-            sims = results["distances"][i] # pyright: ignore[reportOptionalSubscript]
-            hits = list(zip(docs, metas, sims))
-            all_hits.append((q, hits))
-        return all_hits
+        return [(q, hits) for q, (_, hits, _) in zip(queries, self._lookup_batch(queries))]
 
     def answer(self, query: str):
-        hits = self.retrieve(query)
+        return self._answer_cached(query, *self._lookup(query))
+
+    def answer_from_hits(self, query: str, hits):
+        """Build the final response from already-retrieved hits."""
         if not hits:
             return "No relevant entries found."
 
         if not self.use_llm:
             return "\n---\n".join(
-                f"{doc}\n(source: {meta['source']}, distance: {dist:.2f})"
+                f"{doc}\n(source: {meta['source']}, {self.score_kind}: {dist:.2f})"
                 for doc, meta, dist in hits
             )
 
         # --- LLM synthesis ---
-        context_blocks, source_links = [], []
-        for doc, meta, _ in hits:
-            context_blocks.append(doc)
-            if meta["source"].startswith("http"):
-                source_links.append(meta["source"])
+        with metrics.timer("prompt", agent="JSONRAGChroma"):
+            prompt = self._build_prompt(query, hits)
+        with metrics.timer("llm", agent="JSONRAGChroma"):
+            resp = self.client_llm.chat.completions.create(
+                model=self.llm_model,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.2,
+                max_tokens=self.max_tokens,
+            )
+        metrics.usage(resp, agent="JSONRAGChroma", model=self.llm_model)
+        return resp.choices[0].message.content.strip() # type: ignore
 
-        context = "\n\n".join(context_blocks)
+    def _build_prompt(self, query: str, hits):
+        ctx = self._context(hits)
+        context = ctx.text
+        source_links = [s for s in ctx.sources if s.startswith("http")]
         sources_text = "\n".join(source_links) if source_links else "No external URLs retrieved."
 
         prompt = f"""
@@ -148,14 +280,7 @@ Sources:
 
 Final answer:
 """
-
-        resp = self.client_llm.chat.completions.create(
-            model=self.llm_model,
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.2,
-            max_tokens=250,
-        )
-        return resp.choices[0].message.content.strip() # type: ignore
+        return prompt
 
 
 # -----------------------
@@ -1,57 +1,268 @@
-import json
 import os
 import numpy as np
-from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
-from openai import OpenAI
-from dotenv import load_dotenv
+from modelregistry import get_model, registry, release_model
+from synthesis import SynthesisMixin
+from embeddingcache import EmbeddingCache, entry_hash
+from indexartifact import IndexArtifact, file_digest, write_artifact
+from kbstream import iter_kb_rows
+from parallelbuild import ParallelEncoder
+from metrics import metrics
+from vectorindex import BACKENDS, ExactIndex, HNSWIndex, index_report
 
-load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+class RAGAgent(SynthesisMixin):
+    artifact = None
 
-class RAGAgent:
     def __init__(self, kb_file, answer_field="answer_chatgpt",
                  top_k=3, threshold=0.3, model_name="multi-qa-mpnet-base-dot-v1",
-                 use_llm=False, llm_model="gpt-4o-mini"):
+                 use_llm=False, llm_model="gpt-4o-mini", cache_dir="./embcache",
+                 answer_cache=None, progress=None, index_dtype="float32", rescore=True,
+                 index_backend="exact", hnsw_params=None, build_workers=0):
         """
         kb_file: JSON file with [{"input": "...", "answer_chatgpt": "...", ...}]
         answer_field: which answer field to use ("answer_chatgpt", "answer_icliniq", etc.)
         use_llm: whether to synthesize a final answer using LLM
         llm_model: which OpenAI model to use for synthesis
+        cache_dir: on-disk embedding cache; only new/changed entries get encoded (None disables)
+        answer_cache: optional SemanticAnswerCache for synthesized answers
+        progress: optional callback(scanned, embedded, final=False), e.g. kbstream.ProgressPrinter()
+        index_dtype: "float32", or compact "float16" / "int8" (per-vector scales) search copies
+        rescore: re-rank compact-index candidates against the float32 vectors
+        index_backend: "exact" scan, or "hnsw" approximate search (hnswlib). With cache_dir
+            the HNSW graph is saved next to kb_file and updated incrementally on restart
+        hnsw_params: optional dict of HNSWIndex options (M, ef_construction, ef)
+        build_workers: > 1 embeds the KB in that many worker processes (parallelbuild);
+            with cache_dir, finished shards survive a crash under <cache_dir>/shards
         """
-        with open(kb_file, "r", encoding="utf-8") as f:
-            raw_entries = json.load(f)
-
+        if index_backend not in BACKENDS:
+            raise ValueError(f"index_backend must be one of {BACKENDS}, got {index_backend!r}")
+        if index_backend == "hnsw" and index_dtype != "float32":
+            raise ValueError("the hnsw backend stores float32 vectors only")
+        self.kb_file = kb_file
+        self.answer_field = answer_field
+        # Rows are streamed; only the formatted entries are kept
         self.kb_entries = []
-        for row in raw_entries:
+        for row in iter_kb_rows(kb_file):
             q = row.get("input", "").strip()
             a = row.get(answer_field, "").strip()
             if q and a:
                 self.kb_entries.append(f"Q: {q}\nA: {a}")
 
         # Embedding model
-        self.model = SentenceTransformer(model_name)
-        self.embedded_kb = self.model.encode(
-            self.kb_entries, convert_to_numpy=True, show_progress_bar=True
-        )
+        self.model_name = model_name
+        self.model = get_model(model_name, lazy=True)
+        encoder, flush_every = self.model, 4096
+        if build_workers > 1:
+            encoder = ParallelEncoder(model_name, workers=build_workers,
+                                      work_dir=os.path.join(cache_dir, "shards") if cache_dir else None)
+            flush_every = max(flush_every, build_workers * encoder.shard_size)
+        try:
+            if cache_dir:
+                self.embedding_cache = EmbeddingCache(cache_dir, registry.variant(model_name))
+                self.kb_rows = self.embedding_cache.encode_rows(
+                    encoder, self.kb_entries, show_progress_bar=progress is None,
+                    flush_every=flush_every, progress=progress
+                )
+                self.embedded_kb = self.embedding_cache.take(self.kb_rows)
+            else:
+                self.embedding_cache = None
+                self.kb_rows = None
+                self.embedded_kb = encoder.encode(
+                    self.kb_entries, convert_to_numpy=True, show_progress_bar=True
+                )
+        finally:
+            if encoder is not self.model:
+                encoder.close()
+
+        self.index_backend = index_backend
+        self.index_dtype = index_dtype
+        self.rescore = rescore
+        if index_backend == "hnsw":
+            self.index = self._build_hnsw(kb_file, hnsw_params or {})
+        else:
+            self._build_exact()
 
         self.top_k = top_k
         self.threshold = threshold
         self.use_llm = use_llm
         self.llm_model = llm_model
-        if use_llm:
-            self.client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))  
+        self.answer_cache = answer_cache
+        self.max_tokens = 250
+        metrics.gauge("rag_kb_entries", len(self.kb_entries), agent="RAGAgent")
+
+    @classmethod
+    def from_artifact(cls, path, top_k=3, threshold=0.3, use_llm=False, llm_model="gpt-4o-mini",
+                      answer_cache=None, index_dtype="float32", rescore=True, verify=False):
+        """
+        Serve a prebuilt artifact (see export_artifact) without reading the KB or
+        embedding anything: entries and vectors stay memory-mapped in the file.
+        """
+        art = IndexArtifact(path, verify=verify)
+        art.check_model()
+        self = cls.__new__(cls)
+        self.artifact = art
+        self.kb_file = art.source.get("kb_file", path)
+        self.answer_field = art.source.get("answer_field")
+        self.kb_entries = art.documents
+        self.model_name = art.model
+        self.model = get_model(art.model, lazy=True)
+        self.embedding_cache = None
+        self.kb_rows = None
+        self.embedded_kb = art.vectors
+        self.index_backend = "exact"
+        self.index_dtype = index_dtype
+        self.rescore = rescore
+        self.index = ExactIndex(art.vectors, dtype=index_dtype, rescore=rescore, inv_norms=art.inv_norms())
+        self.top_k = top_k
+        self.threshold = threshold
+        self.use_llm = use_llm
+        self.llm_model = llm_model
+        self.answer_cache = answer_cache
+        self.max_tokens = 250
+        metrics.gauge("rag_kb_entries", len(self.kb_entries), agent="RAGAgent")
+        return self
+
+    def export_artifact(self, path):
+        """Write entries, their vectors and the KB's provenance to one artifact file."""
+        self._require_float32()
+        source = {"kb_file": os.path.basename(self.kb_file), "answer_field": self.answer_field}
+        if os.path.exists(self.kb_file) and self.artifact is None:
+            source["kb_blake2b"] = file_digest(self.kb_file)
+        return write_artifact(
+            path, self.embedded_kb, [entry_hash(e).hex() for e in self.kb_entries], self.kb_entries,
+            ({"source": "json", "answer_field": self.answer_field} for _ in range(len(self.kb_entries))),
+            self.model_name, registry.variant(self.model_name), source,
+        )
+
+    def _require_float32(self):
+        if self.embedded_kb is None:
+            raise ValueError(
+                f"float32 vectors were dropped: index_dtype={self.index_dtype!r} with rescore=False keeps "
+                "only the compact codes unless the vectors are memory-mapped from cache_dir; "
+                "use rescore=True or a cache_dir"
+            )
+
+    def _build_exact(self):
+        # Inverse norms / compact codes are computed once, so the (possibly
+        # memory-mapped) KB matrix is never re-normalized per query
+        self.index = ExactIndex(self.embedded_kb, dtype=self.index_dtype, rescore=self.rescore)
+        if self.index_dtype != "float32" and not self.rescore and not isinstance(self.embedded_kb, np.memmap):
+            # Nothing reads the float32 copy any more; keep only the compact one
+            self.index.vectors = self.embedded_kb = None
+
+    def _build_hnsw(self, kb_file, params):
+        dim = self.embedded_kb.shape[1] if len(self.kb_entries) else self.model.get_sentence_embedding_dimension()
+        if self.embedding_cache is None:
+            # Positions are the only labels we have; they are not stable, so no persistence
+            index = HNSWIndex(dim, **params)
+            index.sync(self.embedded_kb, np.arange(len(self.kb_entries)))
+            return index
+
+        # Labels are cache rows; the cache is append-only, so a saved graph stays
+        # valid as long as the key rows it was built against are unchanged
+        index = HNSWIndex(
+            dim, path=f"{kb_file}.{registry.variant(self.model_name).replace('/', '__')}.hnsw",
+            key=self._cache_key(), key_ok=self._cache_key_ok, **params
+        )
+        index.sync(self.embedded_kb, self.kb_rows)
+        if index.dirty:
+            index.save()
+        return index
+
+    def _cache_key(self):
+        n = len(self.embedding_cache)
+        return f"{n}:{self.embedding_cache.keys_digest(n)}"
+
+    def _cache_key_ok(self, key):
+        n, digest = (key or "0:").split(":")
+        return int(n) <= len(self.embedding_cache) and self.embedding_cache.keys_digest(int(n)) == digest
+
+    def add_entries(self, entries):
+        """Embed and index new KB entries in place, without rebuilding the whole index."""
+        entries = [e for e in entries if e]
+        if not entries:
+            return
+        if self.artifact is not None:
+            raise ValueError("agents opened from an artifact are read-only; rebuild the artifact instead")
+        if self.index_backend == "exact":
+            self._require_float32()
+        if self.embedding_cache is not None:
+            rows = self.embedding_cache.encode_rows(self.model, entries)
+            new_vecs = self.embedding_cache.take(rows)
+            self.kb_rows = np.concatenate([self.kb_rows, rows])
+        else:
+            rows = np.arange(len(self.kb_entries), len(self.kb_entries) + len(entries))
+            new_vecs = self.model.encode(entries, convert_to_numpy=True)
+        self.kb_entries.extend(entries)
+        metrics.gauge("rag_kb_entries", len(self.kb_entries), agent="RAGAgent")
+
+        if self.embedded_kb is not None:
+            self.embedded_kb = (self.embedding_cache.take(self.kb_rows) if self.embedding_cache is not None
+                                else np.concatenate([self.embedded_kb, new_vecs]))
+        if self.index_backend == "hnsw":
+            self.index.add(new_vecs, rows)
+            if self.embedding_cache is not None:
+                self.index.key = self._cache_key()
+                self.index.save()
+        else:
+            self._build_exact()
+
+    @property
+    def client(self):
+        """Former name of the OpenAI client attribute."""
+        return self.client_llm
+
+    def close(self):
+        """Hand the shared embedding model back to the registry."""
+        if self.model is not None:
+            release_model(self.model_name)
+            self.model = None
+
+    def _hits(self, idx, scores):
+        return [(self.kb_entries[i], s) for i, s in zip(idx, scores)]
+
+    def _lookup(self, query):
+        """Query embedding, hits and hit ids (entry content hashes) for one query"""
+        return self._lookup_batch([query])[0]
 
     def retrieve(self, query):
         """Retrieve top-k relevant KB entries"""
-        q_vec = self.model.encode([query], convert_to_numpy=True)
-        sims = cosine_similarity(q_vec, self.embedded_kb)[0]
-        top_indices = [i for i in np.argsort(sims)[::-1] if sims[i] >= self.threshold][:self.top_k]
-        return [(self.kb_entries[i], sims[i]) for i in top_indices]
+        return self._lookup(query)[1]
+
+    def _lookup_batch(self, queries, chunk_size=256):
+        """(query embedding, hits, hit ids) per query, one matrix multiply per chunk."""
+        with metrics.timer("encode", agent="RAGAgent"):
+            q_vecs = self._encode_queries(queries)
+        out = []
+        for start in range(0, len(queries), chunk_size):
+            chunk = q_vecs[start:start + chunk_size]
+            with metrics.timer("search", agent="RAGAgent"):
+                found = self.index.search(chunk, self.top_k, self.threshold)
+            for q_vec, (idx, scores) in zip(chunk, found):
+                if len(idx) == 0:
+                    metrics.inc("rag_empty_results_total", agent="RAGAgent")
+                out.append((q_vec, self._hits(idx, scores), [entry_hash(self.kb_entries[i]).hex() for i in idx]))
+        return out
+
+    def retrieve_batch(self, queries, chunk_size=256):
+        """Retrieve results for multiple queries, one matrix multiply per chunk."""
+        return [(q, hits) for q, (_, hits, _) in zip(queries, self._lookup_batch(queries, chunk_size))]
+
+    def index_report(self, queries, k=None):
+        """Memory saved and recall@k of the configured index vs. a float32 scan."""
+        self._require_float32()
+        q_vecs = self._encode_queries(queries)
+        baseline = ExactIndex(self.embedded_kb)
+        return index_report(self.index, baseline, q_vecs, k or self.top_k)
 
     def handle(self, query):
-        retrieved = self.retrieve(query)
+        return self._answer_cached(query, *self._lookup(query))
 
+    def handle_batch(self, queries):
+        """Answer many queries; retrieval for all of them is batched."""
+        return [self.answer_from_hits(q, hits) for q, hits in self.retrieve_batch(queries)]
+
+    def answer_from_hits(self, query, retrieved):
+        """Build the final response from already-retrieved entries."""
         if not retrieved:
             return "No relevant entries found."
 
@@ -59,8 +270,21 @@ class RAGAgent:
             # Return raw retrieved Q&A
             return "\n---\n".join(f"{text} (score: {score:.2f})" for text, score in retrieved)
 
-        # Prepare prompt for synthesis
-        context = "\n\n".join(text for text, _ in retrieved)
+        with metrics.timer("prompt", agent="RAGAgent"):
+            prompt = self._build_prompt(query, retrieved)
+        with metrics.timer("llm", agent="RAGAgent"):
+            response = self.client_llm.chat.completions.create(
+                model=self.llm_model,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.2,
+                max_tokens=self.max_tokens
+            )
+        metrics.usage(response, agent="RAGAgent", model=self.llm_model)
+        return response.choices[0].message.content.strip() # type: ignore
+
+    def _build_prompt(self, query, retrieved):
+        """Synthesis prompt for the LLM"""
+        context = self._context(retrieved).text
         prompt = f"""
 You are a helpful medical assistant.
 Use the following retrieved Q&A information to answer the user’s question clearly and concisely.
@@ -76,14 +300,7 @@ Retrieved info:
 
 Final answer:
 """
-
-        response = self.client.chat.completions.create(
-            model=self.llm_model,
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.2,
-            max_tokens=250
-        )
-        return response.choices[0].message.content.strip() # type: ignore
+        return prompt
 
 
 # -----------------------
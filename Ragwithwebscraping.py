@@ -1,34 +1,245 @@
-import os
-import requests
-from bs4 import BeautifulSoup
-from sentence_transformers import SentenceTransformer
-from dotenv import load_dotenv
-from openai import OpenAI
-import chromadb
-from typing import Optional
+import logging
+import queue
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+from htmlchunks import TextExtractor, iter_html_chunks
+from modelregistry import get_model, registry, release_model
+from synthesis import ChromaSynthesisMixin
+from chromasync import open_collection, sync_collection
+from indexartifact import ChromaArtifactMixin
+from metrics import metrics
+from typing import Optional, TYPE_CHECKING
 
+if TYPE_CHECKING:
+    import requests
 
-def fetch_page_text(url: str, max_chars: int = 3000) -> str:
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+log = logging.getLogger("rag.scrape")
+
+
+class PageFetcher:
+    """
+    Concurrent page downloader.
+    One keep-alive connection pool shared by all workers, at most per_host
+    requests in flight per host, retries with exponential backoff.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = 8,
+        per_host: int = 2,
+        retries: int = 3,
+        backoff: float = 0.5,
+        timeout: float = 10,
+        session: Optional["requests.Session"] = None
+    ):
+        self.max_workers = max_workers
+        self.per_host = per_host
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+
+        if session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+        self.session = session
+
+        self._host_slots = {}
+        self._lock = threading.Lock()
+        self.failed = {}  # url -> last error
+        self.truncated = {}  # url -> chars kept
+
+    def _slot(self, url: str):
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in self._host_slots:
+                self._host_slots[host] = threading.BoundedSemaphore(self.per_host)
+            return self._host_slots[host]
+
+    def stream_text(self, url: str, chunk_size: int = 16384):
+        """
+        Yield the decoded page body piece by piece.
+        Retries only happen before the first piece is handed out. A failure is
+        recorded in self.failed and returned as the generator's value; a
+        success clears any earlier failure of the url.
+        """
+        import requests
+
+        error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            started = False
+            try:
+                with self._slot(url):
+                    with self.session.get(url, timeout=self.timeout, stream=True) as resp:
+                        if resp.status_code in RETRY_STATUSES:
+                            error = f"HTTP {resp.status_code}"
+                            continue
+                        resp.raise_for_status()
+                        resp.encoding = resp.encoding or "utf-8"
+                        for piece in resp.iter_content(chunk_size, decode_unicode=True):
+                            started = True
+                            yield piece
+                with self._lock:
+                    self.failed.pop(url, None)
+                return None
+            except requests.RequestException as e:
+                error = str(e)
+                # A half-read body cannot be retried, and 4xx other than 429 will not get better
+                if started or (e.response is not None and e.response.status_code not in RETRY_STATUSES):
+                    break
+        with self._lock:
+            self.failed[url] = error
+        return error
+
+    def _read_into(self, url: str, write, max_chars: Optional[int] = None):
+        """Stream the body of url into write(); None on success, else the error."""
+        size = 0
+        stream = self.stream_text(url)
+        try:
+            while True:
+                piece = next(stream)
+                if max_chars is not None and size + len(piece) > max_chars:
+                    write(piece[:max_chars - size])
+                    with self._lock:
+                        self.truncated[url] = max_chars
+                    log.warning("%s: page cut at %d characters", url, max_chars)
+                    return None
+                write(piece)
+                size += len(piece)
+        except StopIteration as stop:
+            return stop.value
+        finally:
+            stream.close()
+
+    def fetch(self, url: str, max_chars: Optional[int] = None) -> Optional[str]:
+        """
+        Return the page HTML (at most max_chars of it; cut pages are logged and
+        listed in self.truncated), or None once all retries are used up.
+        """
+        pieces = []
+        error = self._read_into(url, pieces.append, max_chars)
+        return None if error is not None else "".join(pieces)
+
+    def spool(self, url: str, max_chars: Optional[int] = None, memory_chars: int = 1 << 20):
+        """
+        Download url into a temporary file that stays in memory up to
+        memory_chars and moves to disk beyond that, rewound for reading; None
+        once all retries are used up. The host slot and the connection are
+        released before it returns.
+        """
+        f = tempfile.SpooledTemporaryFile(max_size=memory_chars, mode="w+", encoding="utf-8", errors="replace")
+        error = self._read_into(url, f.write, max_chars)
+        if error is not None:
+            f.close()
+            return None
+        f.seek(0)
+        return f
+
+
+def fetch_page_text(url: str, max_chars: int = 3000) -> Optional[str]:
+    """Fetch and clean a single page; None if it could not be fetched."""
+    html = PageFetcher(max_workers=1).fetch(url)
+    if html is None:
+        return None
+    parser = TextExtractor()
+    parser.feed(html)
+    parser.close()
+    return " ".join(parser.pop_text().split())[:max_chars]
+
+
+def fetch_chunks(urls: list[str], fetcher: Optional[PageFetcher] = None,
+                 chunk_chars: int = 800, overlap: int = 150, queue_size: int = 256,
+                 parse_workers: int = 2, max_page_chars: Optional[int] = None,
+                 spool_chars: int = 1 << 20):
     """
-    Fetch and clean webpage text.
-    Truncate to max_chars for efficiency.
+    Fetch urls concurrently and yield (url, chunk, offset) as pages are parsed.
+    Fetch workers only download: a page body is streamed into a spool file
+    (in memory up to spool_chars, on disk beyond), which frees its host slot
+    and pooled connection before parsing starts. parse_workers threads read
+    spooled pages back piece by piece through the incremental parser, so no
+    page sits in memory whole, and a slow consumer or a heavy page holds up
+    parsing, never another download. At most max_workers + parse_workers pages
+    are spooled at once. Pages over max_page_chars are cut (logged, and listed
+    in fetcher.truncated); failed URLs end up in fetcher.failed.
     """
-    try:
-        resp = requests.get(url, timeout=10)
-        resp.raise_for_status()
-        soup = BeautifulSoup(resp.text, "html.parser")
+    fetcher = fetcher or PageFetcher()
+    out = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    done = object()
+    buffered = threading.Semaphore(fetcher.max_workers + parse_workers)
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                out.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def fail(url, error):
+        with fetcher._lock:
+            fetcher.failed[url] = str(error)
 
-        # Remove scripts, styles
-        for tag in soup(["script", "style", "noscript"]):
-            tag.decompose()
+    def parse(url, page):
+        try:
+            with page:
+                pieces = iter(lambda: page.read(16384), "")
+                for chunk, offset in iter_html_chunks(pieces, chunk_chars, overlap):
+                    if not put((url, chunk, offset)):
+                        return
+        except Exception as e:
+            fail(url, e)
+        finally:
+            buffered.release()
+            put(done)
 
-        text = " ".join(soup.get_text(separator=" ").split())
-        return text[:max_chars]  # limit size
-    except Exception as e:
-        return f"Failed to fetch {url}: {e}"
+    def download(url):
+        while not buffered.acquire(timeout=0.1):
+            if stop.is_set():
+                return
+        try:
+            page = None if stop.is_set() else fetcher.spool(url, max_page_chars, spool_chars)
+        except Exception as e:
+            fail(url, e)
+            page = None
+        if page is None:
+            buffered.release()
+            put(done)
+        else:
+            parse_pool.submit(parse, url, page)
 
+    with ThreadPoolExecutor(max_workers=parse_workers) as parse_pool, \
+            ThreadPoolExecutor(max_workers=fetcher.max_workers) as fetch_pool:
+        for url in urls:
+            fetch_pool.submit(download, url)
+        try:
+            remaining = len(urls)
+            while remaining:
+                item = out.get()
+                if item is done:
+                    remaining -= 1
+                    continue
+                yield item
+        finally:
+            # Unblock workers if the consumer stops early
+            stop.set()
+
+
+class ScrapeChroma(ChromaSynthesisMixin, ChromaArtifactMixin):
+    _artifact_defaults = {"max_tokens": 300, "failed_urls": {}}
 
-class ScrapeChroma:
     def __init__(
         self,
         urls: list[str],  # list of URL strings
@@ -37,50 +248,74 @@ class ScrapeChroma:
         use_llm: bool = False,
         llm_model: str = "gpt-4o-mini",
         collection_name: str = "rag_urls",
-        persist_path: str = "./meddialog"
+        persist_path: str = "./meddialog",
+        refresh: bool = False,  # re-fetch URLs that are already indexed
+        fetcher: Optional[PageFetcher] = None,
+        chunk_chars: int = 800,
+        chunk_overlap: int = 150,
+        answer_cache=None  # SemanticAnswerCache shared across agents
     ):
         # Init embedding model
-        self.model = SentenceTransformer(model_name)
+        self.model_name = model_name
+        self.model = get_model(model_name, lazy=True)
 
         # Init Chroma
+        import chromadb
         self.client = chromadb.PersistentClient(path=persist_path)
-        self.collection = self.client.get_or_create_collection(name=collection_name)
-
-        # Only populate if empty
-        if self.collection.count() == 0:
-            docs, sources = [], []
-            for url in urls:
-                page_text = fetch_page_text(url)
-                docs.append(f"{page_text}\n(Source: {url})")
-                sources.append(url)
-
-            embeddings = self.model.encode(docs, convert_to_numpy=True).tolist()
-            self.collection.add(
-                documents=docs,
-                embeddings=embeddings,
-                metadatas=[{"source": s} for s in sources],
-                ids=[str(i) for i in range(len(docs))]
-            )
+        self.collection = open_collection(self.client, collection_name, registry.variant(model_name))
+
+        # Pages already indexed are kept as-is unless refresh is set;
+        # URLs dropped from the list are removed from the collection
+        present = self.collection.get(include=["metadatas"])
+        ids_by_source = {}
+        for rid, meta in zip(present["ids"], present["metadatas"] or []):
+            if meta and meta.get("source") in urls:
+                ids_by_source.setdefault(meta["source"], []).append(rid)
+
+        kept = set()
+        if not refresh:
+            kept.update(rid for rids in ids_by_source.values() for rid in rids)
+        urls_to_fetch = [u for u in urls if refresh or u not in ids_by_source]
+        fetcher = fetcher or PageFetcher()
+
+        def fetched():
+            for url, chunk, offset in fetch_chunks(urls_to_fetch, fetcher, chunk_chars, chunk_overlap):
+                yield f"{chunk}\n(Source: {url})", {"source": url, "offset": offset}
+            # A page that failed to re-fetch keeps its previously indexed copy
+            for url in fetcher.failed:
+                kept.update(ids_by_source.get(url, ()))
+
+        # Small batches so chunks are embedded and stored while pages are still streaming
+        self.sync_report = sync_collection(
+            self.collection, self.model, fetched(), batch_size=64, keep_ids=kept
+        )
+        self.failed_urls = dict(fetcher.failed)
 
         self.top_k = top_k
         self.use_llm = use_llm
         self.llm_model = llm_model
+        self.answer_cache = answer_cache
+        self.max_tokens = 300
+        metrics.gauge("rag_kb_entries", self.collection.count(), agent="ScrapeChroma")
 
-        if use_llm:
-            load_dotenv()
-            self.client_llm = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    def close(self):
+        """Hand the shared embedding model back to the registry."""
+        if self.model is not None:
+            release_model(self.model_name)
+            self.model = None
 
     def retrieve(self, query: str):
-        q_vec = self.model.encode([query], convert_to_numpy=True)[0].tolist()
-        results = self.collection.query(query_embeddings=[q_vec], n_results=self.top_k)
+        return self._lookup(query)[1]
 
-        docs = results["documents"][0] # type: ignore
-        metas = results["metadatas"][0] # type: ignore
-        sims = results["distances"][0] # type: ignore
-        return list(zip(docs, metas, sims))
+    def retrieve_batch(self, queries: list[str]):
+        """Retrieve results for multiple queries at once."""
+        return [(q, hits) for q, (_, hits, _) in zip(queries, self._lookup_batch(queries))]
 
     def answer(self, query: str):
-        hits = self.retrieve(query)
+        return self._answer_cached(query, *self._lookup(query))
+
+    def answer_from_hits(self, query: str, hits):
+        """Build the final response from already-retrieved hits."""
         if not hits:
             return "No relevant entries found."
 
@@ -91,13 +326,22 @@ class ScrapeChroma:
             )
 
         # --- LLM synthesis ---
-        context_blocks, source_links = [], []
-        for doc, meta, _ in hits:
-            context_blocks.append(doc)
-            if meta["source"].startswith("http"): # type: ignore
-                source_links.append(meta["source"])
+        with metrics.timer("prompt", agent="ScrapeChroma"):
+            prompt = self._build_prompt(query, hits)
+        with metrics.timer("llm", agent="ScrapeChroma"):
+            resp = self.client_llm.chat.completions.create(
+                model=self.llm_model,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.2,
+                max_tokens=self.max_tokens,
+            )
+        metrics.usage(resp, agent="ScrapeChroma", model=self.llm_model)
+        return resp.choices[0].message.content.strip() # type: ignore
 
-        context = "\n\n".join(context_blocks)
+    def _build_prompt(self, query: str, hits):
+        ctx = self._context(hits)
+        context = ctx.text
+        source_links = [s for s in ctx.sources if s.startswith("http")]
         sources_text = "\n".join(source_links) if source_links else "No external URLs retrieved."
 
         prompt = f"""
@@ -119,14 +363,7 @@ Sources:
 
 Final answer:
 """
-
-        resp = self.client_llm.chat.completions.create(
-            model=self.llm_model,
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.2,
-            max_tokens=300,
-        )
-        return resp.choices[0].message.content.strip() # type: ignore
+        return prompt
 
 
 # -----------------------
@@ -0,0 +1,140 @@
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+
+
+class SemanticAnswerCache:
+    """
+    LLM answer cache keyed on the query embedding plus the ids of the retrieved docs.
+
+    A lookup hits when an earlier query retrieved exactly the same docs and its
+    embedding has cosine similarity >= threshold with the new one, so answers go
+    stale automatically once the KB (and therefore the hit ids) changes.
+    Entries are evicted LRU beyond max_entries and after ttl seconds. With a path
+    the cache is persisted to SQLite and reloaded on start.
+    """
+
+    def __init__(self, path: str | None = None, threshold: float = 0.95,
+                 max_entries: int = 10000, ttl: float | None = None):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = OrderedDict()  # entry id -> (doc_key, unit vec, answer, created), LRU order
+        self._by_docs = {}             # doc_key -> set of entry ids
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS answers ("
+                "id INTEGER PRIMARY KEY, doc_key TEXT, vec BLOB, answer TEXT, created REAL, last_used REAL)"
+            )
+            self._db.commit()
+            self._load()
+
+    def _load(self):
+        rows = self._db.execute(
+            "SELECT id, doc_key, vec, answer, created FROM answers ORDER BY last_used"
+        ).fetchall()
+        for eid, doc_key, vec, answer, created in rows:
+            self._insert(eid, doc_key, np.frombuffer(vec, dtype=np.float32), answer, created)
+            self._next_id = max(self._next_id, eid + 1)
+        self._evict(time.time())
+
+    @staticmethod
+    def _doc_key(doc_ids, scope: str = "") -> str:
+        return scope + "\x1e" + "\x1f".join(str(i) for i in doc_ids)
+
+    @staticmethod
+    def _unit(q_vec) -> np.ndarray:
+        v = np.asarray(q_vec, dtype=np.float32).ravel()
+        return v / max(float(np.linalg.norm(v)), 1e-12)
+
+    def _insert(self, eid, doc_key, vec, answer, created):
+        self._entries[eid] = (doc_key, vec, answer, created)
+        self._by_docs.setdefault(doc_key, set()).add(eid)
+
+    def _remove(self, eids):
+        for eid in eids:
+            doc_key = self._entries.pop(eid)[0]
+            bucket = self._by_docs[doc_key]
+            bucket.discard(eid)
+            if not bucket:
+                del self._by_docs[doc_key]
+        if self._db and eids:
+            self._db.executemany("DELETE FROM answers WHERE id = ?", [(e,) for e in eids])
+            self._db.commit()
+
+    def _evict(self, now):
+        expired = []
+        if self.ttl is not None:
+            expired = [eid for eid, e in self._entries.items() if now - e[3] > self.ttl]
+        overflow = len(self._entries) - len(expired) - self.max_entries
+        if overflow > 0:
+            expired_set = set(expired)
+            expired += [eid for eid in self._entries if eid not in expired_set][:overflow]
+        self._remove(expired)
+
+    def get(self, q_vec, doc_ids, scope: str = ""):
+        """
+        Cached answer for a near-identical query over the same docs, else None.
+        scope separates answers that differ beyond query and docs (agent,
+        LLM model, prompt, token limit): only entries put with the same scope match.
+        """
+        doc_key = self._doc_key(doc_ids, scope)
+        unit = self._unit(q_vec)
+        now = time.time()
+        with self._lock:
+            best, best_sim = None, self.threshold
+            for eid in self._by_docs.get(doc_key, ()):
+                _, vec, _, created = self._entries[eid]
+                if self.ttl is not None and now - created > self.ttl:
+                    continue
+                sim = float(vec @ unit)
+                if sim >= best_sim:
+                    best, best_sim = eid, sim
+            if best is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(best)
+            if self._db:
+                self._db.execute("UPDATE answers SET last_used = ? WHERE id = ?", (now, best))
+                self._db.commit()
+            return self._entries[best][2]
+
+    def put(self, q_vec, doc_ids, answer: str, scope: str = ""):
+        doc_key = self._doc_key(doc_ids, scope)
+        unit = self._unit(q_vec)
+        now = time.time()
+        with self._lock:
+            eid = self._next_id
+            self._next_id += 1
+            self._insert(eid, doc_key, unit, answer, now)
+            if self._db:
+                self._db.execute(
+                    "INSERT INTO answers VALUES (?, ?, ?, ?, ?, ?)",
+                    (eid, doc_key, unit.tobytes(), answer, now, now),
+                )
+                self._db.commit()
+            self._evict(now)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self._entries),
+        }
+
+    def clear(self):
+        with self._lock:
+            self._remove(list(self._entries))
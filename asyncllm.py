@@ -0,0 +1,156 @@
+import asyncio
+import os
+import threading
+import time
+from metrics import metrics
+
+
+class RateLimiter:
+    """Token buckets for requests-per-minute and tokens-per-minute (None = unlimited)."""
+
+    def __init__(self, rpm: int | None = None, tpm: int | None = None):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._req = float(rpm or 0)
+        self._tok = float(tpm or 0)
+        self._stamp = time.monotonic()
+        # Plain lock: the limiter is shared by every event loop in the process
+        self._lock = threading.Lock()
+
+    def _wait_time(self, tokens: int) -> float:
+        with self._lock:
+            now = time.monotonic()
+            elapsed = now - self._stamp
+            self._stamp = now
+            if self.rpm:
+                self._req = min(self.rpm, self._req + elapsed * self.rpm / 60)
+            if self.tpm:
+                self._tok = min(self.tpm, self._tok + elapsed * self.tpm / 60)
+                # A single request bigger than the whole budget still has to go through
+                tokens = min(tokens, self.tpm)
+
+            wait = 0.0
+            if self.rpm and self._req < 1:
+                wait = max(wait, (1 - self._req) * 60 / self.rpm)
+            if self.tpm and self._tok < tokens:
+                wait = max(wait, (tokens - self._tok) * 60 / self.tpm)
+            if wait == 0.0:
+                if self.rpm:
+                    self._req -= 1
+                if self.tpm:
+                    self._tok -= tokens
+            return wait
+
+    async def acquire(self, tokens: int):
+        while True:
+            wait = self._wait_time(tokens)
+            if wait == 0.0:
+                return
+            await asyncio.sleep(wait)
+
+
+class AsyncLLM:
+    """
+    Shared async chat-completions client with bounded concurrency,
+    RPM/TPM rate limiting and a per-call timeout.
+    Honours OPENAI_API_KEY / OPENAI_BASE_URL, so it can point at any
+    server that speaks the OpenAI API.
+    """
+
+    def __init__(self, max_concurrency: int = 8, rpm: int | None = None, tpm: int | None = None,
+                 timeout: float = 30.0, api_key: str | None = None, base_url: str | None = None):
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.api_key = api_key or os.getenv("OPENAI_API_KEY")
+        self.base_url = base_url
+        self.limiter = RateLimiter(rpm, tpm)
+        # AsyncOpenAI connections and semaphores belong to one event loop
+        self._per_loop = {}
+
+    def _loop_state(self):
+        loop = asyncio.get_running_loop()
+        state = self._per_loop.get(loop)
+        if state is None:
+            for old in [l for l in self._per_loop if l.is_closed()]:
+                del self._per_loop[old]
+            from openai import AsyncOpenAI
+            client = AsyncOpenAI(api_key=self.api_key, base_url=self.base_url, timeout=self.timeout)
+            state = self._per_loop[loop] = (client, asyncio.Semaphore(self.max_concurrency))
+        return state
+
+    async def complete(self, prompt: str, model: str, max_tokens: int, temperature: float = 0.2,
+                       labels: dict | None = None) -> str:
+        """Completion text; labels are attached to the token-usage metrics."""
+        client, sem = self._loop_state()
+        # Rough prompt size (~4 chars/token) plus the completion budget
+        await self.limiter.acquire(len(prompt) // 4 + max_tokens)
+        async with sem:
+            resp = await asyncio.wait_for(
+                client.chat.completions.create(
+                    model=model,
+                    messages=[{"role": "user", "content": prompt}],
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                ),
+                self.timeout,
+            )
+        metrics.usage(resp, model=model, **(labels or {}))
+        return resp.choices[0].message.content.strip()  # type: ignore
+
+    async def stream(self, prompt: str, model: str, max_tokens: int, temperature: float = 0.2,
+                     labels: dict | None = None):
+        """Yield completion text pieces as they arrive; the timeout covers the wait for the stream."""
+        client, sem = self._loop_state()
+        await self.limiter.acquire(len(prompt) // 4 + max_tokens)
+        async with sem:
+            resp = await asyncio.wait_for(
+                client.chat.completions.create(
+                    model=model,
+                    messages=[{"role": "user", "content": prompt}],
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                ),
+                self.timeout,
+            )
+            async for chunk in resp:
+                if getattr(chunk, "usage", None):
+                    metrics.usage(chunk, model=model, **(labels or {}))
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+
+
+_shared = None
+_shared_sync = None
+_shared_lock = threading.Lock()
+
+
+def sync_client():
+    """Process-wide blocking OpenAI client, built (and .env read) on first use."""
+    global _shared_sync
+    with _shared_lock:
+        if _shared_sync is None:
+            from dotenv import load_dotenv
+            from openai import OpenAI
+            load_dotenv()
+            _shared_sync = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        return _shared_sync
+
+
+def shared_llm() -> AsyncLLM:
+    """Process-wide AsyncLLM configured from RAG_LLM_* environment variables."""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            from dotenv import load_dotenv
+            load_dotenv()
+            rpm = os.getenv("RAG_LLM_RPM")
+            tpm = os.getenv("RAG_LLM_TPM")
+            _shared = AsyncLLM(
+                max_concurrency=int(os.getenv("RAG_LLM_CONCURRENCY", "8")),
+                rpm=int(rpm) if rpm else None,
+                tpm=int(tpm) if tpm else None,
+                timeout=float(os.getenv("RAG_LLM_TIMEOUT", "30")),
+            )
+        return _shared
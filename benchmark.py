@@ -0,0 +1,492 @@
+"""
+Offline benchmark for the four RAG agents.
+
+Generates synthetic MedDialog-shaped KBs, serves URL pages from a local
+fixture server and answers LLM calls from a local OpenAI-compatible stub,
+so nothing leaves the machine. Per agent and KB size it records index
+build time, RSS growth, retrieve() p50/p95/p99 latency (query-embedding
+cache emptied first, plus a separate cache-hit run), retrieve_batch()
+throughput and end-to-end answer latency, plus the cold import time of the
+entry-point modules, and writes everything to
+bench_results/<timestamp>-<commit>.json. With --real-model --backends the
+embedding backends are also compared side by side (KB and query encode
+time, parity with the PyTorch baseline).
+
+    python benchmark.py --sizes 1000,100000 --agents rag,json-single
+    python benchmark.py --real-model --backends torch,onnx,onnx-int8 --threads 4
+    python benchmark.py --compare bench_results/old.json
+"""
+import argparse
+import hashlib
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+
+MODEL_NAME = "multi-qa-mpnet-base-dot-v1"
+IMPORT_MODULES = (
+    "mainforrag", "evaluateRAG", "server", "router",
+    "RAGagentwithmeddialog", "RAGagentmultianswer", "ragwithoutmeddialog", "Ragwithwebscraping",
+)
+
+WORDS = (
+    "pill morning after emergency contraception period bleeding spotting pregnancy test "
+    "nausea headache dose hormone levonorgestrel ovulation cycle delay unprotected sex "
+    "doctor cramps side effects pcod safe effective hours weeks brown discharge"
+).split()
+
+
+# -----------------------
+# Synthetic data
+# -----------------------
+def _sentence(rng, n):
+    return " ".join(rng.choice(WORDS) for _ in range(n)).capitalize() + "."
+
+
+def write_synthetic_kb(path: str, rows: int, seed: int = 0):
+    """MedDialog-shaped JSON array, streamed to disk row by row."""
+    rng = random.Random(seed)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("[")
+        for i in range(rows):
+            row = {
+                "input": f"Hi doctor, {_sentence(rng, 18)} {_sentence(rng, 10)}",
+                "answer_chatgpt": " ".join(_sentence(rng, 14) for _ in range(3)),
+                "answer_icliniq": " ".join(_sentence(rng, 14) for _ in range(4)),
+                "answer_chatdoctor": " ".join(_sentence(rng, 14) for _ in range(2)),
+            }
+            f.write(("," if i else "") + json.dumps(row))
+        f.write("]")
+
+
+def synthetic_queries(n: int, seed: int = 1):
+    rng = random.Random(seed)
+    return [f"Hello doctor, {_sentence(rng, 16)}" for _ in range(n)]
+
+
+class HashingEncoder:
+    """Deterministic bag-of-words stand-in for SentenceTransformer (no weights, no network)."""
+
+    def __init__(self, dim: int = 768):
+        self.dim = dim
+
+    def _vec(self, text):
+        v = np.zeros(self.dim, dtype=np.float32)
+        for w in text.lower().split():
+            h = int.from_bytes(hashlib.blake2b(w.encode("utf-8"), digest_size=8).digest(), "little")
+            v[h % self.dim] += 1.0 if (h >> 32) & 1 else -1.0
+        return v
+
+    def encode(self, sentences, batch_size=32, convert_to_numpy=True, show_progress_bar=False, **kwargs):
+        if isinstance(sentences, str):
+            return self._vec(sentences)
+        out = np.zeros((len(sentences), self.dim), dtype=np.float32)
+        for i, s in enumerate(sentences):
+            out[i] = self._vec(s)
+        return out
+
+
+# -----------------------
+# Local fixture servers
+# -----------------------
+class _PageHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        rng = random.Random(self.path)
+        paras = "".join(f"<p>{_sentence(rng, 15)} {_sentence(rng, 12)}</p>" for _ in range(60))
+        body = (
+            "<html><head><script>var tracking = 1;</script></head><body>"
+            "<nav><a>Home</a><a>About</a></nav>"
+            f"<h1>Emergency contraception {self.path}</h1>{paras}"
+            "<footer>Copyright</footer></body></html>"
+        ).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class StubLLMHandler(BaseHTTPRequestHandler):
+    """Just enough of POST /v1/chat/completions (plain and streamed)."""
+
+    protocol_version = "HTTP/1.1"
+    delay = 0.0
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        req = json.loads(self.rfile.read(length))
+        if self.delay:
+            time.sleep(self.delay)
+        prompt = req["messages"][0]["content"]
+        text = "Stub answer. This information is for educational purposes only and not a substitute for professional medical advice."
+        usage = {"prompt_tokens": len(prompt) // 4, "completion_tokens": 20, "total_tokens": len(prompt) // 4 + 20}
+
+        if req.get("stream"):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for i, tok in enumerate(text.split(" ")):
+                delta = {"content": (" " if i else "") + tok}
+                self._chunk({"choices": [{"index": 0, "delta": delta, "finish_reason": None}]}, req)
+            self._chunk({"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "usage": usage}, req)
+            self._write_chunk(b"data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+            return
+
+        body = json.dumps({
+            "id": "stub", "object": "chat.completion", "created": 0, "model": req["model"],
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": usage,
+        }).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _chunk(self, payload, req):
+        payload = {"id": "stub", "object": "chat.completion.chunk", "created": 0, "model": req["model"], **payload}
+        self._write_chunk(f"data: {json.dumps(payload)}\n\n".encode("utf-8"))
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+
+
+def serve(handler):
+    """Start a handler on a free localhost port; returns its base URL."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+# -----------------------
+# Measurement helpers
+# -----------------------
+def rss_mb():
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 2**20
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, AttributeError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def percentiles(samples_s):
+    ms = np.asarray(samples_s) * 1000
+    return {
+        "p50": float(np.percentile(ms, 50)),
+        "p95": float(np.percentile(ms, 95)),
+        "p99": float(np.percentile(ms, 99)),
+        "mean": float(ms.mean()),
+    }
+
+
+def time_calls(fn, args):
+    samples = []
+    for a in args:
+        t0 = time.perf_counter()
+        fn(a)
+        samples.append(time.perf_counter() - t0)
+    return samples
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def import_times(modules=IMPORT_MODULES, repeats=3):
+    """Best-of-repeats seconds to import each module in a fresh interpreter."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = {k: v for k, v in os.environ.items() if k != "OPENAI_API_KEY"}
+    times = {}
+    for module in modules:
+        code = f"import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+        runs = []
+        for _ in range(repeats):
+            out = subprocess.run([sys.executable, "-c", code], cwd=here, env=env,
+                                 capture_output=True, text=True)
+            if out.returncode != 0:
+                runs = None
+                break
+            runs.append(float(out.stdout.strip().splitlines()[-1]))
+        times[module] = min(runs) if runs else None
+    return times
+
+
+# -----------------------
+# Agent builders
+# -----------------------
+def build_agent(kind, kb_file, work_dir, page_base, url_count):
+    """Construct one agent against the synthetic data in its own scratch store."""
+    store = os.path.join(work_dir, kind)
+    if kind == "rag" or kind.startswith("rag-"):
+        from RAGagentwithmeddialog import RAGAgent
+        variant = kind.split("-", 1)[1] if "-" in kind else "float32"
+        if variant == "hnsw":
+            return RAGAgent(kb_file, use_llm=True, cache_dir=store, index_backend="hnsw")
+        return RAGAgent(kb_file, use_llm=True, cache_dir=store, index_dtype=variant)
+    if kind.startswith("json-"):
+        from RAGagentmultianswer import JSONRAGChroma
+        return JSONRAGChroma(
+            kb_file, answer_fields=["answer_chatgpt", "answer_icliniq", "answer_chatdoctor"],
+            mode=kind.split("-", 1)[1], use_llm=True, persist_path=store
+        )
+    if kind == "url":
+        from ragwithoutmeddialog import URLRAGChroma
+        urls = [(f"Emergency contraception page {i}", f"{page_base}/page/{i}") for i in range(url_count)]
+        return URLRAGChroma(urls, use_llm=True, persist_path=store)
+    if kind == "scrape":
+        from Ragwithwebscraping import ScrapeChroma
+        urls = [f"{page_base}/page/{i}" for i in range(url_count)]
+        return ScrapeChroma(urls, use_llm=True, persist_path=store)
+    raise ValueError(f"unknown agent kind: {kind}")
+
+
+def bench_agent(kind, kb_file, rows, args, work_dir, page_base):
+    from querycache import shared_query_cache
+    queries = synthetic_queries(args.queries)
+
+    rss0 = rss_mb()
+    t0 = time.perf_counter()
+    agent = build_agent(kind, kb_file, work_dir, page_base, args.urls)
+    build_s = time.perf_counter() - t0
+    rss1 = rss_mb()
+
+    # Warm restart: same store, nothing should need re-embedding
+    t0 = time.perf_counter()
+    warm = build_agent(kind, kb_file, work_dir, page_base, args.urls)
+    warm_build_s = time.perf_counter() - t0
+    warm.close()
+
+    # The query-embedding cache is process-wide: emptied before every timed
+    # phase so each one pays for query encoding, as runs without the cache did
+    query_cache = getattr(agent, "query_cache", None) or shared_query_cache()
+
+    # First query pays for anything built lazily (model weights, clients)
+    query_cache.clear()
+    t0 = time.perf_counter()
+    agent.retrieve(queries[0])
+    first_retrieve_ms = (time.perf_counter() - t0) * 1000
+    query_cache.clear()
+    retrieve = percentiles(time_calls(agent.retrieve, queries))
+    # Same queries again, now all cache hits
+    retrieve_cached = percentiles(time_calls(agent.retrieve, queries))
+
+    batch_qps = None
+    if hasattr(agent, "retrieve_batch"):
+        query_cache.clear()
+        t0 = time.perf_counter()
+        agent.retrieve_batch(queries)
+        batch_qps = len(queries) / (time.perf_counter() - t0)
+
+    answer_fn = agent.answer if hasattr(agent, "answer") else agent.handle
+    query_cache.clear()
+    answer = percentiles(time_calls(answer_fn, queries[:args.answer_queries]))
+
+    index = agent.index_report(queries) if hasattr(agent, "index_report") else None
+
+    agent.close()
+    query_cache.clear()
+    return {
+        "agent": kind,
+        "kb_rows": args.urls if kind in ("url", "scrape") else rows,
+        "build_s": build_s,
+        "warm_build_s": warm_build_s,
+        "rss_delta_mb": rss1 - rss0,
+        "first_retrieve_ms": first_retrieve_ms,
+        "retrieve_ms": retrieve,
+        "retrieve_cached_ms": retrieve_cached,
+        "batch_qps": batch_qps,
+        "answer_ms": answer,
+        "index": index,
+    }
+
+
+def compare(old_path, new):
+    """Print metric changes against an earlier results file; returns regressions over 10%."""
+    with open(old_path, "r", encoding="utf-8") as f:
+        old = json.load(f)
+    old_rows = {(r["agent"], r["kb_rows"]): r for r in old["results"]}
+    regressions = []
+    print(f"\nvs {old['meta']['commit']} ({old_path})")
+    for r in new["results"]:
+        o = old_rows.get((r["agent"], r["kb_rows"]))
+        if not o:
+            continue
+        for metric, lower_is_better in (
+            ("build_s", True), ("retrieve_ms.p50", True), ("retrieve_ms.p99", True),
+            ("retrieve_cached_ms.p50", True),
+            ("batch_qps", False), ("answer_ms.p50", True),
+        ):
+            a, b = o, r
+            for part in metric.split("."):
+                a, b = (a or {}).get(part), (b or {}).get(part)
+            if not a or b is None:
+                continue
+            change = (b - a) / a
+            worse = change > 0.10 if lower_is_better else change < -0.10
+            flag = "  REGRESSION" if worse else ""
+            print(f"  {r['agent']:<12} {r['kb_rows']:>8} {metric:<16} {a:10.3f} -> {b:10.3f} ({change:+.1%}){flag}")
+            if worse:
+                regressions.append((r["agent"], r["kb_rows"], metric, change))
+
+    for backend, r in new.get("encoders", {}).items():
+        o = old.get("encoders", {}).get(backend)
+        if not o:
+            continue
+        for metric, a, b in (("build_s", o["build_s"], r["build_s"]),
+                             ("query_ms.p50", o["query_ms"]["p50"], r["query_ms"]["p50"])):
+            change = (b - a) / a
+            worse = change > 0.10
+            flag = "  REGRESSION" if worse else ""
+            print(f"  encoder {backend:<10} {metric:<16} {a:10.3f} -> {b:10.3f} ({change:+.1%}){flag}")
+            if worse:
+                regressions.append(("encoder", backend, metric, change))
+
+    for module, b in new.get("imports", {}).items():
+        a = old.get("imports", {}).get(module)
+        if not a or b is None:
+            continue
+        change = (b - a) / a
+        # Imports are short; ignore jitter below 20ms
+        worse = change > 0.10 and b - a > 0.02
+        flag = "  REGRESSION" if worse else ""
+        print(f"  import {module:<22} {a * 1000:8.1f}ms -> {b * 1000:8.1f}ms ({change:+.1%}){flag}")
+        if worse:
+            regressions.append(("import", module, "import_s", change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000", help="comma-separated KB sizes, e.g. 1000,100000,1000000")
+    parser.add_argument("--agents", default="rag,json-single,json-concat,json-multi,url,scrape",
+                        help="also rag-float16 / rag-int8 / rag-hnsw for the other RAGAgent indexes")
+    parser.add_argument("--queries", type=int, default=200, help="queries per latency run")
+    parser.add_argument("--answer-queries", type=int, default=20)
+    parser.add_argument("--urls", type=int, default=50, help="fixture pages for url/scrape agents")
+    parser.add_argument("--llm-delay", type=float, default=0.0, help="stub LLM latency in seconds")
+    parser.add_argument("--real-model", action="store_true",
+                        help="use the cached SentenceTransformer instead of the hashing encoder")
+    parser.add_argument("--backends", default="",
+                        help="with --real-model: embedding backends to compare, e.g. torch,onnx,onnx-int8")
+    parser.add_argument("--backend-rows", type=int, default=2000, help="KB entries encoded per backend")
+    parser.add_argument("--threads", type=int, default=None, help="torch threads / ONNX Runtime intra-op threads")
+    parser.add_argument("--out", default="bench_results")
+    parser.add_argument("--compare", help="earlier results JSON to diff against")
+    args = parser.parse_args()
+    if args.backends and not args.real_model:
+        parser.error("--backends needs --real-model")
+
+    StubLLMHandler.delay = args.llm_delay
+    os.environ["OPENAI_BASE_URL"] = serve(StubLLMHandler) + "/v1"
+    os.environ.setdefault("OPENAI_API_KEY", "offline-benchmark")
+    page_base = serve(_PageHandler)
+
+    if args.real_model:
+        os.environ.setdefault("HF_HUB_OFFLINE", "1")
+        if args.threads:
+            from modelregistry import registry
+            registry.configure(num_threads=args.threads)
+    else:
+        from modelregistry import registry
+        registry.register(MODEL_NAME, HashingEncoder())
+
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+    kinds = [k for k in args.agents.split(",") if k]
+    work_dir = tempfile.mkdtemp(prefix="ragbench-")
+    results = []
+    encoders = {}
+    try:
+        if args.backends:
+            from embedparity import compare_backends, kb_texts, print_table
+            kb_file = os.path.join(work_dir, "kb-encoders.json")
+            write_synthetic_kb(kb_file, args.backend_rows)
+            print(f"[bench] embedding backends @ {args.backend_rows} rows ...", flush=True)
+            encoders = compare_backends(
+                MODEL_NAME, kb_texts(kb_file, args.backend_rows), synthetic_queries(args.queries),
+                [b for b in args.backends.split(",") if b], num_threads=args.threads
+            )
+            print_table(encoders)
+
+        for rows in sizes:
+            kb_file = os.path.join(work_dir, f"kb-{rows}.json")
+            write_synthetic_kb(kb_file, rows)
+            for kind in kinds:
+                if kind in ("url", "scrape") and rows != sizes[0]:
+                    continue  # page count does not depend on KB size
+                size = f"{args.urls} pages" if kind in ("url", "scrape") else f"{rows} rows"
+                print(f"[bench] {kind} @ {size} ...", flush=True)
+                r = bench_agent(kind, kb_file, rows, args, os.path.join(work_dir, str(rows)), page_base)
+                results.append(r)
+                print(
+                    f"        build {r['build_s']:.2f}s (warm {r['warm_build_s']:.2f}s), "
+                    f"rss +{r['rss_delta_mb']:.0f}MB, retrieve p50 {r['retrieve_ms']['p50']:.2f}ms "
+                    f"p99 {r['retrieve_ms']['p99']:.2f}ms (cached p50 {r['retrieve_cached_ms']['p50']:.2f}ms), "
+                    f"answer p50 {r['answer_ms']['p50']:.2f}ms",
+                    flush=True,
+                )
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print("[bench] import times ...", flush=True)
+    imports = import_times()
+    for module, seconds in imports.items():
+        print(f"        {module:<22} " + (f"{seconds * 1000:.1f}ms" if seconds is not None else "failed"))
+
+    commit = git_commit()
+    report = {
+        "meta": {
+            "commit": commit,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "encoder": "sentence-transformers" if args.real_model else "hashing",
+            "args": vars(args),
+        },
+        "results": results,
+        "encoders": encoders,
+        "imports": imports,
+    }
+    os.makedirs(args.out, exist_ok=True)
+    out_path = os.path.join(args.out, f"{time.strftime('%Y%m%d-%H%M%S')}-{commit}.json")
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nresults written to {out_path}")
+
+    if args.compare:
+        regressions = compare(args.compare, report)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+import json
+import math
+import os
+import re
+from collections import Counter
+import numpy as np
+
+_TOKEN = re.compile(r"[a-z0-9]+(?:[-'][a-z0-9]+)*")
+
+
+def tokenize(text: str) -> list[str]:
+    """
+    Lower-cased word tokens. Hyphenated terms are kept whole and also split,
+    so "i-pill" matches both "i-pill" and "pill".
+    """
+    out = []
+    for tok in _TOKEN.findall(text.lower()):
+        out.append(tok)
+        if "-" in tok:
+            out.extend(p for p in tok.split("-") if p)
+    return out
+
+
+# Function words carry no topic; they are indexed but ignored in queries
+STOPWORDS = frozenset("""
+a about after all also am an and any are as at be been before being but by can could
+did do does doing during for from had has have having he her here hers him his how i
+if in into is it its itself me more most my no nor not of off on once only or other
+our ours out over own same she should so some such than that the their theirs them
+then there these they this those through to too under until up very was we were what
+when where which while who whom why will with would you your yours
+""".split())
+
+
+def query_terms(query: str) -> list[str]:
+    """Distinct query tokens, stopwords left out."""
+    return [t for t in dict.fromkeys(tokenize(query)) if t not in STOPWORDS]
+
+
+class BM25Index:
+    """
+    Okapi BM25 inverted index over string ids, persisted as one JSON file.
+
+    Postings are term -> {slot: term frequency}; ids map to integer slots that
+    are reused after deletes. Deletes only mark the slot dead - the postings
+    are swept once, lazily, before the next search or save. Per-term numpy
+    arrays are cached for scoring and dropped whenever the term changes.
+    """
+
+    VERSION = 1
+
+    def __init__(self, path: str | None = None, k1: float = 1.5, b: float = 0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.ids = []          # slot -> id (None = free)
+        self.lengths = []      # slot -> doc length in tokens
+        self.slot_of = {}      # id -> slot
+        self.postings = {}     # term -> {slot: tf}
+        self.free = []
+        self.total_len = 0
+        self.dirty = False
+        self._dead = set()
+        self._arrays = {}
+        if path and os.path.exists(path):
+            self._load()
+
+    def _load(self):
+        with open(self.path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") != self.VERSION:
+            return
+        self.ids = data["ids"]
+        self.lengths = data["lengths"]
+        self.postings = {t: {int(s): tf for s, tf in p} for t, p in data["postings"].items()}
+        self.slot_of = {rid: s for s, rid in enumerate(self.ids) if rid is not None}
+        self.free = [s for s, rid in enumerate(self.ids) if rid is None]
+        self.total_len = sum(self.lengths[s] for s in self.slot_of.values())
+
+    def save(self):
+        if not self.path or not self.dirty:
+            return
+        self._purge()
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({
+                "version": self.VERSION,
+                "ids": self.ids,
+                "lengths": self.lengths,
+                "postings": {t: list(p.items()) for t, p in self.postings.items()},
+            }, f, separators=(",", ":"))
+        os.replace(tmp, self.path)
+        self.dirty = False
+
+    def __len__(self):
+        return len(self.slot_of)
+
+    def __contains__(self, rid):
+        return rid in self.slot_of
+
+    def add(self, items):
+        """Index (id, text) pairs; ids already present are skipped."""
+        for rid, text in items:
+            if rid in self.slot_of:
+                continue
+            terms = Counter(tokenize(text))
+            slot = self.free.pop() if self.free else len(self.ids)
+            if slot == len(self.ids):
+                self.ids.append(rid)
+                self.lengths.append(0)
+            self.ids[slot] = rid
+            self.lengths[slot] = sum(terms.values())
+            self.slot_of[rid] = slot
+            self.total_len += self.lengths[slot]
+            for term, tf in terms.items():
+                self.postings.setdefault(term, {})[slot] = tf
+                self._arrays.pop(term, None)
+            self.dirty = True
+
+    def remove(self, ids):
+        for rid in ids:
+            slot = self.slot_of.pop(rid, None)
+            if slot is None:
+                continue
+            self.total_len -= self.lengths[slot]
+            self._dead.add(slot)
+            self.dirty = True
+
+    def _purge(self):
+        if not self._dead:
+            return
+        for term in list(self.postings):
+            p = self.postings[term]
+            if any(s in self._dead for s in p):
+                for s in self._dead.intersection(p):
+                    del p[s]
+                self._arrays.pop(term, None)
+                if not p:
+                    del self.postings[term]
+        for s in self._dead:
+            self.ids[s] = None
+            self.lengths[s] = 0
+        self.free.extend(self._dead)
+        self._dead.clear()
+
+    def _idf(self, df: int) -> float:
+        n = len(self.slot_of)
+        return math.log(1.0 + (n - df + 0.5) / (df + 0.5))
+
+    def _term_arrays(self, term):
+        arrs = self._arrays.get(term)
+        if arrs is None:
+            p = self.postings[term]
+            arrs = self._arrays[term] = (
+                np.fromiter(p.keys(), dtype=np.int64, count=len(p)),
+                np.fromiter(p.values(), dtype=np.float32, count=len(p)),
+            )
+        return arrs
+
+    def full_match_score(self, query: str) -> float:
+        """Score of an average-length document containing every indexed query term once."""
+        self._purge()
+        return sum(self._idf(len(self.postings[t])) for t in query_terms(query) if t in self.postings)
+
+    def search(self, query: str, k: int):
+        """
+        [(id, score, coverage)] best first, at most k, only documents sharing a
+        term with query. coverage is the share of the query's idf mass the
+        document contains, so one frequent term cannot pass for a full match.
+        Stopwords are ignored, and query terms missing from the index count
+        towards that mass with the highest idf, since no document has them.
+        """
+        self._purge()
+        query_set = query_terms(query)
+        terms = [t for t in query_set if t in self.postings]
+        if not terms or not self.slot_of or k <= 0:
+            return []
+        avgdl = self.total_len / len(self.slot_of)
+        lengths = np.asarray(self.lengths, dtype=np.float32)
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        cover = np.zeros(len(self.ids), dtype=np.float32)
+        total_idf = (len(query_set) - len(terms)) * self._idf(0)
+        norm = self.k1 * (1 - self.b + self.b * lengths / max(avgdl, 1e-9))
+        for t in terms:
+            slots, tfs = self._term_arrays(t)
+            idf = self._idf(len(slots))
+            scores[slots] += idf * tfs * (self.k1 + 1) / (tfs + norm[slots])
+            cover[slots] += idf
+            total_idf += idf
+
+        matched = np.flatnonzero(scores > 0)
+        if len(matched) > k:
+            matched = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+        matched = matched[np.argsort(-scores[matched])]
+        return [(self.ids[s], float(scores[s]), float(cover[s]) / total_idf) for s in matched]
+
+    def reconcile(self, collection, batch_size: int = 1000):
+        """Re-align with a Chroma collection: index missing docs, drop ids it no longer has."""
+        stored = set(collection.get(include=[])["ids"])
+        self.remove([rid for rid in list(self.slot_of) if rid not in stored])
+        missing = [rid for rid in stored if rid not in self.slot_of]
+        for i in range(0, len(missing), batch_size):
+            got = collection.get(ids=missing[i:i + batch_size], include=["documents"])
+            self.add(zip(got["ids"], got["documents"]))  # type: ignore
@@ -0,0 +1,116 @@
+import hashlib
+from dataclasses import dataclass
+
+
+def record_id(doc: str, meta: dict) -> str:
+    """Stable id derived from a record's content and source(s)."""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(str(meta.get("source", "")).encode("utf-8"))
+    h.update(b"\x00")
+    h.update(doc.encode("utf-8"))
+    if "sources" in meta:
+        # Collapsed duplicates: a changed member list must be re-written
+        h.update(b"\x00")
+        h.update(meta["sources"].encode("utf-8"))
+    return h.hexdigest()
+
+
+@dataclass
+class SyncReport:
+    added: int = 0
+    deleted: int = 0
+    unchanged: int = 0
+
+    @property
+    def changed(self):
+        return bool(self.added or self.deleted)
+
+    def __str__(self):
+        return f"added {self.added}, deleted {self.deleted}, unchanged {self.unchanged}"
+
+
+def open_collection(client, name: str, variant: str):
+    """
+    Chroma collection `name`, stamped with the embedding variant its vectors
+    were made with (registry.variant()). Ids only hash content, so a
+    collection stamped with another variant is dropped and recreated empty:
+    the next sync re-embeds everything instead of mixing vector spaces.
+    Collections from before the stamp are taken to match and get stamped.
+    """
+    collection = client.get_or_create_collection(name=name, metadata={"embedding": variant})
+    stored = (collection.metadata or {}).get("embedding")
+    if stored is None:
+        collection.modify(metadata={**(collection.metadata or {}), "embedding": variant})
+    elif stored != variant:
+        client.delete_collection(name)
+        collection = client.create_collection(name=name, metadata={"embedding": variant})
+    return collection
+
+
+def _upsert(collection, model, batch):
+    ids, docs, metas = zip(*batch)
+    embeddings = model.encode(list(docs), convert_to_numpy=True).tolist()
+    collection.upsert(ids=list(ids), documents=list(docs), embeddings=embeddings, metadatas=list(metas))
+
+
+def sync_collection(collection, model, records, batch_size: int = 1000,
+                    keep_ids=None, prune: bool = True, progress=None,
+                    on_upsert=None, on_delete=None) -> SyncReport:
+    """
+    Bring a Chroma collection in line with a source.
+
+    records: iterable of (document, metadata). Records whose content-hash id
+    is already stored are skipped; the rest are embedded and upserted in
+    batches of batch_size (kept below Chroma's max batch size). With prune,
+    ids that are neither produced by records nor listed in keep_ids are
+    deleted, which also clears out entries written under the old positional ids.
+    keep_ids is only read after records is exhausted.
+
+    records may be a lazy stream: memory is bounded by one batch plus the id
+    sets. Every batch is committed as it is embedded, so an interrupted sync
+    resumes where it stopped - finished records are simply found unchanged.
+    progress(scanned, embedded, final=False) is called after each batch.
+    on_upsert(batch of (id, doc, meta)) and on_delete(ids) mirror every write,
+    so side indexes (e.g. BM25) can follow the collection.
+    """
+    existing = set(collection.get(include=[])["ids"])
+    keep = keep_ids if keep_ids is not None else set()
+    seen = set()
+    report = SyncReport()
+
+    batch = []
+    for doc, meta in records:
+        rid = record_id(doc, meta)
+        if rid in seen:
+            continue
+        seen.add(rid)
+        if rid in existing:
+            continue
+        batch.append((rid, doc, meta))
+        if len(batch) >= batch_size:
+            _upsert(collection, model, batch)
+            if on_upsert:
+                on_upsert(batch)
+            report.added += len(batch)
+            batch = []
+            if progress:
+                progress(len(seen), report.added)
+    if batch:
+        _upsert(collection, model, batch)
+        if on_upsert:
+            on_upsert(batch)
+        report.added += len(batch)
+    if progress:
+        progress(len(seen), report.added, final=True)
+
+    live = seen | set(keep)
+    report.unchanged = len(live & existing)
+    if prune:
+        stale = list(existing - live)
+        for i in range(0, len(stale), batch_size):
+            collection.delete(ids=stale[i:i + batch_size])
+            if on_delete:
+                on_delete(stale[i:i + batch_size])
+        report.deleted = len(stale)
+
+    return report
@@ -0,0 +1,252 @@
+import logging
+import os
+import re
+import threading
+from dataclasses import dataclass, field
+from metrics import metrics
+
+_QA = re.compile(r"Q:\s*(.*?)\nA(?: \(([^)]*)\))?:\s*(.*)", re.DOTALL)
+_WORD = re.compile(r"\w+")
+_PIECE = re.compile(r"[^\W\d]+|\d{1,3}|[^\w\s]")
+
+# Share of the budget used when token counts are only estimated
+FALLBACK_MARGIN = 0.85
+
+log = logging.getLogger("rag.context")
+_warned = False
+
+
+class TokenCounter:
+    """
+    Token counts with the OpenAI tokenizer (tiktoken) for the given model.
+
+    tiktoken is optional. Without it counts are estimated as the larger of
+    ~4 characters per token and one token per word, number group (up to 3
+    digits) or punctuation mark, so dosages and non-English text are not
+    undercounted as badly; a warning is logged once per process and
+    ContextBuilder keeps FALLBACK_MARGIN of its budget.
+    """
+
+    def __init__(self, model: str = "gpt-4o-mini"):
+        global _warned
+        self.model = model
+        self._enc = None
+        try:
+            import tiktoken
+        except ImportError:
+            if not _warned:
+                _warned = True
+                log.warning("tiktoken is not installed; context token counts are estimated "
+                            "and the budget is cut to %d%%", FALLBACK_MARGIN * 100)
+            return
+        try:
+            self._enc = tiktoken.encoding_for_model(model)
+        except KeyError:
+            self._enc = tiktoken.get_encoding("o200k_base")
+
+    @property
+    def exact(self) -> bool:
+        return self._enc is not None
+
+    def count(self, text: str) -> int:
+        if self._enc is not None:
+            return len(self._enc.encode(text, disallowed_special=()))
+        return max((len(text) + 3) // 4, len(_PIECE.findall(text)))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Leading part of text within max_tokens, cut back to a word boundary."""
+        if max_tokens <= 1:
+            return ""
+        if self._enc is not None:
+            # One token is kept for the trailing " ..."
+            tokens = self._enc.encode(text, disallowed_special=())
+            if len(tokens) <= max_tokens:
+                return text
+            cut = self._enc.decode(tokens[:max_tokens - 1])
+        else:
+            if self.count(text) <= max_tokens:
+                return text
+            # Longest prefix whose estimate, " ..." included, still fits
+            lo, hi = 0, min(len(text), (max_tokens - 1) * 4)
+            while lo < hi:
+                mid = (lo + hi + 1) // 2
+                if self.count(text[:mid] + " ...") <= max_tokens:
+                    lo = mid
+                else:
+                    hi = mid - 1
+            if not lo:
+                return ""
+            cut = text[:lo]
+        space = cut.rfind(" ")
+        return (cut[:space] if space > len(cut) // 2 else cut).rstrip() + " ..."
+
+
+@dataclass
+class Context:
+    text: str
+    sources: list[str]
+    tokens: int                 # tokens in text
+    raw_tokens: int             # tokens of the hits joined as-is
+    blocks: int                 # blocks kept
+    dropped: dict[str, int] = field(default_factory=dict)  # reason -> hits/blocks dropped
+
+    @property
+    def saved(self) -> int:
+        return max(self.raw_tokens - self.tokens, 0)
+
+
+def _shingles(text: str, n: int = 3):
+    words = _WORD.findall(text.lower())
+    if len(words) < n:
+        return {tuple(words)} if words else set()
+    return {tuple(words[i:i + n]) for i in range(len(words) - n + 1)}
+
+
+def _strip_overlap(prev: str, text: str, min_chars: int = 40) -> str:
+    """text without its leading part when that repeats the end of prev (overlapping chunks)."""
+    probe = text[:min_chars]
+    if len(probe) < min_chars:
+        return text
+    pos = prev.find(probe, max(len(prev) - len(text), 0))
+    while pos != -1:
+        tail = prev[pos:]
+        if text.startswith(tail):
+            return text[len(tail):].lstrip()
+        pos = prev.find(probe, pos + 1)
+    return text
+
+
+class ContextBuilder:
+    """
+    Turns ranked hits into the "retrieved knowledge" section of a prompt.
+
+    - Q&A hits ("Q: ...\\nA (field): ...") for the same question are grouped
+      into one block listing each distinct answer, so multi-mode KBs state the
+      question once.
+    - Chunks of the same source that overlap the previous chunk lose the
+      repeated lead-in; blocks whose word 3-grams are at least dedup_threshold
+      contained in an earlier block are dropped.
+    - Blocks are added in rank order until max_tokens (counted with the
+      LLM's tokenizer; FALLBACK_MARGIN of it when counts are estimated) is
+      reached; the block that crosses the budget is truncated if at least
+      min_block_tokens of it fit.
+
+    Tokens saved against the plain concatenation of hits are returned on the
+    Context and counted in rag_context_tokens_total{kind="raw"|"used"}.
+    """
+
+    def __init__(self, max_tokens: int = 1500, model: str = "gpt-4o-mini",
+                 dedup_threshold: float = 0.8, min_block_tokens: int = 32):
+        self.max_tokens = max_tokens
+        self.model = model
+        self.dedup_threshold = dedup_threshold
+        self.min_block_tokens = min_block_tokens
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def counter(self, model: str | None = None) -> TokenCounter:
+        model = model or self.model
+        with self._lock:
+            tc = self._counters.get(model)
+            if tc is None:
+                tc = self._counters[model] = TokenCounter(model)
+            return tc
+
+    def _blocks(self, items, dropped):
+        """[(text, sources)] in rank order, Q&A hits grouped by question."""
+        blocks = []          # [question or None, answers or text, sources]
+        by_question = {}
+        for text, source in items:
+            m = _QA.fullmatch(text.strip())
+            if m is None:
+                blocks.append([None, text.strip(), [source]])
+                continue
+            question, label, answer = m.group(1).strip(), m.group(2), m.group(3).strip()
+            key = " ".join(question.lower().split())
+            block = by_question.get(key)
+            if block is None:
+                block = by_question[key] = [question, [], []]
+                blocks.append(block)
+            else:
+                dropped["grouped"] = dropped.get("grouped", 0) + 1
+            if any(a == answer for _, a in block[1]):
+                dropped["duplicate"] = dropped.get("duplicate", 0) + 1
+            else:
+                block[1].append((label, answer))
+            if source not in block[2]:
+                block[2].append(source)
+
+        out = []
+        for question, body, sources in blocks:
+            if question is not None:
+                lines = [f"A ({label}): {a}" if label else f"A: {a}" for label, a in body]
+                body = f"Q: {question}\n" + "\n".join(lines)
+            out.append((body, sources))
+        return out
+
+    def build(self, items, model: str | None = None, max_tokens: int | None = None,
+              agent: str = "") -> Context:
+        """Context for ranked (text, source) pairs."""
+        items = [(t, s or "") for t, s in items if t and t.strip()]
+        tc = self.counter(model)
+        budget = self.max_tokens if max_tokens is None else max_tokens
+        if not tc.exact:
+            budget = int(budget * FALLBACK_MARGIN)
+        raw_tokens = tc.count("\n\n".join(t for t, _ in items))
+        dropped = {}
+
+        kept, kept_shingles, last_of_source = [], [], {}
+        for text, sources in self._blocks(items, dropped):
+            prev = last_of_source.get(sources[0])
+            if prev is not None:
+                trimmed = _strip_overlap(prev, text)
+                if trimmed != text:
+                    dropped["overlap"] = dropped.get("overlap", 0) + 1
+                    text = trimmed
+            if not text:
+                continue
+            sh = _shingles(text)
+            if sh and any(len(sh & k) >= self.dedup_threshold * len(sh) for k in kept_shingles):
+                dropped["near_duplicate"] = dropped.get("near_duplicate", 0) + 1
+                continue
+            for s in sources:
+                last_of_source[s] = text
+            kept.append((text, sources))
+            kept_shingles.append(sh)
+
+        parts, sources_out, used = [], [], 0
+        for i, (text, sources) in enumerate(kept):
+            # Blocks are joined by a blank line, ~1 token
+            cost = tc.count(text) + (1 if parts else 0)
+            if used + cost > budget:
+                room = budget - used - (1 if parts else 0)
+                if room >= self.min_block_tokens:
+                    parts.append(tc.truncate(text, room))
+                    sources_out.extend(sources)
+                    dropped["truncated"] = 1
+                    i += 1
+                dropped["budget"] = len(kept) - i
+                break
+            parts.append(text)
+            sources_out.extend(sources)
+            used += cost
+
+        text = "\n\n".join(parts)
+        ctx = Context(text, list(dict.fromkeys(sources_out)), tc.count(text), raw_tokens, len(parts),
+                      {k: v for k, v in dropped.items() if v})
+        metrics.inc("rag_context_tokens_total", ctx.raw_tokens, kind="raw", agent=agent)
+        metrics.inc("rag_context_tokens_total", ctx.tokens, kind="used", agent=agent)
+        return ctx
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_context_builder() -> ContextBuilder:
+    """Process-wide builder; budget from RAG_CONTEXT_TOKENS (default 1500)."""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = ContextBuilder(max_tokens=int(os.getenv("RAG_CONTEXT_TOKENS", "1500")))
+        return _shared
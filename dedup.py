@@ -0,0 +1,240 @@
+"""
+Near-duplicate collapsing of KB records at ingest (MinHash + LSH).
+
+Records whose word-3-gram Jaccard similarity (estimated from MinHash
+signatures) is at least threshold are collapsed into the first of them,
+which keeps its text and gains the metadata of every record it absorbed.
+recall_report() measures what collapsing costs retrieval:
+
+    python dedup.py --kb meddialog.json --mode multi --threshold 0.8 --k 5
+"""
+import argparse
+import json
+import re
+import zlib
+from dataclasses import dataclass
+from functools import lru_cache
+import numpy as np
+
+_WORD = re.compile(r"\w+")
+_FIELD_LABEL = re.compile(r"^A \([^)]*\):", re.M)
+_PRIME = np.uint64(4294967291)   # largest prime below 2**32
+_MIX = (np.uint64(0x9E3779B1), np.uint64(0x85EBCA77))
+
+
+@lru_cache(maxsize=1 << 16)
+def _word_hash(word: str) -> int:
+    # Bounded: a KB's vocabulary is mostly a few thousand frequent words
+    return zlib.crc32(word.encode("utf-8"))
+
+
+@dataclass
+class DedupReport:
+    records_in: int = 0
+    records_out: int = 0
+    clusters: int = 0          # groups of two or more records
+    largest: int = 1
+
+    @property
+    def removed(self):
+        return self.records_in - self.records_out
+
+    @property
+    def shrink(self):
+        return self.removed / self.records_in if self.records_in else 0.0
+
+    def __str__(self):
+        return (f"{self.records_in} -> {self.records_out} records ({self.shrink:.1%} smaller), "
+                f"{self.clusters} duplicate groups, largest {self.largest}")
+
+
+class MinHasher:
+    """MinHash signatures over word 3-grams; deterministic across processes for a given seed."""
+
+    def __init__(self, num_perm: int = 64, shingle: int = 3, seed: int = 1, slice_size: int = 4096):
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self.shingle = shingle
+        self.slice_size = slice_size
+        # a < 2**31 keeps a * h + b inside uint64
+        self.a = rng.integers(1, 1 << 31, num_perm, dtype=np.uint64)[:, None]
+        self.b = rng.integers(0, 1 << 32, num_perm, dtype=np.uint64)[:, None]
+
+    def _shingles(self, text):
+        words = _WORD.findall(text.lower())
+        h = np.fromiter(map(_word_hash, words), dtype=np.uint64, count=len(words))
+        n = self.shingle
+        if len(h) < n:
+            return np.array([int(h.sum()) & 0xFFFFFFFF], dtype=np.uint64)
+        out = h[:len(h) - n + 1].copy()
+        for i in range(1, n):
+            out = (out * _MIX[(i - 1) % 2] + h[i:len(h) - n + 1 + i]) & np.uint64(0xFFFFFFFF)
+        return np.unique(out)
+
+    def signature(self, text) -> np.ndarray:
+        """uint32 [num_perm] for one text; shingles are hashed slice_size at a time."""
+        shingles = self._shingles(text)
+        sig = np.full(self.num_perm, np.iinfo(np.uint64).max, dtype=np.uint64)
+        buf = np.empty((self.num_perm, min(len(shingles), self.slice_size)), dtype=np.uint64)
+        for s in range(0, len(shingles), self.slice_size):
+            part = shingles[s:s + self.slice_size]
+            out = buf[:, :len(part)]
+            np.multiply(self.a, part[None, :], out=out)
+            out += self.b
+            out %= _PRIME
+            np.minimum(sig, out.min(axis=1), out=sig)
+        return sig.astype(np.uint32)
+
+    def signatures(self, texts) -> np.ndarray:
+        """uint32 [len(texts), num_perm]; peak memory is num_perm x slice_size, whatever the batch."""
+        texts = list(texts)
+        out = np.empty((len(texts), self.num_perm), dtype=np.uint32)
+        for i, t in enumerate(texts):
+            out[i] = self.signature(t)
+        return out
+
+
+def lsh_bands(threshold: float, num_perm: int):
+    """(bands, rows) with bands * rows == num_perm whose S-curve midpoint is closest to threshold."""
+    options = [(b, num_perm // b) for b in range(1, num_perm + 1) if num_perm % b == 0]
+    return min(options, key=lambda br: abs((1.0 / br[0]) ** (1.0 / br[1]) - threshold))
+
+
+def cluster_signatures(sigs: np.ndarray, threshold: float) -> np.ndarray:
+    """Representative (lowest index in its group) for every row; rows sharing a band are verified."""
+    n, num_perm = sigs.shape
+    parent = np.arange(n)
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    bands, rows = lsh_bands(threshold, num_perm)
+    weights = np.random.default_rng(0).integers(1, 1 << 62, rows, dtype=np.uint64)
+    for band in range(bands):
+        keys = (sigs[:, band * rows:(band + 1) * rows].astype(np.uint64) * weights).sum(axis=1)
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+        bounds = np.flatnonzero(np.diff(sorted_keys)) + 1
+        for group in np.split(order, bounds):
+            if len(group) < 2:
+                continue
+            head = group[0]
+            similar = (sigs[group[1:]] == sigs[head]).mean(axis=1) >= threshold
+            for j in group[1:][similar]:
+                ri, rj = find(head), find(j)
+                if ri != rj:
+                    parent[max(ri, rj)] = min(ri, rj)
+    return np.fromiter((find(i) for i in range(n)), dtype=np.int64, count=n)
+
+
+def merge_metadata(metas):
+    """First record's metadata plus every member's, so no source is lost."""
+    merged = dict(metas[0] or {})
+    sources = list(dict.fromkeys(str((m or {}).get("source", "")) for m in metas))
+    merged["sources"] = " | ".join(s for s in sources if s)
+    merged["duplicates"] = len(metas) - 1
+    # Chroma metadata values are scalars; the full member list is kept as JSON
+    merged["merged_from"] = json.dumps(metas, ensure_ascii=False, sort_keys=True)
+    return merged
+
+
+def collapse_records(make_records, threshold: float = 0.8, num_perm: int = 64, batch_size: int = 2048):
+    """
+    (records, DedupReport, representative index per input record), where
+    records yields (document, metadata) with near-duplicates collapsed, in
+    the order the surviving records first appear.
+
+    make_records() must return a fresh iterable of (document, metadata) each
+    call: the first pass keeps only signatures and metadata, the second
+    re-reads the documents, so memory stays bounded by the signatures.
+    Multi-mode answer labels ("A (answer_icliniq):") are ignored when
+    comparing, so the same answer under two fields counts as identical.
+    """
+    hasher = MinHasher(num_perm)
+    sigs, metas, batch = [], [], []
+    for doc, meta in make_records():
+        batch.append(_FIELD_LABEL.sub("A:", doc))
+        metas.append(meta)
+        if len(batch) >= batch_size:
+            sigs.append(hasher.signatures(batch))
+            batch = []
+    if batch:
+        sigs.append(hasher.signatures(batch))
+    sigs = np.concatenate(sigs) if sigs else np.zeros((0, num_perm), dtype=np.uint32)
+    rep = cluster_signatures(sigs, threshold)
+
+    members = {}
+    for i, r in enumerate(rep):
+        if r != i:
+            members.setdefault(int(r), [int(r)]).append(i)
+    sizes = [len(m) for m in members.values()]
+    report = DedupReport(len(rep), int((rep == np.arange(len(rep))).sum()), len(sizes), max(sizes, default=1))
+
+    def records():
+        for i, (doc, meta) in enumerate(make_records()):
+            if rep[i] != i:
+                continue
+            group = members.get(i)
+            yield doc, (merge_metadata([metas[j] for j in group]) if group else meta)
+
+    return records(), report, rep
+
+
+def recall_report(model, docs, rep, queries, k: int = 5):
+    """
+    Effect of collapsing on retrieval. For each query, the top-k of the full
+    index is the reference; a reference hit counts as recalled when the
+    collapsed index's top-k contains its group's representative. Also
+    reports how many distinct groups fill the full index's top-k slots.
+    """
+    from vectorindex import ExactIndex
+    vecs = model.encode(list(docs), convert_to_numpy=True)
+    keep = np.flatnonzero(rep == np.arange(len(rep)))
+    full = ExactIndex(vecs)
+    collapsed = ExactIndex(vecs[keep])
+    q_vecs = model.encode(list(queries), convert_to_numpy=True)
+
+    recalled, distinct = [], []
+    for (f_idx, _), (c_idx, _) in zip(full.search(q_vecs, k), collapsed.search(q_vecs, k)):
+        found = set(keep[c_idx])
+        recalled.append(np.mean([rep[i] in found for i in f_idx]) if len(f_idx) else 1.0)
+        distinct.append(len({int(rep[i]) for i in f_idx}))
+    return {
+        "k": k,
+        "queries": len(q_vecs),
+        "records": len(rep),
+        "records_collapsed": len(keep),
+        "recall_at_k": float(np.mean(recalled)),
+        "distinct_in_full_topk": float(np.mean(distinct)),
+    }
+
+
+if __name__ == "__main__":
+    from kbstream import iter_kb_rows
+    from modelregistry import get_model
+    from RAGagentmultianswer import iter_records
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--kb", default="meddialog.json")
+    parser.add_argument("--mode", default="multi", choices=("single", "concat", "multi"))
+    parser.add_argument("--fields", default="answer_chatgpt,answer_icliniq,answer_chatdoctor")
+    parser.add_argument("--threshold", type=float, default=0.8)
+    parser.add_argument("--num-perm", type=int, default=64)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=200, help="KB questions reused as queries (0 = skip recall)")
+    parser.add_argument("--model", default="multi-qa-mpnet-base-dot-v1")
+    args = parser.parse_args()
+
+    fields = args.fields.split(",")
+    make = lambda: iter_records(iter_kb_rows(args.kb), args.mode, fields)
+    _, report, rep = collapse_records(make, args.threshold, args.num_perm)
+    print(report)
+    if args.queries:
+        docs = [doc for doc, _ in make()]
+        questions = list(dict.fromkeys(d.split("\n", 1)[0][3:] for d in docs))
+        step = max(len(questions) // args.queries, 1)
+        result = recall_report(get_model(args.model), docs, rep, questions[::step][:args.queries], args.k)
+        print(json.dumps(result, indent=2))
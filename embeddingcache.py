@@ -0,0 +1,141 @@
+import hashlib
+import json
+import os
+import numpy as np
+
+
+def entry_hash(text: str) -> bytes:
+    """16-byte content hash of a KB entry."""
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+
+class EmbeddingCache:
+    """
+    Append-only on-disk embedding store, one directory per model.
+
+    Layout under <cache_dir>/<model>/:
+      meta.json    - {"model": ..., "dim": ...}
+      vectors.f32  - raw float32 rows, memory-mapped on load
+      keys.bin     - 16-byte entry hash per row, same order as vectors.f32
+    Only entries whose hash is not stored yet get encoded.
+    """
+
+    KEY_SIZE = 16
+
+    def __init__(self, cache_dir: str, model_name: str):
+        self.model_name = model_name
+        self.dir = os.path.join(cache_dir, model_name.replace("/", "__"))
+        os.makedirs(self.dir, exist_ok=True)
+        self.meta_path = os.path.join(self.dir, "meta.json")
+        self.vec_path = os.path.join(self.dir, "vectors.f32")
+        self.keys_path = os.path.join(self.dir, "keys.bin")
+        self._load()
+
+    def _load(self):
+        self.dim = None
+        self.vectors = None
+        self.index = {}
+
+        if not os.path.exists(self.meta_path):
+            return
+        with open(self.meta_path, "r", encoding="utf-8") as f:
+            self.dim = json.load(f)["dim"]
+
+        row_bytes = self.dim * 4
+        vec_rows = os.path.getsize(self.vec_path) // row_bytes if os.path.exists(self.vec_path) else 0
+        key_rows = os.path.getsize(self.keys_path) // self.KEY_SIZE if os.path.exists(self.keys_path) else 0
+        # An interrupted append can leave one file longer than the other
+        n = min(vec_rows, key_rows)
+        if n == 0:
+            return
+
+        with open(self.keys_path, "rb") as f:
+            raw = f.read(n * self.KEY_SIZE)
+        self.index = {raw[i * self.KEY_SIZE:(i + 1) * self.KEY_SIZE]: i for i in range(n)}
+        self.vectors = np.memmap(self.vec_path, dtype=np.float32, mode="r", shape=(n, self.dim))
+
+    def __len__(self):
+        return 0 if self.vectors is None else self.vectors.shape[0]
+
+    def _append(self, keys: list[bytes], vecs: np.ndarray):
+        vecs = np.ascontiguousarray(vecs, dtype=np.float32)
+        if self.dim is None:
+            self.dim = vecs.shape[1]
+            with open(self.meta_path, "w", encoding="utf-8") as f:
+                json.dump({"model": self.model_name, "dim": self.dim}, f)
+
+        start = len(self)
+        # Truncate any torn tail left by an earlier crash before appending
+        for path, size in ((self.vec_path, start * self.dim * 4), (self.keys_path, start * self.KEY_SIZE)):
+            with open(path, "ab") as f:
+                f.truncate(size)
+
+        with open(self.vec_path, "ab") as f:
+            f.write(vecs.tobytes())
+        with open(self.keys_path, "ab") as f:
+            f.write(b"".join(keys))
+
+        for i, k in enumerate(keys):
+            self.index[k] = start + i
+        self.vectors = np.memmap(
+            self.vec_path, dtype=np.float32, mode="r", shape=(start + len(keys), self.dim)
+        )
+
+    def keys_digest(self, n: int) -> str:
+        """Digest of the first n row keys; rows are append-only, so it pins row ids."""
+        h = hashlib.blake2b(digest_size=16)
+        if n:
+            with open(self.keys_path, "rb") as f:
+                h.update(f.read(n * self.KEY_SIZE))
+        return h.hexdigest()
+
+    def encode_rows(self, model, texts: list[str], batch_size: int = 64, show_progress_bar: bool = False,
+                    flush_every: int = 4096, progress=None) -> np.ndarray:
+        """
+        Cache row id of every text, encoding only entries not already cached.
+        New vectors are appended to disk every flush_every entries, so an
+        interrupted build keeps everything encoded so far and resumes from there.
+        progress(scanned, embedded, final=False) is called after each flush.
+        """
+        hashes = [entry_hash(t) for t in texts]
+
+        missing, missing_texts, positions = [], [], []
+        seen = set()
+        for i, (h, t) in enumerate(zip(hashes, texts)):
+            if h not in self.index and h not in seen:
+                seen.add(h)
+                missing.append(h)
+                missing_texts.append(t)
+                positions.append(i)
+
+        for start in range(0, len(missing_texts), flush_every):
+            end = min(start + flush_every, len(missing_texts))
+            new_vecs = model.encode(
+                missing_texts[start:end], batch_size=batch_size,
+                convert_to_numpy=True, show_progress_bar=show_progress_bar
+            )
+            self._append(missing[start:end], new_vecs)
+            if progress:
+                # Every text up to the last one just encoded has been handled
+                progress(positions[end - 1] + 1, end)
+        if progress:
+            progress(len(texts), len(missing_texts), final=True)
+
+        return np.fromiter((self.index[h] for h in hashes), dtype=np.int64, count=len(hashes))
+
+    def take(self, rows) -> np.ndarray:
+        """Vectors for the given row ids."""
+        if len(rows) == 0:
+            return np.zeros((0, self.dim or 0), dtype=np.float32)
+        # Warm restart on an unchanged KB: hand back the memmap itself, no copy
+        if rows[0] == 0 and np.array_equal(rows, np.arange(len(rows))):
+            return self.vectors[:len(rows)]
+        return np.asarray(self.vectors[rows])
+
+    def encode(self, model, texts: list[str], batch_size: int = 64, show_progress_bar: bool = False,
+               flush_every: int = 4096, progress=None):
+        """Embeddings for texts, encoding only entries not already cached (see encode_rows)."""
+        return self.take(self.encode_rows(
+            model, texts, batch_size=batch_size, show_progress_bar=show_progress_bar,
+            flush_every=flush_every, progress=progress
+        ))
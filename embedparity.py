@@ -0,0 +1,151 @@
+"""
+Side-by-side check of the embedding backends against the PyTorch baseline.
+
+Encodes the same KB texts and queries with every backend, times the KB
+encode (index build) and per-query encode, and checks that embeddings and
+top-k results stay within tolerance of the "torch" backend.
+
+    python embedparity.py --kb meddialog.json --backends onnx,onnx-int8 --threads 4
+"""
+import argparse
+import json
+import sys
+import time
+import numpy as np
+from kbstream import iter_kb_rows
+from modelregistry import BACKENDS, load_encoder
+
+# backend -> (min cosine to the baseline vector, min mean top-k overlap)
+TOLERANCES = {
+    "torch": (0.9999, 1.0),
+    "onnx": (0.999, 0.98),
+    "onnx-int8": (0.97, 0.8),
+}
+
+
+def _unit(x):
+    x = np.asarray(x, dtype=np.float32)
+    return x / np.maximum(np.linalg.norm(x, axis=1, keepdims=True), 1e-12)
+
+
+def _top_k(corpus, queries, k):
+    scores = _unit(queries) @ _unit(corpus).T
+    k = min(k, scores.shape[1])
+    idx = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    return [set(row) for row in idx]
+
+
+def parity_report(base_corpus, base_queries, corpus, queries, k: int = 10):
+    """
+    How closely candidate embeddings track the baseline: per-vector cosine
+    (KB and queries together) and the mean share of the baseline top-k that
+    each query's candidate top-k (candidate vectors on both sides) recovers.
+    """
+    cos = np.sum(_unit(np.vstack([base_corpus, base_queries])) * _unit(np.vstack([corpus, queries])), axis=1)
+    base_top = _top_k(base_corpus, base_queries, k)
+    cand_top = _top_k(corpus, queries, k)
+    overlap = [len(b & c) / len(b) for b, c in zip(base_top, cand_top)]
+    return {
+        "k": k,
+        "min_cosine": float(cos.min()),
+        "mean_cosine": float(cos.mean()),
+        "topk_overlap": float(np.mean(overlap)),
+        "min_topk_overlap": float(np.min(overlap)),
+    }
+
+
+def check_parity(report, backend: str):
+    """Failed checks for a parity_report under the backend's tolerances (empty = pass)."""
+    min_cos, min_overlap = TOLERANCES.get(backend, TOLERANCES["onnx-int8"])
+    failures = []
+    if report["min_cosine"] < min_cos:
+        failures.append(f"min cosine {report['min_cosine']:.4f} < {min_cos}")
+    if report["topk_overlap"] < min_overlap:
+        failures.append(f"top-{report['k']} overlap {report['topk_overlap']:.3f} < {min_overlap}")
+    return failures
+
+
+def bench_backend(model, corpus, queries, batch_size: int = 64):
+    """(KB vectors, query vectors, timings) for one encoder; queries are encoded one at a time like retrieve()."""
+    model.encode(queries[:1], convert_to_numpy=True)
+    t0 = time.perf_counter()
+    corpus_vecs = model.encode(corpus, batch_size=batch_size, convert_to_numpy=True)
+    build_s = time.perf_counter() - t0
+    query_vecs, samples = [], []
+    for q in queries:
+        t0 = time.perf_counter()
+        query_vecs.append(model.encode([q], convert_to_numpy=True)[0])
+        samples.append(time.perf_counter() - t0)
+    ms = np.asarray(samples) * 1000
+    timings = {
+        "build_s": build_s,
+        "build_rows_per_s": len(corpus) / build_s if build_s else None,
+        "query_ms": {"p50": float(np.percentile(ms, 50)), "p95": float(np.percentile(ms, 95)),
+                     "mean": float(ms.mean())},
+    }
+    return corpus_vecs, np.asarray(query_vecs), timings
+
+
+def compare_backends(model_name: str, corpus, queries, backends=BACKENDS, k: int = 10,
+                     num_threads: int | None = None, batch_size: int = 64):
+    """{backend: timings + parity vs torch}; the torch baseline is always run first."""
+    results = {}
+    base = None
+    for backend in ["torch"] + [b for b in backends if b != "torch"]:
+        model = load_encoder(model_name, backend, device="cpu", num_threads=num_threads)
+        corpus_vecs, query_vecs, timings = bench_backend(model, corpus, queries, batch_size)
+        del model
+        if base is None:
+            base = corpus_vecs, query_vecs
+        report = parity_report(base[0], base[1], corpus_vecs, query_vecs, k)
+        failures = check_parity(report, backend)
+        results[backend] = {**timings, "parity": report, "ok": not failures, "failures": failures}
+    return results
+
+
+def kb_texts(kb_file: str, rows: int, answer_field: str = "answer_chatgpt"):
+    """KB texts as RAGAgent embeds them, first rows entries."""
+    texts = []
+    for row in iter_kb_rows(kb_file):
+        q, a = row.get("input", "").strip(), row.get(answer_field, "").strip()
+        if q and a:
+            texts.append(f"Q: {q}\nA: {a}")
+            if len(texts) >= rows:
+                break
+    return texts
+
+
+def print_table(results):
+    base = results["torch"]
+    print(f"{'backend':<10} {'build s':>9} {'rows/s':>9} {'query p50':>10} {'speedup':>8} "
+          f"{'min cos':>8} {'top-k':>6}  parity")
+    for backend, r in results.items():
+        speedup = base["query_ms"]["p50"] / r["query_ms"]["p50"] if r["query_ms"]["p50"] else 0.0
+        p = r["parity"]
+        print(f"{backend:<10} {r['build_s']:9.2f} {r['build_rows_per_s']:9.0f} {r['query_ms']['p50']:8.2f}ms "
+              f"{speedup:7.2f}x {p['min_cosine']:8.4f} {p['topk_overlap']:6.3f}  "
+              + ("ok" if r["ok"] else "FAIL: " + "; ".join(r["failures"])))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--kb", default="meddialog.json")
+    parser.add_argument("--model", default="multi-qa-mpnet-base-dot-v1")
+    parser.add_argument("--backends", default="onnx,onnx-int8", help=f"comma-separated, from {BACKENDS}")
+    parser.add_argument("--rows", type=int, default=2000, help="KB entries to encode")
+    parser.add_argument("--queries", type=int, default=100, help="KB questions reused as queries")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--threads", type=int, default=None, help="torch threads / ONNX Runtime intra-op threads")
+    parser.add_argument("--json", help="also write the results here")
+    args = parser.parse_args()
+
+    corpus = kb_texts(args.kb, args.rows)
+    queries = [t.split("\nA: ", 1)[0][3:] for t in corpus[::max(len(corpus) // args.queries, 1)]][:args.queries]
+    results = compare_backends(args.model, corpus, queries, [b for b in args.backends.split(",") if b],
+                               args.k, args.threads)
+    print_table(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if not all(r["ok"] for r in results.values()):
+        sys.exit(1)
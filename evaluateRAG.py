@@ -1,8 +1,16 @@
-import os
-from openai import OpenAI
-from sentence_transformers import SentenceTransformer, util
+from concurrent.futures import ThreadPoolExecutor
+from asyncllm import sync_client
+from modelregistry import get_model
+from metrics import metrics
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Judge embedders stay checked out of the registry for the life of the process
+_embed_models = {}
+
+
+def get_embed_model(name):
+    if name not in _embed_models:
+        _embed_models[name] = get_model(name, lazy=True)
+    return _embed_models[name]
 
 
 def unpack_hits(hits):
@@ -25,11 +33,14 @@ def unpack_hits(hits):
 def eval_retrieval(query, retrieved_docs, gold_answer=None, embed_model=None):
     """Evaluate retrieval quality."""
     if gold_answer:
-        sim_scores = [
-            util.cos_sim(embed_model.encode(gold_answer), embed_model.encode(doc))[0].item()
-            for doc in retrieved_docs
-        ]
-        recall = max(sim_scores) > 0.7
+        if not retrieved_docs:
+            return {"recall@k": 0.0}
+        from sentence_transformers import util
+        # Gold answer and all docs in one encode call
+        with metrics.timer("eval_embed", agent="evaluator"):
+            vecs = embed_model.encode([gold_answer] + list(retrieved_docs), convert_to_tensor=True)
+        sim_scores = util.cos_sim(vecs[:1], vecs[1:])[0]
+        recall = sim_scores.max().item() > 0.7
         return {"recall@k": float(recall)}
     else:
         context = "\n".join(retrieved_docs)
@@ -40,12 +51,14 @@ Retrieved docs: {context}
 Are the retrieved docs relevant to the query?
 Return ONLY 1 if relevant, 0 if not.
 """
-        resp = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.0,
-            max_tokens=5,
-        )
+        with metrics.timer("judge_relevance", agent="evaluator"):
+            resp = sync_client().chat.completions.create(
+                model="gpt-4o-mini",
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.0,
+                max_tokens=5,
+            )
+        metrics.usage(resp, agent="evaluator", model="gpt-4o-mini")
         return {"relevance": int(resp.choices[0].message.content.strip())}
 
 
@@ -65,45 +78,84 @@ Task:
 - Count unsupported statements as hallucinations.
 - Return ONLY a number between 0 and 1 = fraction of hallucinated statements.
 """
-    resp = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0.0,
-        max_tokens=10,
-    )
+    with metrics.timer("judge_hallucination", agent="evaluator"):
+        resp = sync_client().chat.completions.create(
+            model="gpt-4o-mini",
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.0,
+            max_tokens=10,
+        )
+    metrics.usage(resp, agent="evaluator", model="gpt-4o-mini")
     try:
         return float(resp.choices[0].message.content.strip())
     except:
         return None
 
 
-def evaluate_agent(agent, queries, gold_answers=None, embed_model_name="all-MiniLM-L6-v2"):
-    """Evaluate a RAG agent across queries."""
-    embed_model = SentenceTransformer(embed_model_name)
-    results = []
+def answer_from_hits(agent, query, hits):
+    """Answer using hits that were already retrieved, so each query is retrieved once."""
+    if hasattr(agent, "answer_from_hits"):
+        return agent.answer_from_hits(query, hits)
+    return agent.answer(query) if hasattr(agent, "answer") else agent.handle(query)
 
-    for q in queries:
-        hits = agent.retrieve(q)
-        hits = unpack_hits(hits)   # ✅ normalize here
 
-        docs = [doc for doc, _, _ in hits]
-        answer = agent.answer(q) if hasattr(agent, "answer") else agent.handle(q)
+def _answer_and_judge(agent, query, hits, docs):
+    answer = answer_from_hits(agent, query, hits)
+    return answer, eval_hallucination("\n".join(docs), answer)
 
-        # Retrieval metrics
-        if gold_answers and q in gold_answers:
-            retrieval_metrics = eval_retrieval(q, docs, gold_answers[q], embed_model)
-        else:
-            retrieval_metrics = eval_retrieval(q, docs, None, embed_model)
-
-        # Hallucination metric
-        context = "\n".join(docs)
-        halluc_rate = eval_hallucination(context, answer)
 
-        results.append({
-            "query": q,
-            "retrieval": retrieval_metrics,
-            "hallucination_rate": halluc_rate,
-            "answer": answer
-        })
+def evaluate_agent(agent, queries, gold_answers=None, embed_model_name="all-MiniLM-L6-v2",
+                   max_workers=4, judge_pool=None):
+    """
+    Evaluate a RAG agent across queries.
+    Retrieval runs here, one query after another; answer synthesis and the
+    LLM-judge calls for all queries run concurrently on judge_pool.
+    """
+    embed_model = get_embed_model(embed_model_name)
+    own_pool = judge_pool is None
+    if own_pool:
+        judge_pool = ThreadPoolExecutor(max_workers=max_workers)
 
-    return results
+    try:
+        pending = []
+        for q in queries:
+            with metrics.timer("retrieve", agent=type(agent).__name__):
+                raw_hits = agent.retrieve(q)
+            hits = unpack_hits(raw_hits)   # ✅ normalize here
+            docs = [doc for doc, _, _ in hits]
+
+            gold = gold_answers.get(q) if gold_answers else None
+            retrieval_f = judge_pool.submit(eval_retrieval, q, docs, gold, embed_model)
+            answer_f = judge_pool.submit(_answer_and_judge, agent, q, raw_hits, docs)
+            pending.append((q, retrieval_f, answer_f))
+
+        results = []
+        for q, retrieval_f, answer_f in pending:
+            answer, halluc_rate = answer_f.result()
+            results.append({
+                "query": q,
+                "retrieval": retrieval_f.result(),
+                "hallucination_rate": halluc_rate,
+                "answer": answer
+            })
+        return results
+    finally:
+        if own_pool:
+            judge_pool.shutdown()
+
+
+def evaluate_agents(jobs, queries, embed_model_name="all-MiniLM-L6-v2", max_workers=8):
+    """
+    Evaluate several agents over the same queries in parallel.
+    jobs: {name: (agent, gold_answers or None)}. All agents share one bounded
+    pool for LLM calls. Returns {name: results} in the order of jobs.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as judge_pool, \
+            ThreadPoolExecutor(max_workers=max(len(jobs), 1)) as agent_pool:
+        futures = {
+            name: agent_pool.submit(
+                evaluate_agent, agent, queries, gold, embed_model_name, judge_pool=judge_pool
+            )
+            for name, (agent, gold) in jobs.items()
+        }
+        return {name: f.result() for name, f in futures.items()}
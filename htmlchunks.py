@@ -0,0 +1,138 @@
+import re
+from html.parser import HTMLParser
+
+
+# Content inside these never reaches the index
+SKIP_TAGS = {
+    "script", "style", "noscript", "template", "svg", "iframe",
+    "nav", "header", "footer", "aside", "form", "button", "select",
+}
+BLOCK_TAGS = {
+    "p", "div", "br", "li", "ul", "ol", "table", "tr", "td", "th",
+    "section", "article", "main", "blockquote", "pre", "dd", "dt",
+    "h1", "h2", "h3", "h4", "h5", "h6",
+}
+
+# Sentence ends, or a line break coming from a block-level tag
+BOUNDARY = re.compile(r"(?<=[.!?])\s+|\s*\n\s*")
+
+
+class TextExtractor(HTMLParser):
+    """Incremental HTML -> text; feed() it pieces and pop_text() what is ready."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self._skip = 0
+        self._parts = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIP_TAGS:
+            self._skip += 1
+        elif tag in BLOCK_TAGS:
+            self._parts.append("\n")
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in BLOCK_TAGS:
+            self._parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in SKIP_TAGS:
+            self._skip = max(self._skip - 1, 0)
+        elif tag in BLOCK_TAGS:
+            self._parts.append("\n")
+
+    def handle_data(self, data):
+        if not self._skip:
+            self._parts.append(data)
+
+    def pop_text(self) -> str:
+        text = "".join(self._parts)
+        self._parts.clear()
+        return text
+
+
+class SentenceChunker:
+    """
+    Groups a stream of text into sentence-aligned chunks of up to max_chars,
+    repeating up to overlap chars of trailing sentences at the start of the
+    next chunk. Offsets are positions in the whitespace-normalized text.
+    """
+
+    def __init__(self, max_chars: int = 800, overlap: int = 150, min_words: int = 3):
+        self.max_chars = max_chars
+        self.overlap = overlap
+        self.min_words = min_words
+        self._buf = ""
+        self._pending = []  # (sentence, offset)
+        self._size = 0
+        self._pos = 0
+
+    def _sentences(self, pieces):
+        for piece in pieces:
+            sent = " ".join(piece.split())
+            if not sent:
+                continue
+            # Short unpunctuated fragments are menu items, buttons, bylines...
+            if len(sent.split()) < self.min_words and sent[-1] not in ".!?":
+                continue
+            # Hard-split run-on text with no sentence boundaries
+            while len(sent) > self.max_chars:
+                cut = sent.rfind(" ", 0, self.max_chars)
+                cut = cut if cut > 0 else self.max_chars
+                yield sent[:cut]
+                sent = sent[cut:].lstrip()
+            if sent:
+                yield sent
+
+    def _add(self, sent):
+        if self._pending and self._size + 1 + len(sent) > self.max_chars:
+            yield self._emit()
+            # Carry trailing sentences over as overlap
+            carried, size = [], 0
+            for s, off in reversed(self._pending):
+                if size + len(s) > self.overlap:
+                    break
+                carried.insert(0, (s, off))
+                size += len(s) + 1
+            self._pending = carried
+            self._size = max(size - 1, 0)
+        self._size += len(sent) + (1 if self._pending else 0)
+        self._pending.append((sent, self._pos))
+        self._pos += len(sent) + 1
+
+    def _emit(self):
+        return " ".join(s for s, _ in self._pending), self._pending[0][1]
+
+    def feed(self, text: str):
+        """Yield (chunk, offset) for every chunk completed by this text."""
+        self._buf += text
+        pieces = BOUNDARY.split(self._buf)
+        # The last piece may be a sentence that continues in the next feed
+        self._buf = pieces.pop()
+        if len(self._buf) > self.max_chars:
+            pieces.append(self._buf)
+            self._buf = ""
+        for sent in self._sentences(pieces):
+            yield from self._add(sent)
+
+    def finish(self):
+        """Flush the remaining text as a final chunk."""
+        for sent in self._sentences([self._buf]):
+            yield from self._add(sent)
+        self._buf = ""
+        if self._pending:
+            yield self._emit()
+            self._pending = []
+            self._size = 0
+
+
+def iter_html_chunks(html_pieces, max_chars: int = 800, overlap: int = 150):
+    """Yield (chunk, offset) from an iterable of HTML text pieces."""
+    parser = TextExtractor()
+    chunker = SentenceChunker(max_chars, overlap)
+    for piece in html_pieces:
+        parser.feed(piece)
+        yield from chunker.feed(parser.pop_text())
+    parser.close()
+    yield from chunker.feed(parser.pop_text())
+    yield from chunker.finish()
@@ -0,0 +1,383 @@
+"""
+Single-file, prebuilt KB index ("artifact").
+
+Layout (little-endian):
+    magic "RAGINDEX" | u32 format version | u32 header length | 32-byte blake2b of the header
+    header JSON (model, dim, count, source, per-section offset / size / blake2b)
+    ... padding up to HEADER_SPACE ...
+    vectors   float32 [count, dim], page aligned
+    norms     float32 [count]      (L2 norm of every vector)
+    ids, documents, metadatas      utf-8 blobs + int64 offsets [count + 1]
+
+Opening maps the file read-only: no section is read or copied until it is
+touched, and every process that opens the same file shares its page cache.
+The header checksum and the file size are always checked; verify=True also
+hashes every section.
+
+    python indexartifact.py build meddialog.json meddialog.ragidx
+    python indexartifact.py info meddialog.ragidx
+    python indexartifact.py verify meddialog.ragidx
+"""
+import argparse
+import hashlib
+import json
+import os
+import struct
+import time
+import numpy as np
+from modelregistry import get_model, registry
+
+MAGIC = b"RAGINDEX"
+FORMAT_VERSION = 1
+HEADER_SPACE = 1 << 16
+_PREAMBLE = struct.Struct("<8sII32s")
+_TEXT_COLUMNS = ("ids", "documents", "metadatas")
+
+
+class ArtifactError(ValueError):
+    pass
+
+
+def file_digest(path: str) -> str:
+    h = hashlib.blake2b(digest_size=32)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class _SectionWriter:
+    def __init__(self, f):
+        self.f = f
+        self.sections = {}
+
+    def begin(self, name, align=64):
+        pos = self.f.tell()
+        pad = -pos % align
+        self.f.write(b"\0" * pad)
+        self._name, self._start, self._hash = name, pos + pad, hashlib.blake2b(digest_size=32)
+
+    def write(self, data):
+        data = bytes(data) if not isinstance(data, bytes) else data
+        self.f.write(data)
+        self._hash.update(data)
+
+    def end(self, **info):
+        self.sections[self._name] = {"offset": self._start, "size": self.f.tell() - self._start,
+                                     "blake2b": self._hash.hexdigest(), **info}
+
+
+def write_artifact(path: str, vectors, ids, documents, metadatas, model: str, variant: str | None = None,
+                   source: dict | None = None, chunk_rows: int = 8192) -> dict:
+    """
+    Pack a KB into one artifact file (written to a temp file, then renamed).
+    vectors may be a memmap; it is streamed chunk by chunk. Returns the header.
+    """
+    n = len(vectors)
+    dim = int(vectors.shape[1]) if n else 0
+    columns = {"ids": [str(i) for i in ids], "documents": list(documents),
+               "metadatas": [json.dumps(m or {}, ensure_ascii=False, sort_keys=True) for m in metadatas]}
+    for name, col in columns.items():
+        if len(col) != n:
+            raise ArtifactError(f"{name}: {len(col)} entries for {n} vectors")
+
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(b"\0" * HEADER_SPACE)
+        w = _SectionWriter(f)
+        norms = np.empty(n, dtype=np.float32)
+
+        w.begin("vectors", align=4096)
+        for s in range(0, n, chunk_rows):
+            block = np.ascontiguousarray(vectors[s:s + chunk_rows], dtype="<f4")
+            norms[s:s + len(block)] = np.linalg.norm(block, axis=1)
+            w.write(block.tobytes())
+        w.end(dtype="float32", shape=[n, dim])
+
+        w.begin("norms")
+        w.write(norms.astype("<f4").tobytes())
+        w.end(dtype="float32", shape=[n])
+
+        for name in _TEXT_COLUMNS:
+            offsets = np.zeros(n + 1, dtype="<i8")
+            w.begin(name)
+            for i, text in enumerate(columns[name]):
+                data = text.encode("utf-8")
+                w.write(data)
+                offsets[i + 1] = offsets[i] + len(data)
+            w.end()
+            w.begin(f"{name}.offsets")
+            w.write(offsets.tobytes())
+            w.end(dtype="int64", shape=[n + 1])
+        size = f.tell()
+
+        header = {
+            "format": FORMAT_VERSION,
+            "model": model,
+            "variant": variant or model,
+            "dim": dim,
+            "count": n,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "source": source or {},
+            "size": size,
+            "sections": w.sections,
+        }
+        raw = json.dumps(header, sort_keys=True).encode("utf-8")
+        if _PREAMBLE.size + len(raw) > HEADER_SPACE:
+            raise ArtifactError(f"header of {len(raw)} bytes does not fit in {HEADER_SPACE}")
+        f.seek(0)
+        f.write(_PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(raw), hashlib.blake2b(raw, digest_size=32).digest()))
+        f.write(raw)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return header
+
+
+class TextColumn:
+    """Read-only sequence over a utf-8 blob section; entries are decoded on access."""
+
+    def __init__(self, blob, offsets, decode=None):
+        self._blob = blob
+        self._offsets = offsets
+        self._decode = decode
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        i = int(i)
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        text = self._blob[self._offsets[i]:self._offsets[i + 1]].tobytes().decode("utf-8")
+        return self._decode(text) if self._decode else text
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+
+class IndexArtifact:
+    """An opened artifact: memory-mapped vectors, norms and lazy text columns."""
+
+    def __init__(self, path: str, verify: bool = False):
+        self.path = path
+        with open(path, "rb") as f:
+            pre = f.read(_PREAMBLE.size)
+            if len(pre) < _PREAMBLE.size:
+                raise ArtifactError(f"{path}: not an index artifact (too short)")
+            magic, version, length, digest = _PREAMBLE.unpack(pre)
+            if magic != MAGIC:
+                raise ArtifactError(f"{path}: not an index artifact")
+            if version > FORMAT_VERSION:
+                raise ArtifactError(f"{path}: format {version} is newer than supported ({FORMAT_VERSION})")
+            raw = f.read(length)
+        if hashlib.blake2b(raw, digest_size=32).digest() != digest:
+            raise ArtifactError(f"{path}: header checksum mismatch")
+        self.header = json.loads(raw)
+        if os.path.getsize(path) != self.header["size"]:
+            raise ArtifactError(f"{path}: truncated ({os.path.getsize(path)} of {self.header['size']} bytes)")
+
+        self._mm = np.memmap(path, dtype=np.uint8, mode="r")
+        if verify:
+            self.verify()
+        n, dim = self.count, self.dim
+        self.vectors = self._section("vectors").view("<f4").reshape(n, dim)
+        self.norms = self._section("norms").view("<f4")
+        self.ids = self._column("ids")
+        self.documents = self._column("documents")
+        self.metadatas = self._column("metadatas", json.loads)
+
+    model = property(lambda self: self.header["model"])
+    variant = property(lambda self: self.header.get("variant", self.header["model"]))
+    dim = property(lambda self: self.header["dim"])
+    count = property(lambda self: self.header["count"])
+    source = property(lambda self: self.header.get("source", {}))
+
+    def __len__(self):
+        return self.count
+
+    def _section(self, name):
+        s = self.header["sections"][name]
+        return self._mm[s["offset"]:s["offset"] + s["size"]]
+
+    def _column(self, name, decode=None):
+        return TextColumn(self._section(name), self._section(f"{name}.offsets").view("<i8"), decode)
+
+    def verify(self):
+        """Hash every section against the header; raises ArtifactError on the first mismatch."""
+        for name, s in self.header["sections"].items():
+            h = hashlib.blake2b(digest_size=32)
+            data = self._section(name)
+            for start in range(0, len(data), 1 << 24):
+                h.update(data[start:start + (1 << 24)].tobytes())
+            if h.hexdigest() != s["blake2b"]:
+                raise ArtifactError(f"{self.path}: section {name!r} checksum mismatch")
+        return True
+
+    def inv_norms(self) -> np.ndarray:
+        norms = np.asarray(self.norms, dtype=np.float32)
+        return np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+
+    def check_model(self):
+        """Refuse to serve the artifact with an encoder whose vectors it was not built from."""
+        if registry.variant(self.model) != self.variant:
+            raise ArtifactError(f"{self.path} was built with {self.variant}, "
+                                f"the registry would encode queries with {registry.variant(self.model)}")
+
+
+class ArtifactCollection:
+    """
+    Read-only stand-in for the Chroma collection calls the agents make
+    (count, get, query), answering from an IndexArtifact. Distances are
+    squared L2 like Chroma's default space, so scores read the same.
+    """
+
+    def __init__(self, artifact: IndexArtifact, chunk_rows: int = 65536):
+        self.artifact = artifact
+        self.name = os.path.basename(artifact.path)
+        self.chunk_rows = chunk_rows
+        self._row_of = None
+
+    def count(self):
+        return self.artifact.count
+
+    def _rows(self, ids):
+        if self._row_of is None:
+            self._row_of = {rid: i for i, rid in enumerate(self.artifact.ids)}
+        return [self._row_of[rid] for rid in ids if rid in self._row_of]
+
+    def _result(self, rows, include, distances=None):
+        art = self.artifact
+        out = {"ids": [art.ids[i] for i in rows]}
+        if "documents" in include:
+            out["documents"] = [art.documents[i] for i in rows]
+        if "metadatas" in include:
+            out["metadatas"] = [art.metadatas[i] for i in rows]
+        if "embeddings" in include:
+            out["embeddings"] = np.asarray(art.vectors[np.asarray(rows, dtype=np.int64)])
+        if distances is not None:
+            out["distances"] = distances
+        return out
+
+    def get(self, ids=None, include=("documents", "metadatas"), limit=None, offset=0):
+        if ids is None:
+            end = self.count() if limit is None else min(offset + limit, self.count())
+            rows = list(range(offset, end))
+        else:
+            rows = self._rows(ids)
+        return self._result(rows, include)
+
+    def query(self, query_embeddings, n_results=10, ids=None, include=("documents", "metadatas", "distances")):
+        art = self.artifact
+        q = np.asarray(query_embeddings, dtype=np.float32).reshape(-1, art.dim)
+        subset = np.asarray(self._rows(ids), dtype=np.int64) if ids is not None else None
+        n = len(subset) if subset is not None else art.count
+        k = min(n_results, n)
+        if k == 0:
+            return {"ids": [[] for _ in q], "documents": [[] for _ in q],
+                    "metadatas": [[] for _ in q], "distances": [[] for _ in q]}
+
+        dist = np.empty((len(q), n), dtype=np.float32)
+        q_sq = np.einsum("ij,ij->i", q, q)[:, None]
+        for s in range(0, n, self.chunk_rows):
+            rows = subset[s:s + self.chunk_rows] if subset is not None else slice(s, s + self.chunk_rows)
+            block = art.vectors[rows]
+            norms = art.norms[rows]
+            dist[:, s:s + len(block)] = q_sq + norms * norms - 2.0 * (q @ block.T)
+        np.maximum(dist, 0.0, out=dist)
+
+        out = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        for row in dist:
+            top = np.argpartition(row, k - 1)[:k]
+            top = top[np.argsort(row[top])]
+            rows = subset[top] if subset is not None else top
+            res = self._result([int(r) for r in rows], include, distances=[float(d) for d in row[top]])
+            for key in out:
+                out[key].append(res.get(key, []))
+        return out
+
+
+def export_collection(collection, path: str, model: str, source: dict | None = None, batch_size: int = 5000):
+    """Write every record of a Chroma collection (with its stored embeddings) to an artifact."""
+    ids, docs, metas, vecs = [], [], [], []
+    total = collection.count()
+    for offset in range(0, total, batch_size):
+        got = collection.get(include=["documents", "metadatas", "embeddings"], limit=batch_size, offset=offset)
+        ids.extend(got["ids"])
+        docs.extend(got["documents"])  # type: ignore
+        metas.extend(got["metadatas"])  # type: ignore
+        vecs.append(np.asarray(got["embeddings"], dtype=np.float32))  # type: ignore
+    vectors = np.concatenate(vecs) if vecs else np.zeros((0, 0), dtype=np.float32)
+    src = {"collection": getattr(collection, "name", ""), **(source or {})}
+    return write_artifact(path, vectors, ids, docs, metas, model, registry.variant(model), src)
+
+
+class ChromaArtifactMixin:
+    """
+    export_artifact() / from_artifact() for the Chroma-backed agents.
+
+    from_artifact() builds the agent around an ArtifactCollection instead of
+    a Chroma client: no sync, no re-embedding, nothing read until queried.
+    Attributes the constructor would set are taken from _artifact_defaults.
+    """
+
+    artifact = None
+    _artifact_defaults = {}
+
+    def export_artifact(self, path: str):
+        return export_collection(self.collection, path, self.model_name, {"agent": type(self).__name__})
+
+    @classmethod
+    def from_artifact(cls, path: str, top_k: int = 3, use_llm: bool = False, llm_model: str = "gpt-4o-mini",
+                      answer_cache=None, verify: bool = False):
+        art = IndexArtifact(path, verify=verify)
+        art.check_model()
+        self = cls.__new__(cls)
+        for name, value in cls._artifact_defaults.items():
+            setattr(self, name, value.copy() if isinstance(value, (dict, list)) else value)
+        self.artifact = art
+        self.model_name = art.model
+        self.model = get_model(art.model, lazy=True)
+        self.client = None
+        self.collection = ArtifactCollection(art)
+        self.sync_report = None
+        self.top_k = top_k
+        self.use_llm = use_llm
+        self.llm_model = llm_model
+        self.answer_cache = answer_cache
+        return self
+
+
+def _build(args):
+    from RAGagentwithmeddialog import RAGAgent
+    agent = RAGAgent(args.kb, answer_field=args.answer_field, model_name=args.model, cache_dir=args.cache_dir)
+    header = agent.export_artifact(args.out)
+    print(f"{args.out}: {header['count']} entries x {header['dim']} dims, {header['size'] / 2**20:.1f} MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("build", help="embed a MedDialog-style KB and write it as an artifact")
+    b.add_argument("kb")
+    b.add_argument("out")
+    b.add_argument("--answer-field", default="answer_chatgpt")
+    b.add_argument("--model", default="multi-qa-mpnet-base-dot-v1")
+    b.add_argument("--cache-dir", default="./embcache")
+    for cmd in ("info", "verify"):
+        sub.add_parser(cmd).add_argument("path")
+    args = parser.parse_args()
+
+    if args.cmd == "build":
+        _build(args)
+    else:
+        t0 = time.perf_counter()
+        art = IndexArtifact(args.path, verify=args.cmd == "verify")
+        ms = (time.perf_counter() - t0) * 1000
+        info = {k: v for k, v in art.header.items() if k != "sections"}
+        print(json.dumps(info, indent=2))
+        print(f"{args.cmd}: ok in {ms:.1f}ms")
@@ -0,0 +1,98 @@
+import json
+import sys
+import time
+
+
+def _skip_space(f, buf, pos, chunk_size, chars=" \t\r\n"):
+    """Advance past chars, reading more chunks as needed; returns (buf, pos, eof)."""
+    while True:
+        while pos < len(buf) and buf[pos] in chars:
+            pos += 1
+        if pos < len(buf):
+            return buf, pos, False
+        buf, pos = f.read(chunk_size), 0
+        if not buf:
+            return buf, pos, True
+
+
+def _iter_json_array(f, chunk_size):
+    decoder = json.JSONDecoder()
+    buf, pos, done = _skip_space(f, "", 0, chunk_size)
+    if done or buf[pos] != "[":
+        raise ValueError("KB file is not a JSON array")
+    pos += 1
+    eof = False
+    read_size = chunk_size
+
+    while True:
+        # Skip separators between elements
+        buf, pos, done = _skip_space(f, buf, pos, chunk_size, " \t\r\n,")
+        if done or buf[pos] == "]":
+            return
+
+        try:
+            row, end = decoder.raw_decode(buf, pos)
+            # A number cut by the chunk end still decodes ("12" of "1234"),
+            # so only accept an element once the "," or "]" after it is read
+            nxt = end
+            while nxt < len(buf) and buf[nxt] in " \t\r\n":
+                nxt += 1
+            if nxt == len(buf) or buf[nxt] not in ",]":
+                raise json.JSONDecodeError("Expecting ',' delimiter", buf, nxt)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            # Element spans the buffer boundary; grow reads so huge rows stay linear
+            more = f.read(read_size)
+            eof = not more
+            buf = buf[pos:] + more
+            pos = 0
+            read_size *= 2
+            continue
+
+        read_size = chunk_size
+        yield row
+        pos = end
+        if pos > chunk_size:
+            buf, pos = buf[pos:], 0
+
+
+def iter_kb_rows(path: str, chunk_size: int = 1 << 20):
+    """
+    Yield KB rows one at a time from a JSON array or a JSONL file,
+    holding at most a few chunks of the file in memory.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        buf, pos, done = _skip_space(f, "", 0, 4096)
+        first = "" if done else buf[pos]
+        f.seek(0)
+        if first == "[":
+            yield from _iter_json_array(f, chunk_size)
+        else:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+
+
+class ProgressPrinter:
+    """Progress callback for ingest: prints at most every `every` seconds."""
+
+    def __init__(self, label: str = "ingest", every: float = 5.0, stream=sys.stderr):
+        self.label = label
+        self.every = every
+        self.stream = stream
+        self._start = time.monotonic()
+        self._last = 0.0
+
+    def __call__(self, scanned: int, embedded: int, final: bool = False):
+        now = time.monotonic()
+        if not final and now - self._last < self.every:
+            return
+        self._last = now
+        elapsed = max(now - self._start, 1e-9)
+        print(
+            f"[{self.label}] {scanned} records scanned, {embedded} embedded "
+            f"({embedded / elapsed:.0f} embedded/s)",
+            file=self.stream, flush=True,
+        )
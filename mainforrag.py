@@ -2,7 +2,8 @@ from Ragwithwebscraping import ScrapeChroma
 from RAGagentmultianswer import JSONRAGChroma
 from RAGagentwithmeddialog import RAGAgent
 from ragwithoutmeddialog import URLRAGChroma
-from evaluateRAG import evaluate_agent
+from evaluateRAG import evaluate_agents
+from router import AgentRouter
 
 
 if __name__ == "__main__":
@@ -40,19 +41,27 @@ if __name__ == "__main__":
         "https://www.plannedparenthood.org/learn/morning-after-pill-emergency-contraception"
     ], use_llm=True)
 
-    # Evaluate all
-    print("\n=== Evaluating MedDialog Agent ===")
-    results_med = evaluate_agent(agent_med, queries, gold_answers)
-    print(results_med)
+    # Evaluate all agents concurrently
+    results = evaluate_agents({
+        "MedDialog Agent": (agent_med, gold_answers),
+        "URL Agent": (agent_url, None),
+        "Hybrid Agent": (agent_hybrid, None),
+        "Scraping Agent": (agent_scraping, None),
+    }, queries)
 
-    print("\n=== Evaluating URL Agent ===")
-    results_url = evaluate_agent(agent_url, queries)
-    print(results_url)
+    for name, agent_results in results.items():
+        print(f"\n=== Evaluating {name} ===")
+        print(agent_results)
 
-    print("\n=== Evaluating Hybrid Agent ===")
-    results_hybrid = evaluate_agent(agent_hybrid, queries)
-    print(results_hybrid)
-
-    print("\n=== Evaluating Scraping Agent ===")
-    results_scraping = evaluate_agent(agent_scraping, queries)
-    print(results_scraping)
+    # One fused answer from all agents, queried concurrently
+    router = AgentRouter({
+        "MedDialog Agent": agent_med,
+        "URL Agent": agent_url,
+        "Hybrid Agent": agent_hybrid,
+        "Scraping Agent": agent_scraping,
+    })
+    for q in queries:
+        routed = router.answer(q)
+        print(f"\n=== Routed answer (timed out: {routed.timed_out or 'none'}) ===")
+        print(routed.answer)
+    router.close()
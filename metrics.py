@@ -0,0 +1,192 @@
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class _NoopTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _NoopTimer()
+
+
+class _Timer:
+    __slots__ = ("metrics", "stage", "labels", "start")
+
+    def __init__(self, metrics, stage, labels):
+        self.metrics = metrics
+        self.stage = stage
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe("rag_stage_seconds", time.perf_counter() - self.start,
+                             stage=self.stage, **self.labels)
+        return False
+
+
+class Metrics:
+    """
+    Process-wide counters, gauges and latency histograms for the RAG pipeline.
+
+    Disabled by default (set RAG_METRICS=1 or call enable()); while disabled
+    every call returns immediately and timer() hands back a shared no-op
+    context manager, so instrumented code pays one attribute check.
+    Sinks added with add_sink() receive every observation as a dict, e.g.
+    JsonLogSink for structured logs (RAG_METRICS_LOG=1); render_prometheus() /
+    write_prometheus() export the aggregated values in Prometheus text format
+    (RAG_METRICS_FILE=path writes the file at exit).
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._counters = {}     # (name, labels) -> value
+        self._gauges = {}       # (name, labels) -> value
+        self._hists = {}        # (name, labels) -> [bucket counts..., count, sum]
+        self._sinks = []
+
+    def enable(self, on: bool = True):
+        self.enabled = on
+
+    def add_sink(self, sink):
+        self._sinks.append(sink)
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def _emit(self, kind, name, value, labels):
+        if self._sinks:
+            event = {"ts": time.time(), "type": kind, "name": name, "value": value, **labels}
+            for sink in self._sinks:
+                sink(event)
+
+    def timer(self, stage: str, **labels):
+        """Context manager timing one pipeline stage into rag_stage_seconds."""
+        if not self.enabled:
+            return _NOOP
+        return _Timer(self, stage, labels)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        if not self.enabled:
+            return
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+        self._emit("counter", name, value, labels)
+
+    def gauge(self, name: str, value: float, **labels):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._gauges[self._key(name, labels)] = value
+        self._emit("gauge", name, value, labels)
+
+    def observe(self, name: str, value: float, **labels):
+        if not self.enabled:
+            return
+        key = self._key(name, labels)
+        with self._lock:
+            h = self._hists.get(key)
+            if h is None:
+                h = self._hists[key] = [0] * (len(LATENCY_BUCKETS) + 2)
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if value <= bound:
+                    h[i] += 1
+            h[-2] += 1
+            h[-1] += value
+        self._emit("histogram", name, value, labels)
+
+    def usage(self, resp, **labels):
+        """Prompt/completion token counters from an OpenAI response (if it reports usage)."""
+        if not self.enabled:
+            return
+        usage = getattr(resp, "usage", None)
+        if usage is None:
+            return
+        self.inc("rag_llm_prompt_tokens_total", usage.prompt_tokens or 0, **labels)
+        self.inc("rag_llm_completion_tokens_total", usage.completion_tokens or 0, **labels)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "counters": dict(self._counters),
+                "gauges": dict(self._gauges),
+                "histograms": {k: list(v) for k, v in self._hists.items()},
+            }
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._hists.clear()
+
+    def render_prometheus(self) -> str:
+        def fmt(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+        snap = self.snapshot()
+        lines = []
+        for kind, values in (("counter", snap["counters"]), ("gauge", snap["gauges"])):
+            typed = set()
+            for (name, labels), value in sorted(values.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {name} {kind}")
+                    typed.add(name)
+                lines.append(f"{name}{fmt(labels)} {value}")
+        typed = set()
+        for (name, labels), h in sorted(snap["histograms"].items()):
+            if name not in typed:
+                lines.append(f"# TYPE {name} histogram")
+                typed.add(name)
+            for bound, count in zip(LATENCY_BUCKETS, h):
+                lines.append(f"{name}_bucket{fmt(labels, [('le', bound)])} {count}")
+            lines.append(f"{name}_bucket{fmt(labels, [('le', '+Inf')])} {h[-2]}")
+            lines.append(f"{name}_count{fmt(labels)} {h[-2]}")
+            lines.append(f"{name}_sum{fmt(labels)} {h[-1]}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str):
+        """Write the text exposition atomically, e.g. for node_exporter's textfile collector."""
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(self.render_prometheus())
+        os.replace(tmp, path)
+
+
+class JsonLogSink:
+    """Sink writing one JSON object per observation to a logger."""
+
+    def __init__(self, logger: logging.Logger | None = None, level: int = logging.INFO):
+        self.logger = logger or logging.getLogger("rag.metrics")
+        self.level = level
+
+    def __call__(self, event):
+        self.logger.log(self.level, json.dumps(event, default=str))
+
+
+metrics = Metrics(enabled=os.getenv("RAG_METRICS", "") not in ("", "0", "false"))
+if os.getenv("RAG_METRICS_LOG"):
+    metrics.add_sink(JsonLogSink())
+if os.getenv("RAG_METRICS_FILE"):
+    atexit.register(lambda: metrics.write_prometheus(os.environ["RAG_METRICS_FILE"]))
@@ -0,0 +1,214 @@
+import os
+import platform
+import shutil
+import tempfile
+import threading
+
+BACKENDS = ("torch", "onnx", "onnx-int8")
+
+
+def _quant_config() -> str:
+    """Dynamic int8 quantization preset for this CPU (RAG_ONNX_QUANT overrides)."""
+    preset = os.getenv("RAG_ONNX_QUANT")
+    if preset:
+        return preset
+    if platform.machine().lower() in ("arm64", "aarch64"):
+        return "arm64"
+    try:
+        with open("/proc/cpuinfo") as f:
+            flags = f.read()
+    except OSError:
+        return "avx2"
+    if "avx512_vnni" in flags:
+        return "avx512_vnni"
+    return "avx512" if "avx512f" in flags else "avx2"
+
+
+def _onnx_dir(name: str) -> str:
+    root = os.getenv("RAG_ONNX_DIR") or os.path.join(os.path.expanduser("~"), ".cache", "rag-onnx")
+    return os.path.join(root, name.replace("/", "__"))
+
+
+def _int8_file() -> str:
+    return f"onnx/model_qint8_{_quant_config()}.onnx"
+
+
+def prepare_encoder(name: str, backend: str = "torch"):
+    """
+    Do the one-time on-disk work load_encoder() needs for a backend: for
+    "onnx-int8", export the quantized model into RAG_ONNX_DIR unless it is
+    there already. The export is written to a temporary directory next to
+    it and moved into place, so concurrent loaders never see a partial model.
+    """
+    if backend != "onnx-int8":
+        return
+    path = _onnx_dir(name)
+    file_name = _int8_file()
+    target = os.path.join(path, file_name)
+    if os.path.exists(target):
+        return
+    from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+    parent = os.path.dirname(path)
+    os.makedirs(parent, exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix=".export-", dir=parent)
+    try:
+        fp32 = SentenceTransformer(name, device="cpu", backend="onnx")
+        fp32.save(tmp)
+        export_dynamic_quantized_onnx_model(fp32, _quant_config(), tmp)
+        try:
+            os.replace(tmp, path)
+        except OSError:
+            # The model directory exists (another preset, or a concurrent export won): add just this file
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(os.path.join(tmp, file_name), target)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def load_encoder(name: str, backend: str = "torch", device: str | None = None,
+                 num_threads: int | None = None):
+    """
+    Build a SentenceTransformer for one backend.
+
+    "onnx" runs the exported ONNX graph on ONNX Runtime's CPU provider;
+    "onnx-int8" additionally quantizes the weights to int8 (dynamic
+    quantization), exported once into RAG_ONNX_DIR (see prepare_encoder)
+    and reused after that.
+    num_threads sets torch's thread count or ONNX Runtime's intra-op threads.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"unknown embedding backend {backend!r}; one of {BACKENDS}")
+    from sentence_transformers import SentenceTransformer
+    if backend == "torch":
+        if num_threads:
+            import torch
+            torch.set_num_threads(num_threads)
+        return SentenceTransformer(name, device=device)
+
+    kwargs = {"provider": "CPUExecutionProvider"}
+    if num_threads:
+        import onnxruntime as ort
+        opts = ort.SessionOptions()
+        opts.intra_op_num_threads = num_threads
+        opts.inter_op_num_threads = 1
+        kwargs["session_options"] = opts
+    if backend == "onnx":
+        return SentenceTransformer(name, device="cpu", backend="onnx", model_kwargs=kwargs)
+
+    prepare_encoder(name, backend)
+    return SentenceTransformer(_onnx_dir(name), device="cpu", backend="onnx",
+                               model_kwargs={**kwargs, "file_name": _int8_file()})
+
+
+class _LazyModel:
+    """Stand-in for a registry model that loads the weights on first use."""
+
+    def __init__(self, registry, name: str):
+        self._registry = registry
+        self._name = name
+        self._model = None
+
+    def __getattr__(self, attr):
+        if self._model is None:
+            self._model = self._registry._load(self._name)
+        return getattr(self._model, attr)
+
+
+class ModelRegistry:
+    """
+    Process-wide pool of SentenceTransformer models.
+
+    Every agent that asks for the same model name gets the same instance.
+    Models are reference-counted and dropped once the last holder releases them.
+    backend ("torch", "onnx", "onnx-int8"; RAG_EMBED_BACKEND) picks how
+    models are run, see load_encoder().
+    """
+
+    def __init__(self, device: str | None = None, num_threads: int | None = None,
+                 backend: str | None = None):
+        self.device = device or os.getenv("RAG_EMBED_DEVICE") or None
+        threads = num_threads or os.getenv("RAG_EMBED_THREADS")
+        self.num_threads = int(threads) if threads else None
+        self.backend = backend or os.getenv("RAG_EMBED_BACKEND") or "torch"
+        if self.backend not in BACKENDS:
+            raise ValueError(f"unknown embedding backend {self.backend!r}; one of {BACKENDS}")
+        self._models = {}
+        self._refs = {}
+        self._pinned = set()
+        self._lock = threading.RLock()
+
+    def configure(self, device: str | None = None, num_threads: int | None = None,
+                  backend: str | None = None):
+        """Set device / thread count / backend for models loaded from now on."""
+        if backend is not None and backend not in BACKENDS:
+            raise ValueError(f"unknown embedding backend {backend!r}; one of {BACKENDS}")
+        with self._lock:
+            if device is not None:
+                self.device = device
+            if num_threads is not None:
+                self.num_threads = num_threads
+            if backend is not None:
+                self.backend = backend
+
+    def variant(self, name: str) -> str:
+        """Name for on-disk embedding stores: int8 vectors are kept apart from fp32 ones."""
+        with self._lock:
+            if self.backend == "onnx-int8" and name not in self._pinned:
+                return f"{name}.int8"
+            return name
+
+    def _load(self, name: str):
+        with self._lock:
+            model = self._models.get(name)
+            if model is None:
+                model = load_encoder(name, self.backend, self.device, self.num_threads)
+                self._models[name] = model
+            return model
+
+    def register(self, name: str, model):
+        """Put an already-built encoder (anything with .encode) into the pool; it is never dropped."""
+        with self._lock:
+            self._models[name] = model
+            self._pinned.add(name)
+
+    def pinned(self, name: str):
+        """The encoder put in with register(), or None."""
+        with self._lock:
+            return self._models.get(name) if name in self._pinned else None
+
+    def acquire(self, name: str, lazy: bool = False):
+        """Take a reference to a model; with lazy=True the weights load on first use."""
+        with self._lock:
+            self._refs[name] = self._refs.get(name, 0) + 1
+            if lazy and name not in self._models:
+                return _LazyModel(self, name)
+            return self._load(name)
+
+    def release(self, name: str):
+        with self._lock:
+            refs = self._refs.get(name, 0) - 1
+            if refs > 0:
+                self._refs[name] = refs
+                return
+            self._refs.pop(name, None)
+            if name not in self._pinned:
+                self._models.pop(name, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                name: {"refs": self._refs.get(name, 0), "loaded": name in self._models,
+                       "backend": "custom" if name in self._pinned else self.backend}
+                for name in set(self._refs) | set(self._models)
+            }
+
+
+registry = ModelRegistry()
+
+
+def get_model(name: str, lazy: bool = False):
+    return registry.acquire(name, lazy=lazy)
+
+
+def release_model(name: str):
+    registry.release(name)
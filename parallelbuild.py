@@ -0,0 +1,273 @@
+"""
+Multi-process KB embedding for index builds.
+
+ParallelEncoder has the encode() interface of a SentenceTransformer, so it
+can stand in for the model wherever a whole KB is embedded (RAGAgent's
+embedding cache, JSONRAGChroma's collection sync). Each encode() call is cut
+into shards that a pool of worker processes embeds independently; every
+finished shard is saved to work_dir, and the shards are merged back in input
+order. When a worker dies only the shards without a saved result are
+retried, and a rerun after a crash reuses the shards already on disk.
+
+    python parallelbuild.py --kb meddialog.json --workers 1,2,4,8,16,32 --rows 20000
+"""
+import argparse
+import hashlib
+import json
+import math
+import multiprocessing as mp
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+import numpy as np
+from modelregistry import load_encoder, prepare_encoder, registry
+
+_worker_model = None
+
+
+def _init_worker(loader, num_threads):
+    global _worker_model
+    if num_threads:
+        os.environ["OMP_NUM_THREADS"] = str(num_threads)
+    _worker_model = loader()
+
+
+def _encode_shard(texts, path, batch_size):
+    vecs = _worker_model.encode(texts, batch_size=batch_size, convert_to_numpy=True, show_progress_bar=False)
+    tmp = f"{path}.tmp.npy"
+    np.save(tmp, np.asarray(vecs, dtype=np.float32))
+    os.replace(tmp, path)
+    return path
+
+
+def _same(model):
+    return model
+
+
+def _encoder_dim(model):
+    get_dim = getattr(model, "get_sentence_embedding_dimension", None)
+    dim = get_dim() if get_dim is not None else getattr(model, "dim", None)
+    return int(dim) if dim else None
+
+
+def _shard_path(work_dir, key, texts):
+    h = hashlib.blake2b(key.encode("utf-8"), digest_size=16)
+    h.update(b"\x00")
+    for t in texts:
+        h.update(t.encode("utf-8"))
+        h.update(b"\x00")
+    return os.path.join(work_dir, f"shard-{h.hexdigest()}.npy")
+
+
+class ParallelEncoder:
+    """
+    Encoder that fans KB-sized encode() calls out to worker processes.
+
+    workers: process count (default: CPU count). Each worker loads its own
+    copy of the model through loader (default: a pickled copy of an encoder
+    pinned with registry.register(), else load_encoder for model_name with
+    the registry's backend/device) and gets cpu_count // workers
+    compute threads unless threads_per_worker is given. Calls are split into
+    shards of at most shard_size rows (and no fewer than min_shard rows) so
+    every worker has work. Shards are content-addressed .npy files in
+    work_dir (a temporary directory unless given) and are removed once
+    merged unless keep_shards is set. A shard is retried up to retries times.
+    The pool starts on the first encode() and lives until close().
+
+    Shard names also hash key, which defaults to the model name, backend,
+    registry variant and embedding dimension (when it can be known without
+    loading the model), so a shared work_dir never hands one model's
+    vectors to another; pass key when using a custom loader. Shards are
+    checked for shape before they are merged.
+    """
+
+    def __init__(self, model_name: str, workers: int | None = None, shard_size: int = 2048,
+                 min_shard: int = 64, work_dir: str | None = None, keep_shards: bool = False,
+                 loader=None, threads_per_worker: int | None = None, retries: int = 2,
+                 start_method: str = "spawn", key: str | None = None, dim: int | None = None):
+        self.model_name = model_name
+        self.workers = workers or os.cpu_count() or 1
+        self.shard_size = shard_size
+        self.min_shard = min_shard
+        self.keep_shards = keep_shards
+        self.threads_per_worker = threads_per_worker or max((os.cpu_count() or 1) // self.workers, 1)
+        pinned = registry.pinned(model_name) if loader is None else None
+        # One-time model exports (onnx-int8) run once here before the pool starts, not in every worker
+        self._prepare = None
+        if loader is None:
+            loader = (partial(_same, pinned) if pinned is not None else
+                      partial(load_encoder, model_name, registry.backend, registry.device, self.threads_per_worker))
+            backend = f"custom:{type(pinned).__name__}" if pinned is not None else registry.backend
+            if pinned is None:
+                self._prepare = partial(prepare_encoder, model_name, registry.backend)
+        else:
+            backend = "loader"
+        self.loader = loader
+        self.dim = dim or (_encoder_dim(pinned) if pinned is not None else None)
+        self.key = key or "|".join([model_name, backend, registry.variant(model_name), str(self.dim or "")])
+        self.retries = retries
+        self.start_method = start_method
+        self._own_dir = work_dir is None
+        self.work_dir = work_dir or tempfile.mkdtemp(prefix="ragbuild-")
+        os.makedirs(self.work_dir, exist_ok=True)
+        self._pool = None
+        self.rows = 0
+        self.seconds = 0.0
+        self.retried = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def _start(self):
+        if self._pool is None:
+            if self._prepare is not None:
+                self._prepare()
+                self._prepare = None
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=mp.get_context(self.start_method),
+                initializer=_init_worker, initargs=(self.loader, self.threads_per_worker),
+            )
+        return self._pool
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+        if self._own_dir and not self.keep_shards:
+            shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def warmup(self):
+        """Start the workers and load their models now, outside any timed build."""
+        pool = self._start()
+        list(pool.map(_encode_shard, [["warmup"]] * self.workers,
+                      [os.path.join(self.work_dir, f"warmup-{i}.npy") for i in range(self.workers)],
+                      [1] * self.workers))
+        for i in range(self.workers):
+            os.remove(os.path.join(self.work_dir, f"warmup-{i}.npy"))
+        return self
+
+    def _shape(self, path):
+        """(rows, dim) of a saved shard, None if missing or unreadable; dim is None while unknown."""
+        try:
+            shape = np.load(path, mmap_mode="r").shape
+        except (OSError, ValueError):
+            return None
+        if len(shape) != 2:
+            return None
+        return shape[0], shape[1] if self.dim is not None else None
+
+    def _shards(self, n):
+        count = max(self.workers, math.ceil(n / self.shard_size))
+        count = max(1, min(count, math.ceil(n / self.min_shard)))
+        size = math.ceil(n / count)
+        return [(i, min(i + size, n)) for i in range(0, n, size)]
+
+    def encode(self, sentences, batch_size: int = 64, convert_to_numpy: bool = True,
+               show_progress_bar: bool = False, **kwargs):
+        """Embeddings for sentences in order (float32 rows)."""
+        if isinstance(sentences, str):
+            return self.encode([sentences], batch_size)[0]
+        texts = list(sentences)
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        t0 = time.perf_counter()
+        shards = [(texts[a:b], _shard_path(self.work_dir, self.key, texts[a:b])) for a, b in self._shards(len(texts))]
+        # Identical shards share a file and are encoded once; a leftover file
+        # of the wrong shape (e.g. from an interrupted write) is redone
+        todo = list({p: (t, p) for t, p in shards if self._shape(p) != (len(t), self.dim)}.values())
+
+        error = None
+        for attempt in range(self.retries + 1):
+            if not todo:
+                break
+            if attempt:
+                self.retried += len(todo)
+            pool = self._start()
+            futures = {pool.submit(_encode_shard, t, p, batch_size): (t, p) for t, p in todo}
+            failed, broken = [], False
+            for fut in as_completed(futures):
+                try:
+                    fut.result()
+                except Exception as e:
+                    failed.append(futures[fut])
+                    error = e
+                    broken = broken or isinstance(e, BrokenProcessPool)
+            if broken:
+                # A dead worker takes the whole pool down; the retry gets a fresh one
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+            todo = failed
+        if todo:
+            raise RuntimeError(f"{len(todo)} of {len(shards)} shards failed after {self.retries} retries") from error
+
+        parts = []
+        for t, p in shards:
+            vecs = np.load(p)
+            dim = self.dim or (parts[0].shape[1] if parts else vecs.shape[-1])
+            if vecs.shape != (len(t), dim):
+                os.remove(p)
+                raise ValueError(f"{p}: shape {vecs.shape}, expected {(len(t), dim)}; "
+                                 "the shard was removed, rerun to re-encode it")
+            parts.append(vecs)
+        self.dim = parts[0].shape[1]
+        out = np.concatenate(parts)
+        if not self.keep_shards:
+            for p in {p for _, p in shards}:
+                os.remove(p)
+        self.rows += len(texts)
+        self.seconds += time.perf_counter() - t0
+        return out
+
+
+def scaling_report(model_name: str, texts, workers=(1, 2, 4, 8), loader=None, batch_size: int = 64,
+                   shard_size: int = 2048):
+    """
+    Rows/s of a cold encode of texts per worker count, with speedup and
+    parallel efficiency against the smallest count. Model loading is done
+    before timing starts.
+    """
+    rows = []
+    for n in workers:
+        with ParallelEncoder(model_name, workers=n, loader=loader, shard_size=shard_size) as enc:
+            enc.warmup()
+            t0 = time.perf_counter()
+            enc.encode(texts, batch_size=batch_size)
+            seconds = time.perf_counter() - t0
+        rows.append({"workers": n, "seconds": seconds, "rows_per_s": len(texts) / seconds})
+    base = rows[0]
+    for r in rows:
+        r["speedup"] = r["rows_per_s"] / base["rows_per_s"]
+        r["efficiency"] = r["speedup"] / (r["workers"] / base["workers"])
+    return rows
+
+
+if __name__ == "__main__":
+    from embedparity import kb_texts
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--kb", default="meddialog.json")
+    parser.add_argument("--model", default="multi-qa-mpnet-base-dot-v1")
+    parser.add_argument("--workers", default="1,2,4,8", help="comma-separated worker counts")
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--shard-size", type=int, default=2048)
+    parser.add_argument("--json", help="also write the report here")
+    args = parser.parse_args()
+
+    texts = kb_texts(args.kb, args.rows)
+    report = scaling_report(args.model, texts, [int(w) for w in args.workers.split(",") if w],
+                            shard_size=args.shard_size)
+    print(f"{len(texts)} rows, {os.cpu_count()} CPUs")
+    print(f"{'workers':>7} {'seconds':>9} {'rows/s':>9} {'speedup':>8} {'efficiency':>10}")
+    for r in report:
+        print(f"{r['workers']:>7} {r['seconds']:9.2f} {r['rows_per_s']:9.0f} {r['speedup']:7.2f}x {r['efficiency']:9.0%}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,110 @@
+import os
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+import numpy as np
+from metrics import metrics
+
+
+def normalize_query(text: str) -> str:
+    """Cache key form of a query: NFC, trimmed, runs of whitespace collapsed."""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+class QueryEmbeddingCache:
+    """
+    LRU cache of query embeddings keyed by (model variant, normalized query);
+    callers pass registry.variant(name) so int8 and fp32 vectors stay apart.
+
+    One instance is shared by every agent in the process (shared_query_cache()),
+    so a query fanned out to several agents on the same model, or asked again,
+    skips the forward pass. Entries are evicted LRU beyond max_entries and
+    after ttl seconds; max_entries=0 disables caching.
+    """
+
+    def __init__(self, max_entries: int = 4096, ttl: float | None = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # (model, query) -> (read-only vector, created)
+        self._lock = threading.Lock()
+
+    def _get(self, key, now):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if self.ttl is not None and now - entry[1] > self.ttl:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def encode(self, model_name: str, model, queries: list[str]) -> np.ndarray:
+        """Embeddings for queries (rows in order); only uncached queries are encoded, in one batch."""
+        if self.max_entries <= 0:
+            return model.encode(queries, convert_to_numpy=True)
+
+        keys = [(model_name, normalize_query(q)) for q in queries]
+        now = time.time()
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key not in found:
+                    vec = self._get(key, now)
+                    if vec is not None:
+                        found[key] = vec
+
+        missing = list(dict.fromkeys(k for k in keys if k not in found))
+        hits = sum(1 for k in keys if k in found)
+        if missing:
+            vecs = model.encode([k[1] for k in missing], convert_to_numpy=True)
+            with self._lock:
+                for key, vec in zip(missing, vecs):
+                    vec = np.array(vec, dtype=np.float32)
+                    vec.flags.writeable = False
+                    found[key] = vec
+                    self._entries[key] = (vec, now)
+                    self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+
+        with self._lock:
+            self.hits += hits
+            self.misses += len(keys) - hits
+        metrics.inc("rag_query_cache_total", hits, result="hit")
+        metrics.inc("rag_query_cache_total", len(keys) - hits, result="miss")
+        if not keys:
+            return model.encode([], convert_to_numpy=True)
+        return np.stack([found[k] for k in keys])
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self._entries),
+        }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_query_cache() -> QueryEmbeddingCache:
+    """Process-wide cache sized from RAG_QUERY_CACHE_SIZE / RAG_QUERY_CACHE_TTL."""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            ttl = os.getenv("RAG_QUERY_CACHE_TTL")
+            _shared = QueryEmbeddingCache(
+                max_entries=int(os.getenv("RAG_QUERY_CACHE_SIZE", "4096")),
+                ttl=float(ttl) if ttl else None,
+            )
+        return _shared
@@ -1,12 +1,14 @@
-import os
-from sentence_transformers import SentenceTransformer
-from dotenv import load_dotenv
-from openai import OpenAI
-import chromadb
+from modelregistry import get_model, registry, release_model
+from synthesis import ChromaSynthesisMixin
+from chromasync import open_collection, sync_collection
+from indexartifact import ChromaArtifactMixin
+from metrics import metrics
 from typing import Optional
 
 
-class URLRAGChroma:
+class URLRAGChroma(ChromaSynthesisMixin, ChromaArtifactMixin):
+    _artifact_defaults = {"max_tokens": 250}
+
     def __init__(
         self,
         urls: list[tuple[str, str]],   # list of (text, url)
@@ -15,46 +17,49 @@ class URLRAGChroma:
         use_llm: bool = False,
         llm_model: str = "gpt-4o-mini",
         collection_name: str = "rag_urls",
-        persist_path: str = "./rag"
+        persist_path: str = "./rag",
+        answer_cache=None  # SemanticAnswerCache shared across agents
     ):
         # Init embedding model
-        self.model = SentenceTransformer(model_name)
+        self.model_name = model_name
+        self.model = get_model(model_name, lazy=True)
 
         # Init Chroma
+        import chromadb
         self.client = chromadb.PersistentClient(path=persist_path)
-        self.collection = self.client.get_or_create_collection(name=collection_name)
-
-        # Only populate if empty
-        if self.collection.count() == 0:
-            records = [f"{desc} (Source: {url})" for desc, url in urls]
-            sources = [url for _, url in urls]
-            embeddings = self.model.encode(records, convert_to_numpy=True).tolist()
-            self.collection.add(
-                documents=records,
-                embeddings=embeddings,
-                metadatas=[{"source": s} for s in sources],
-                ids=[str(i) for i in range(len(records))]
-            )
+        self.collection = open_collection(self.client, collection_name, registry.variant(model_name))
+
+        # Embed/upsert only new or changed records, drop ones no longer in the list
+        self.sync_report = sync_collection(
+            self.collection, self.model,
+            ((f"{desc} (Source: {url})", {"source": url}) for desc, url in urls)
+        )
 
         self.top_k = top_k
         self.use_llm = use_llm
         self.llm_model = llm_model
+        self.answer_cache = answer_cache
+        self.max_tokens = 250
+        metrics.gauge("rag_kb_entries", self.collection.count(), agent="URLRAGChroma")
 
-        if use_llm:
-            load_dotenv()
-            self.client_llm = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    def close(self):
+        """Hand the shared embedding model back to the registry."""
+        if self.model is not None:
+            release_model(self.model_name)
+            self.model = None
 
     def retrieve(self, query: str):
-        q_vec = self.model.encode([query], convert_to_numpy=True)[0].tolist()
-        results = self.collection.query(query_embeddings=[q_vec], n_results=self.top_k)
+        return self._lookup(query)[1]
 
-        docs = results["documents"][0]
-        metas = results["metadatas"][0]
-        sims = results["distances"][0]
-        return list(zip(docs, metas, sims))
+    def retrieve_batch(self, queries: list[str]):
+        """Retrieve results for multiple queries at once."""
+        return [(q, hits) for q, (_, hits, _) in zip(queries, self._lookup_batch(queries))]
 
     def answer(self, query: str):
-        hits = self.retrieve(query)
+        return self._answer_cached(query, *self._lookup(query))
+
+    def answer_from_hits(self, query: str, hits):
+        """Build the final response from already-retrieved hits."""
         if not hits:
             return "No relevant entries found."
 
@@ -65,13 +70,22 @@ class URLRAGChroma:
             )
 
         # --- LLM synthesis ---
-        context_blocks, source_links = [], []
-        for doc, meta, _ in hits:
-            context_blocks.append(doc)
-            if meta["source"].startswith("http"):
-                source_links.append(meta["source"])
+        with metrics.timer("prompt", agent="URLRAGChroma"):
+            prompt = self._build_prompt(query, hits)
+        with metrics.timer("llm", agent="URLRAGChroma"):
+            resp = self.client_llm.chat.completions.create(
+                model=self.llm_model,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.2,
+                max_tokens=self.max_tokens,
+            )
+        metrics.usage(resp, agent="URLRAGChroma", model=self.llm_model)
+        return resp.choices[0].message.content.strip()
 
-        context = "\n\n".join(context_blocks)
+    def _build_prompt(self, query: str, hits):
+        ctx = self._context(hits)
+        context = ctx.text
+        source_links = [s for s in ctx.sources if s.startswith("http")]
         sources_text = "\n".join(source_links) if source_links else "No external URLs retrieved."
 
         prompt = f"""
@@ -93,14 +107,7 @@ Sources:
 
 Final answer:
 """
-
-        resp = self.client_llm.chat.completions.create(
-            model=self.llm_model,
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.2,
-            max_tokens=250,
-        )
-        return resp.choices[0].message.content.strip()
+        return prompt
 
 
 # -----------------------
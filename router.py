@@ -0,0 +1,185 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from asyncllm import shared_llm
+from contextbuilder import shared_context_builder
+from metrics import metrics
+
+
+def normalize_hits(hits, score_kind: str = "distance"):
+    """
+    (text, source, score) per hit with score in [0, 1], higher is better.
+
+    RAGAgent hits are (text, cosine similarity); the Chroma agents return
+    (doc, meta, distance) with Chroma's default squared-L2 distance, mapped
+    through 1 / (1 + d) so both kinds of score move in the same direction.
+    Agents whose score_kind is "score" (lexical / hybrid JSONRAGChroma)
+    already report [0, 1] scores.
+    """
+    out = []
+    for hit in hits:
+        if len(hit) == 2:
+            text, sim = hit
+            out.append((text, "kb", min(max(float(sim), 0.0), 1.0)))
+        else:
+            doc, meta, dist = hit
+            score = float(dist) if score_kind == "score" else 1.0 / (1.0 + max(float(dist), 0.0))
+            out.append((doc, (meta or {}).get("source", ""), score))
+    return out
+
+
+@dataclass
+class FusedHit:
+    text: str
+    source: str
+    rrf: float
+    score: float                          # best normalized score across agents
+    agents: list[str] = field(default_factory=list)
+
+
+@dataclass
+class RouteResult:
+    query: str
+    hits: list[FusedHit]
+    answer: str | None = None
+    timings: dict[str, float] = field(default_factory=dict)   # agent -> seconds (completed agents only)
+    timed_out: list[str] = field(default_factory=list)
+    failed: dict[str, str] = field(default_factory=dict)      # agent -> error
+
+
+def rrf_fuse(ranked: dict[str, list], k: int = 60, weights: dict[str, float] | None = None):
+    """
+    Reciprocal rank fusion of per-agent normalized hit lists.
+    Identical texts found by several agents are merged and their scores summed.
+    """
+    fused = {}
+    for name, hits in ranked.items():
+        w = (weights or {}).get(name, 1.0)
+        for rank, (text, source, score) in enumerate(hits):
+            entry = fused.get(text)
+            if entry is None:
+                entry = fused[text] = FusedHit(text, source, 0.0, score)
+            entry.rrf += w / (k + rank + 1)
+            entry.score = max(entry.score, score)
+            if name not in entry.agents:
+                entry.agents.append(name)
+    return sorted(fused.values(), key=lambda h: (h.rrf, h.score), reverse=True)
+
+
+class AgentRouter:
+    """
+    Fans one query out to several agents at once and fuses their hits.
+
+    Each agent's retrieve() runs in its own worker thread under a deadline
+    (deadlines[name], else default_deadline seconds); agents that miss it are
+    left out of the fusion, so latency is bounded by the slowest agent within
+    its deadline rather than the sum of all agents. The fused top_k hits go to
+    a single LLM call (self.llm, else the shared AsyncLLM).
+    """
+
+    def __init__(self, agents: dict, top_k: int = 5, default_deadline: float = 2.0,
+                 deadlines: dict[str, float] | None = None, weights: dict[str, float] | None = None,
+                 rrf_k: int = 60, use_llm: bool = True, llm_model: str = "gpt-4o-mini", llm=None,
+                 context_builder=None):
+        self.agents = agents
+        self.top_k = top_k
+        self.default_deadline = default_deadline
+        self.deadlines = deadlines or {}
+        self.weights = weights
+        self.rrf_k = rrf_k
+        self.use_llm = use_llm
+        self.llm_model = llm_model
+        self.llm = llm
+        self.context_builder = context_builder
+        self.max_tokens = 300
+        # Threads of agents that blew their deadline keep running; leave headroom
+        self._pool = ThreadPoolExecutor(max_workers=4 * max(len(agents), 1), thread_name_prefix="router")
+
+    def close(self):
+        self._pool.shutdown(wait=False)
+
+    async def _retrieve_one(self, name, agent, query):
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        hits = await asyncio.wait_for(
+            loop.run_in_executor(self._pool, agent.retrieve, query),
+            self.deadlines.get(name, self.default_deadline),
+        )
+        seconds = time.perf_counter() - start
+        metrics.observe("rag_router_agent_seconds", seconds, agent=name)
+        return hits, seconds
+
+    async def aretrieve(self, query: str) -> RouteResult:
+        names = list(self.agents)
+        outcomes = await asyncio.gather(
+            *(self._retrieve_one(n, self.agents[n], query) for n in names), return_exceptions=True
+        )
+        result = RouteResult(query, [])
+        ranked = {}
+        for name, outcome in zip(names, outcomes):
+            if isinstance(outcome, asyncio.TimeoutError):
+                metrics.inc("rag_router_timeouts_total", agent=name)
+                result.timed_out.append(name)
+            elif isinstance(outcome, BaseException):
+                result.failed[name] = repr(outcome)
+            else:
+                hits, seconds = outcome
+                ranked[name] = normalize_hits(hits, getattr(self.agents[name], "score_kind", "distance"))
+                result.timings[name] = seconds
+        result.hits = rrf_fuse(ranked, self.rrf_k, self.weights)[:self.top_k]
+        return result
+
+    async def aanswer(self, query: str) -> RouteResult:
+        result = await self.aretrieve(query)
+        if not result.hits:
+            result.answer = "No relevant entries found."
+        elif not self.use_llm:
+            result.answer = "\n---\n".join(
+                f"{h.text}\n(source: {h.source}, agents: {', '.join(h.agents)}, score: {h.score:.2f})"
+                for h in result.hits
+            )
+        else:
+            prompt = self._build_prompt(query, result.hits)
+            with metrics.timer("llm", agent="AgentRouter"):
+                result.answer = await (self.llm or shared_llm()).complete(
+                    prompt, self.llm_model, self.max_tokens, labels={"agent": "AgentRouter"}
+                )
+        return result
+
+    def retrieve(self, query: str) -> RouteResult:
+        """Blocking wrapper around aretrieve (not for use inside a running loop)."""
+        return asyncio.run(self.aretrieve(query))
+
+    def answer(self, query: str) -> RouteResult:
+        """Blocking wrapper around aanswer (not for use inside a running loop)."""
+        return asyncio.run(self.aanswer(query))
+
+    def _build_prompt(self, query: str, hits):
+        ctx = (self.context_builder or shared_context_builder()).build(
+            [(h.text, h.source) for h in hits], model=self.llm_model, agent="AgentRouter"
+        )
+        context = ctx.text
+        source_links = [s for s in ctx.sources if s.startswith("http")]
+        sources_text = "\n".join(source_links) if source_links else "No external URLs retrieved."
+
+        prompt = f"""
+You are a helpful medical assistant.
+Use the retrieved information from several knowledge sources to answer the user's question clearly and concisely.
+- Summarize key points; the snippets are ordered by relevance.
+- If there are URLs, include them as citations at the end.
+- Do not copy text verbatim; synthesize into a clean short answer.
+- Always include a disclaimer: "This information is for educational purposes only and not a substitute for professional medical advice."
+
+User question:
+{query}
+
+Retrieved knowledge:
+{context}
+
+Sources:
+{sources_text}
+
+Final answer:
+"""
+        return prompt
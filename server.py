@@ -0,0 +1,256 @@
+"""
+HTTP service for the RAG agents.
+
+    POST /retrieve  {"query": "...", "agent": "meddialog"}  -> {"hits": [...]}
+    POST /answer    {"query": "...", "agent": "meddialog"}  -> {"answer": "..."}
+    POST /answer    {..., "stream": true}                    -> answer text, chunked as generated
+    GET  /healthz                                             -> {"status": "ok", ...}
+    GET  /metrics                                             -> Prometheus text (RAG_METRICS=1)
+
+"agent" may be omitted when only one agent is served. Concurrent queries for
+the same agent are coalesced for up to --max-wait-ms and embedded together
+through the agent's _lookup_batch(); when more than --max-pending queries are
+waiting the service answers 503 instead of queueing without bound.
+
+    python server.py --agents meddialog,hybrid --port 8080
+"""
+import argparse
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from aiohttp import web
+from metrics import metrics
+from querycache import shared_query_cache
+
+
+class Overloaded(Exception):
+    pass
+
+
+class Coalescer:
+    """
+    Gathers concurrent lookups for one agent into batches.
+
+    A batch is dispatched as soon as it holds max_batch queries or max_wait
+    seconds after its first query arrived. Batches run one at a time in a
+    dedicated worker thread, so the next batch fills up while the current one
+    is being embedded.
+    """
+
+    def __init__(self, agent, max_batch: int = 32, max_wait: float = 0.005, max_pending: int = 1024):
+        self.agent = agent
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.max_pending = max_pending
+        self.pending = 0
+        self.batches = 0
+        self.batched_queries = 0
+        self._queue = None
+        self._task = None
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="coalescer")
+
+    def start(self):
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._pool.shutdown(wait=False)
+
+    async def lookup(self, query: str):
+        """(query embedding, hits, hit ids) for query, computed as part of a batch."""
+        if self.pending >= self.max_pending:
+            metrics.inc("rag_server_rejected_total")
+            raise Overloaded()
+        self.pending += 1
+        fut = asyncio.get_running_loop().create_future()
+        await self._queue.put((query, fut))
+        try:
+            return await fut
+        finally:
+            self.pending -= 1
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # Callers that gave up (client disconnect) are dropped from the batch
+            batch = [(q, f) for q, f in batch if not f.done()]
+            if not batch:
+                continue
+            queries = [q for q, _ in batch]
+            try:
+                results = await loop.run_in_executor(self._pool, self.agent._lookup_batch, queries)
+            except Exception as e:
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+                continue
+            self.batches += 1
+            self.batched_queries += len(batch)
+            metrics.inc("rag_server_batches_total")
+            metrics.inc("rag_server_batched_queries_total", len(batch))
+            for (_, fut), result in zip(batch, results):
+                if not fut.done():
+                    fut.set_result(result)
+
+    def stats(self):
+        return {
+            "pending": self.pending,
+            "batches": self.batches,
+            "mean_batch": self.batched_queries / self.batches if self.batches else 0.0,
+        }
+
+
+def hit_json(hit, score_kind: str = "distance"):
+    if len(hit) == 2:
+        text, score = hit
+        return {"text": text, "score": float(score)}
+    doc, meta, value = hit
+    return {"text": doc, "metadata": meta, score_kind: float(value)}
+
+
+def create_app(agents: dict, max_batch: int = 32, max_wait_ms: float = 5.0, max_pending: int = 1024,
+               warmup: bool = True):
+    coalescers = {name: Coalescer(agent, max_batch, max_wait_ms / 1000.0, max_pending)
+                  for name, agent in agents.items()}
+    started = time.time()
+
+    async def on_startup(app):
+        # Models and clients are built lazily; pay for them before the first request
+        if warmup:
+            loop = asyncio.get_running_loop()
+            for agent in agents.values():
+                if hasattr(agent, "warmup"):
+                    # /answer goes through the async client, built per event loop
+                    await loop.run_in_executor(None, lambda a=agent: a.warmup(llm=False))
+        for c in coalescers.values():
+            c.start()
+
+    async def on_cleanup(app):
+        for c in coalescers.values():
+            await c.stop()
+
+    async def parse(request):
+        try:
+            body = await request.json()
+        except ValueError:
+            raise web.HTTPBadRequest(text="body must be JSON")
+        query = body.get("query") if isinstance(body, dict) else None
+        if not isinstance(query, str) or not query.strip():
+            raise web.HTTPBadRequest(text="'query' must be a non-empty string")
+        name = body.get("agent") or (next(iter(agents)) if len(agents) == 1 else None)
+        if name not in agents:
+            raise web.HTTPNotFound(text=f"unknown agent {name!r}; one of {sorted(agents)}")
+        return name, query, bool(body.get("stream"))
+
+    async def lookup(name, query):
+        try:
+            return await coalescers[name].lookup(query)
+        except Overloaded:
+            raise web.HTTPServiceUnavailable(text="too many pending queries", headers={"Retry-After": "1"})
+
+    async def retrieve(request):
+        name, query, _ = await parse(request)
+        _, hits, _ = await lookup(name, query)
+        kind = getattr(agents[name], "score_kind", "distance")
+        return web.json_response({"agent": name, "hits": [hit_json(h, kind) for h in hits]})
+
+    async def answer(request):
+        started = time.perf_counter()
+        name, query, stream = await parse(request)
+        q_vec, hits, ids = await lookup(name, query)
+        if not stream:
+            text = await agents[name]._asynthesize(query, q_vec, hits, ids)
+            return web.json_response({"agent": name, "answer": text})
+
+        resp = web.StreamResponse(headers={"Content-Type": "text/plain; charset=utf-8", "X-Agent": name})
+        resp.enable_chunked_encoding()
+        await resp.prepare(request)
+        async for piece in agents[name]._astream_synthesize(query, q_vec, hits, ids, started):
+            await resp.write(piece.encode("utf-8"))
+        await resp.write_eof()
+        return resp
+
+    async def prometheus(request):
+        return web.Response(text=metrics.render_prometheus(), content_type="text/plain")
+
+    async def healthz(request):
+        return web.json_response({
+            "status": "ok",
+            "uptime_s": round(time.time() - started, 1),
+            "agents": {name: c.stats() for name, c in coalescers.items()},
+            "query_cache": shared_query_cache().stats(),
+        })
+
+    app = web.Application()
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    app.router.add_post("/retrieve", retrieve)
+    app.router.add_post("/answer", answer)
+    app.router.add_get("/healthz", healthz)
+    app.router.add_get("/metrics", prometheus)
+    return app
+
+
+def build_demo_agents(names, use_llm):
+    agents = {}
+    for name in names:
+        if name == "meddialog":
+            from RAGagentwithmeddialog import RAGAgent
+            agents[name] = RAGAgent("meddialog.json", use_llm=use_llm)
+        elif name == "hybrid":
+            from RAGagentmultianswer import JSONRAGChroma
+            agents[name] = JSONRAGChroma(
+                "meddialog.json", answer_fields=["answer_chatgpt", "answer_icliniq", "answer_chatdoctor"],
+                mode="concat", use_llm=use_llm
+            )
+        elif name == "url":
+            from ragwithoutmeddialog import URLRAGChroma
+            agents[name] = URLRAGChroma([
+                ("Morning-after pill guide", "https://www.drugs.com/mtm/morning-after.html"),
+                ("Emergency contraception info", "https://www.drugs.com/condition/postcoital-contraception.html"),
+            ], use_llm=use_llm)
+        elif name == "scrape":
+            from Ragwithwebscraping import ScrapeChroma
+            agents[name] = ScrapeChroma([
+                "https://www.drugs.com/mtm/morning-after.html",
+                "https://www.plannedparenthood.org/learn/morning-after-pill-emergency-contraception",
+            ], use_llm=use_llm)
+        else:
+            raise SystemExit(f"unknown agent: {name}")
+    return agents
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--agents", default="meddialog", help="comma-separated: meddialog, hybrid, url, scrape")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--max-batch", type=int, default=32)
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    parser.add_argument("--max-pending", type=int, default=1024)
+    parser.add_argument("--no-llm", action="store_true", help="return raw hits from /answer")
+    parser.add_argument("--no-warmup", action="store_true", help="load models on the first request instead")
+    args = parser.parse_args()
+
+    agents = build_demo_agents(args.agents.split(","), use_llm=not args.no_llm)
+    web.run_app(
+        create_app(agents, args.max_batch, args.max_wait_ms, args.max_pending, warmup=not args.no_warmup),
+        host=args.host, port=args.port,
+    )
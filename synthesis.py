@@ -0,0 +1,277 @@
+import asyncio
+import hashlib
+import time
+from asyncllm import shared_llm, sync_client
+from contextbuilder import shared_context_builder
+from metrics import metrics
+from modelregistry import registry
+from querycache import shared_query_cache
+
+DISCLAIMER = ("This information is for educational purposes only "
+              "and not a substitute for professional medical advice.")
+
+
+class SynthesisMixin:
+    """
+    Answering paths shared by the agents.
+
+    Agents provide _lookup(query) -> (query embedding or None, hits, hit ids),
+    answer_from_hits() and _build_prompt(), and may override _lookup_batch()
+    to embed many queries in one pass. stream_answer() / astream_answer()
+    yield the answer as it is generated and end with the disclaimer and
+    source URLs when the text lacks them. _encode_queries() goes through the
+    process-wide query-embedding cache (or self.query_cache, if set), and
+    _context() through the shared ContextBuilder (or self.context_builder).
+    The embedding model and the OpenAI client are only built on first use;
+    warmup() builds them up front. Set self.llm to use a specific AsyncLLM
+    instead of the shared one, and self.answer_cache to a SemanticAnswerCache
+    to skip the LLM for near-duplicate questions.
+    """
+
+    llm = None
+    answer_cache = None
+    query_cache = None
+    context_builder = None
+    _client_llm = None
+
+    @property
+    def client_llm(self):
+        """Blocking OpenAI client for answer_from_hits (shared unless one is assigned)."""
+        if self._client_llm is None:
+            self._client_llm = sync_client()
+        return self._client_llm
+
+    @client_llm.setter
+    def client_llm(self, client):
+        self._client_llm = client
+
+    def _encode_queries(self, queries):
+        # Keyed on the variant: int8 query vectors must not meet an fp32 index
+        return (self.query_cache or shared_query_cache()).encode(registry.variant(self.model_name), self.model, queries)
+
+    def warmup(self, llm: bool = True):
+        """Load the embedding model (and the blocking LLM client) now instead of on the first query."""
+        if getattr(self, "model", None) is not None:
+            self.model.encode(["warmup"], convert_to_numpy=True)
+        if llm and self.use_llm:
+            self.client_llm
+        return self
+
+    def _cache(self):
+        # Raw (non-LLM) answers are cheap, only synthesized ones are cached
+        return self.answer_cache if self.use_llm else None
+
+    def _cache_scope(self) -> str:
+        """Answer-cache scope: agent class, LLM model, token limit and prompt template."""
+        cls = type(self)
+        prompt = cls.__dict__.get("_prompt_digest")
+        if prompt is None:
+            code = cls._build_prompt.__code__
+            prompt = hashlib.blake2b(code.co_code + repr(code.co_consts).encode("utf-8"), digest_size=8).hexdigest()
+            cls._prompt_digest = prompt
+        return f"{cls.__name__}|{self.llm_model}|{self.max_tokens}|{prompt}"
+
+    def _cache_get(self, cache, q_vec, ids):
+        cached = cache.get(q_vec, ids, self._cache_scope())
+        metrics.inc("rag_answer_cache_total", agent=type(self).__name__,
+                    result="miss" if cached is None else "hit")
+        return cached
+
+    def _cache_put(self, cache, q_vec, ids, answer):
+        cache.put(q_vec, ids, answer, self._cache_scope())
+
+    def _answer_cached(self, query, q_vec, hits, ids):
+        # Lexical-only lookups have no query embedding to key the cache on
+        cache = self._cache() if q_vec is not None else None
+        if cache is not None and hits:
+            cached = self._cache_get(cache, q_vec, ids)
+            if cached is not None:
+                return cached
+        answer = self.answer_from_hits(query, hits)
+        if cache is not None and hits:
+            self._cache_put(cache, q_vec, ids, answer)
+        return answer
+
+    async def _asynthesize(self, query, q_vec, hits, ids):
+        if not hits or not self.use_llm:
+            return self.answer_from_hits(query, hits)
+        cache = self._cache() if q_vec is not None else None
+        if cache is not None:
+            cached = self._cache_get(cache, q_vec, ids)
+            if cached is not None:
+                return cached
+        agent = type(self).__name__
+        with metrics.timer("prompt", agent=agent):
+            prompt = self._build_prompt(query, hits)
+        with metrics.timer("llm", agent=agent):
+            answer = await (self.llm or shared_llm()).complete(
+                prompt, self.llm_model, self.max_tokens, labels={"agent": agent}
+            )
+        if cache is not None:
+            self._cache_put(cache, q_vec, ids, answer)
+        return answer
+
+    def _lookup_batch(self, queries):
+        return [self._lookup(q) for q in queries]
+
+    def _context(self, hits):
+        """Deduplicated, token-budgeted prompt context for (text, score) or (doc, meta, score) hits."""
+        items = [(h[0], (h[1] or {}).get("source", "") if len(h) == 3 else "") for h in hits]
+        return (self.context_builder or shared_context_builder()).build(
+            items, model=self.llm_model, agent=type(self).__name__
+        )
+
+    def _sources(self, hits):
+        """Distinct http(s) sources of (doc, meta, score) hits, in rank order (collapsed duplicates included)."""
+        found = []
+        for h in hits:
+            if len(h) == 3 and h[1]:
+                found.append(str(h[1].get("source", "")))
+                found.extend(h[1].get("sources", "").split(" | "))
+        return list(dict.fromkeys(s for s in found if s.startswith("http")))
+
+    def _footer(self, text, hits):
+        parts = []
+        if DISCLAIMER.lower() not in text.lower():
+            parts.append(DISCLAIMER)
+        missing = [u for u in self._sources(hits) if u not in text]
+        if missing:
+            parts.append("Sources:\n" + "\n".join(f"- {u}" for u in missing))
+        return "\n\n" + "\n\n".join(parts) if parts else ""
+
+    def _stream_start(self, query, q_vec, hits, ids):
+        """Whole answer text if nothing needs generating, else (prompt, cache)."""
+        if not hits:
+            return self.answer_from_hits(query, hits), None
+        if not self.use_llm:
+            text = self.answer_from_hits(query, hits)
+            return text + self._footer(text, hits), None
+        cache = self._cache() if q_vec is not None else None
+        if cache is not None:
+            cached = self._cache_get(cache, q_vec, ids)
+            if cached is not None:
+                # The cache holds bare model text, as answer() stores it
+                return cached + self._footer(cached, hits), None
+        with metrics.timer("prompt", agent=type(self).__name__):
+            return None, (self._build_prompt(query, hits), cache)
+
+    def _stream_done(self, parts, hits, q_vec, ids, cache, started):
+        text = "".join(parts)
+        footer = self._footer(text, hits)
+        metrics.observe("rag_stream_seconds", time.perf_counter() - started, agent=type(self).__name__)
+        # An empty stream (cut off or filtered) must not become the cached answer
+        if cache is not None and text.strip():
+            self._cache_put(cache, q_vec, ids, text.strip())
+        return footer
+
+    def stream_answer(self, query):
+        """Yield the answer in pieces as the LLM generates it (blocking generator)."""
+        agent = type(self).__name__
+        started = time.perf_counter()
+        q_vec, hits, ids = self._lookup(query)
+        whole, pending = self._stream_start(query, q_vec, hits, ids)
+        if whole is not None:
+            yield whole
+            return
+        prompt, cache = pending
+
+        resp = self.client_llm.chat.completions.create(
+            model=self.llm_model,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.2,
+            max_tokens=self.max_tokens,
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+        parts = []
+        for chunk in resp:
+            if getattr(chunk, "usage", None):
+                metrics.usage(chunk, agent=agent, model=self.llm_model)
+            if not chunk.choices or not chunk.choices[0].delta.content:
+                continue
+            if not parts:
+                metrics.observe("rag_ttft_seconds", time.perf_counter() - started, agent=agent)
+            parts.append(chunk.choices[0].delta.content)
+            yield parts[-1]
+        footer = self._stream_done(parts, hits, q_vec, ids, cache, started)
+        if footer:
+            yield footer
+
+    async def astream_answer(self, query):
+        """Async generator form of stream_answer(); the LLM call goes through AsyncLLM."""
+        agent = type(self).__name__
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        q_vec, hits, ids = await loop.run_in_executor(None, self._lookup, query)
+        async for piece in self._astream_synthesize(query, q_vec, hits, ids, started, agent):
+            yield piece
+
+    async def _astream_synthesize(self, query, q_vec, hits, ids, started=None, agent=None):
+        agent = agent or type(self).__name__
+        started = started or time.perf_counter()
+        whole, pending = self._stream_start(query, q_vec, hits, ids)
+        if whole is not None:
+            yield whole
+            return
+        prompt, cache = pending
+
+        parts = []
+        async for piece in (self.llm or shared_llm()).stream(
+            prompt, self.llm_model, self.max_tokens, labels={"agent": agent}
+        ):
+            if not parts:
+                metrics.observe("rag_ttft_seconds", time.perf_counter() - started, agent=agent)
+            parts.append(piece)
+            yield piece
+        footer = self._stream_done(parts, hits, q_vec, ids, cache, started)
+        if footer:
+            yield footer
+
+    async def aanswer(self, query):
+        loop = asyncio.get_running_loop()
+        q_vec, hits, ids = await loop.run_in_executor(None, self._lookup, query)
+        return await self._asynthesize(query, q_vec, hits, ids)
+
+    async def aanswer_batch(self, queries):
+        """
+        Answers in query order. Retrieval runs one query at a time in a worker
+        thread while LLM calls for earlier queries are already in flight.
+        """
+        loop = asyncio.get_running_loop()
+        tasks = []
+        for q in queries:
+            q_vec, hits, ids = await loop.run_in_executor(None, self._lookup, q)
+            tasks.append(asyncio.create_task(self._asynthesize(q, q_vec, hits, ids)))
+        return await asyncio.gather(*tasks)
+
+    def answer_batch(self, queries):
+        """Blocking wrapper around aanswer_batch (not for use inside a running loop)."""
+        return asyncio.run(self.aanswer_batch(queries))
+
+
+class ChromaSynthesisMixin(SynthesisMixin):
+    """
+    SynthesisMixin for agents over a Chroma collection (or an ArtifactCollection):
+    dense lookups embed the whole batch in one pass and send one collection query.
+    """
+
+    def _lookup_batch(self, queries):
+        """(query embedding, hits, hit ids) per query; one encode and one collection query."""
+        agent = type(self).__name__
+        with metrics.timer("encode", agent=agent):
+            q_vecs = self._encode_queries(queries)
+        with metrics.timer("search", agent=agent):
+            results = self.collection.query(query_embeddings=q_vecs.tolist(), n_results=self.top_k)
+        out = []
+        for i, q_vec in enumerate(q_vecs):
+            if not results["ids"][i]:
+                metrics.inc("rag_empty_results_total", agent=agent)
+            docs = results["documents"][i] # type: ignore
+            metas = results["metadatas"][i] # type: ignore
+            sims = results["distances"][i] # type: ignore
+            out.append((q_vec, list(zip(docs, metas, sims)), results["ids"][i]))
+        return out
+
+    def _lookup(self, query):
+        """Query embedding, hits and hit ids for a single query."""
+        return self._lookup_batch([query])[0]
@@ -0,0 +1,67 @@
+import os
+import sys
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark import HashingEncoder, StubLLMHandler, serve  # noqa: E402
+
+
+@pytest.fixture
+def encoder():
+    return HashingEncoder(dim=64)
+
+
+class ScriptedHandler(BaseHTTPRequestHandler):
+    """Answers each path with the next (status, body) from its script; the last one repeats."""
+
+    scripts = {}
+    hits = {}
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        script = self.scripts.get(self.path, [(404, "")])
+        n = self.hits.get(self.path, 0)
+        self.hits[self.path] = n + 1
+        status, body = script[min(n, len(script) - 1)]
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+@pytest.fixture
+def page_server():
+    """(base URL, scripts, hits) of a local server driven by per-path scripts."""
+    handler = type("Handler", (ScriptedHandler,), {"scripts": {}, "hits": {}})
+    return serve(handler), handler.scripts, handler.hits
+
+
+@pytest.fixture
+def llm_server():
+    """(base URL, request log) of a local OpenAI-compatible stub; set .delay on the log's handler to slow it."""
+    class Handler(StubLLMHandler):
+        requests = []
+
+        def do_POST(self):
+            self.requests.append(self.path)
+            super().do_POST()
+
+    return serve(Handler) + "/v1", Handler
+
+
+@pytest.fixture
+def kb_file(tmp_path):
+    import json
+
+    rows = [{"input": f"Can I take the pill after {i} days of unprotected sex?",
+             "answer_chatgpt": f"Emergency contraception works best within {i} days."} for i in range(1, 21)]
+    path = tmp_path / "kb.json"
+    path.write_text(json.dumps(rows), encoding="utf-8")
+    return str(path)
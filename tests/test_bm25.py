@@ -0,0 +1,74 @@
+import pytest
+
+from bm25 import BM25Index, query_terms, tokenize
+from modelregistry import registry
+from RAGagentmultianswer import JSONRAGChroma
+
+DOCS = {
+    "ec": "Emergency contraception pills work best within three days.",
+    "ipill": "The i-pill is an emergency contraceptive pill.",
+    "ibu": "Ibuprofen dosage for adults is 200 to 400 mg.",
+    "iron": "Iron supplements help with anaemia during pregnancy.",
+}
+
+
+@pytest.fixture
+def index():
+    idx = BM25Index()
+    idx.add(DOCS.items())
+    return idx
+
+
+def test_tokenize_keeps_hyphenated_terms_whole_and_split():
+    assert tokenize("The I-Pill, 400mg") == ["the", "i-pill", "i", "pill", "400mg"]
+
+
+def test_query_terms_drop_stopwords():
+    assert query_terms("what is the dosage of the ibuprofen") == ["dosage", "ibuprofen"]
+    assert query_terms("who is it") == []
+
+
+def test_search_ranks_matching_documents(index):
+    found = index.search("ibuprofen dosage", 3)
+    assert [rid for rid, _, _ in found] == ["ibu"]
+    assert found[0][2] == pytest.approx(1.0)
+
+
+def test_stopwords_do_not_match(index):
+    assert index.search("what is the", 3) == []
+    assert [rid for rid, _, _ in index.search("is the i-pill an option", 3)][0] == "ipill"
+
+
+def test_unindexed_terms_lower_coverage(index):
+    # Only "dosage" is indexed; the rest of the question is about something else
+    found = index.search("what is the paracetamol dosage for a child", 3)
+    assert [rid for rid, _, _ in found] == ["ibu"]
+    assert found[0][2] < 0.5
+
+
+def test_full_match_score_ignores_stopwords(index):
+    assert index.full_match_score("the ibuprofen dosage") == pytest.approx(index.full_match_score("ibuprofen dosage"))
+    assert index.full_match_score("paracetamol") == 0.0
+
+
+def test_remove_and_reuse_slots(index, tmp_path):
+    index.remove(["ibu"])
+    assert index.search("ibuprofen", 3) == []
+    index.add([("para", "Paracetamol dosage for a child depends on weight.")])
+    assert len(index) == 4
+    assert index.search("paracetamol dosage child", 3)[0][0] == "para"
+
+    index.path = str(tmp_path / "bm25.json")
+    index.save()
+    loaded = BM25Index(index.path)
+    assert loaded.search("paracetamol dosage child", 3) == index.search("paracetamol dosage child", 3)
+
+
+def test_hybrid_short_circuit_needs_the_whole_query(kb_file, encoder, tmp_path):
+    registry.register("test-hashing", encoder)
+    agent = JSONRAGChroma(kb_file, model_name="test-hashing", top_k=1, persist_path=str(tmp_path / "db"),
+                          collection_name="kb_test", search_mode="hybrid", lexical_cutoff=0.8)
+    # Embedding skipped only when the lexical hits cover the question
+    assert agent._lookup_mixed("emergency contraception after unprotected sex")[0] is None
+    assert agent._lookup_mixed("what is the paracetamol dosage for a child")[0] is not None
+    agent.close()
@@ -0,0 +1,98 @@
+import chromadb
+import pytest
+
+from chromasync import open_collection, record_id, sync_collection
+
+
+class CountingEncoder:
+    def __init__(self, encoder):
+        self.encoder = encoder
+        self.rows = 0
+
+    def encode(self, sentences, **kwargs):
+        self.rows += len(sentences)
+        return self.encoder.encode(sentences, **kwargs)
+
+
+@pytest.fixture
+def collection(tmp_path):
+    client = chromadb.PersistentClient(path=str(tmp_path / "chroma"))
+    return client.get_or_create_collection(name="kb_test")
+
+
+def records(n, changed=()):
+    for i in range(n):
+        answer = f"changed answer {i}" if i in changed else f"answer {i}"
+        yield f"Q: question {i}\nA: {answer}", {"source": "json", "row": i}
+
+
+def test_first_sync_adds_everything(collection, encoder):
+    model = CountingEncoder(encoder)
+    report = sync_collection(collection, model, records(30), batch_size=8)
+    assert (report.added, report.deleted, report.unchanged) == (30, 0, 0)
+    assert collection.count() == 30
+    assert model.rows == 30
+
+
+def test_resync_of_same_kb_embeds_nothing(collection, encoder):
+    sync_collection(collection, encoder, records(30))
+    model = CountingEncoder(encoder)
+    report = sync_collection(collection, model, records(30))
+    assert not report.changed
+    assert report.unchanged == 30
+    assert model.rows == 0
+
+
+def test_kb_change_adds_and_deletes(collection, encoder):
+    sync_collection(collection, encoder, records(30))
+    model = CountingEncoder(encoder)
+    deleted, upserted = [], []
+    report = sync_collection(collection, model, records(25, changed={3, 7}), batch_size=4,
+                             on_upsert=upserted.extend, on_delete=deleted.extend)
+    # 2 edited rows re-embedded; their old versions and the 5 dropped rows deleted
+    assert (report.added, report.deleted, report.unchanged) == (2, 7, 23)
+    assert model.rows == 2
+    assert collection.count() == 25
+    assert len(deleted) == 7 and len(upserted) == 2
+    docs = set(collection.get()["documents"])
+    assert "Q: question 3\nA: changed answer 3" in docs
+    assert "Q: question 3\nA: answer 3" not in docs
+    assert "Q: question 29\nA: answer 29" not in docs
+
+
+def test_keep_ids_and_prune(collection, encoder):
+    sync_collection(collection, encoder, records(10))
+    keep = {record_id(*r) for r in records(10)}
+    assert sync_collection(collection, encoder, records(0), keep_ids=keep).deleted == 0
+    assert sync_collection(collection, encoder, records(0), prune=False).deleted == 0
+    assert collection.count() == 10
+    assert sync_collection(collection, encoder, records(0)).deleted == 10
+    assert collection.count() == 0
+
+
+def test_duplicate_records_stored_once(collection, encoder):
+    report = sync_collection(collection, encoder, list(records(5)) * 2)
+    assert report.added == 5
+    assert collection.count() == 5
+
+
+def test_record_id_follows_merged_sources():
+    doc = "Q: q\nA: a"
+    assert record_id(doc, {"source": "json"}) == record_id(doc, {"source": "json", "row": 1})
+    assert record_id(doc, {"source": "json"}) != record_id(doc, {"source": "url"})
+    assert record_id(doc, {"source": "json", "sources": "a | b"}) != record_id(doc, {"source": "json", "sources": "a"})
+
+
+def test_open_collection_rebuilds_on_a_new_embedding_variant(tmp_path, encoder):
+    client = chromadb.PersistentClient(path=str(tmp_path / "chroma"))
+    # A collection from before the stamp is kept as it is
+    sync_collection(client.get_or_create_collection(name="kb_test"), encoder, records(10))
+    collection = open_collection(client, "kb_test", "m")
+    assert collection.count() == 10 and collection.metadata["embedding"] == "m"
+    assert open_collection(client, "kb_test", "m").count() == 10
+
+    collection = open_collection(client, "kb_test", "m.int8")
+    assert collection.count() == 0 and collection.metadata["embedding"] == "m.int8"
+    model = CountingEncoder(encoder)
+    assert sync_collection(collection, model, records(10)).added == 10
+    assert model.rows == 10
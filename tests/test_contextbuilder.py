@@ -0,0 +1,75 @@
+import logging
+
+import pytest
+
+import contextbuilder
+from contextbuilder import FALLBACK_MARGIN, ContextBuilder, TokenCounter
+
+needs_fallback = pytest.mark.skipif(TokenCounter().exact, reason="tiktoken is installed")
+
+
+def hits(n, words=40):
+    return [(f"Q: question {i}?\nA: " + " ".join(f"dose{i} 12.5mg word{j}" for j in range(words)), "") for i in range(n)]
+
+
+@pytest.mark.parametrize("budget", [64, 200, 600])
+def test_budget_is_never_exceeded(budget):
+    builder = ContextBuilder(max_tokens=budget)
+    ctx = builder.build(hits(20))
+    limit = budget if builder.counter().exact else int(budget * FALLBACK_MARGIN)
+    assert ctx.tokens <= limit
+    assert ctx.dropped["budget"] > 0
+    assert ctx.saved > 0
+
+
+@needs_fallback
+def test_fallback_counts_numbers_and_non_latin_text():
+    tc = TokenCounter()
+    assert tc.count("Take 1.5 mg within 72 hours.") >= 9
+    assert tc.count("Примите таблетку в течение 72 часов") >= 7
+
+
+@needs_fallback
+def test_fallback_truncate_fits_with_ellipsis():
+    tc = TokenCounter()
+    text = "Take 1500 mg of levonorgestrel within 72 hours, 12.5% dose. " * 20
+    for max_tokens in (2, 5, 20, 50):
+        cut = tc.truncate(text, max_tokens)
+        assert tc.count(cut) <= max_tokens
+        assert cut == "" or cut.endswith(" ...")
+
+
+@needs_fallback
+def test_fallback_warns_once(monkeypatch, caplog):
+    monkeypatch.setattr(contextbuilder, "_warned", False)
+    with caplog.at_level(logging.WARNING, logger="rag.context"):
+        TokenCounter()
+        TokenCounter("gpt-4o")
+    assert len([r for r in caplog.records if "tiktoken" in r.getMessage()]) == 1
+
+
+def test_groups_answers_to_the_same_question():
+    items = [
+        ("Q: Is it safe?\nA (answer_chatgpt): Yes, for most people.", ""),
+        ("Q: Is it safe?\nA (answer_icliniq): Generally safe, see a doctor.", ""),
+        ("Q: Is it safe?\nA (answer_chatdoctor): Yes, for most people.", ""),
+    ]
+    ctx = ContextBuilder().build(items)
+    assert ctx.text.count("Q: Is it safe?") == 1
+    assert ctx.text.count("Yes, for most people.") == 1
+    assert ctx.dropped == {"grouped": 2, "duplicate": 1}
+
+
+def test_drops_near_duplicates_and_overlap():
+    page = "https://example.org/pill"
+    text = "The pill works best when taken as soon as possible after unprotected sex, ideally within a day."
+    items = [
+        (text, page),
+        (text[40:] + " It can cause nausea and spotting for a few days afterwards in some people.", page),
+        (text + " Really.", "https://example.org/other"),
+    ]
+    ctx = ContextBuilder().build(items)
+    assert ctx.dropped["overlap"] == 1
+    assert ctx.dropped["near_duplicate"] == 1
+    assert ctx.text.count("ideally within a day.") == 1
+    assert ctx.sources == [page]
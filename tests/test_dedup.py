@@ -0,0 +1,76 @@
+import json
+
+import numpy as np
+
+from dedup import MinHasher, cluster_signatures, collapse_records, lsh_bands, merge_metadata
+
+BASE = [
+    "Take the morning after pill as soon as possible after unprotected sex for the best effect",
+    "Spotting and a delayed period are common side effects and usually settle within a cycle",
+    "See a doctor if your period is more than a week late or you have severe abdominal pain",
+    "The copper IUD is the most effective form of emergency contraception up to five days after",
+]
+
+
+def kb():
+    """Four distinct answers, each repeated under other sources with small edits."""
+    rows = []
+    for i, text in enumerate(BASE):
+        rows.append((f"Q: question {i}\nA (answer_chatgpt): {text}.", {"source": f"https://a.example/{i}"}))
+    rows.append((f"Q: question 0\nA (answer_icliniq): {BASE[0]}.", {"source": "https://b.example/0"}))
+    rows.append((f"Q: question 1\nA: {BASE[1]}!", {"source": "https://c.example/1"}))
+    rows.append((f"Q: question 0\nA: {BASE[0]} too.", {"source": "https://a.example/0"}))
+    return rows
+
+
+def test_signatures_do_not_depend_on_slicing_or_batching():
+    texts = [t * (i + 1) for i, t in enumerate(BASE)] + ["", "one", "one two"]
+    full = MinHasher().signatures(texts)
+    assert np.array_equal(MinHasher(slice_size=3).signatures(texts), full)
+    assert np.array_equal(np.stack([MinHasher().signature(t) for t in texts]), full)
+
+
+def test_similarity_estimate():
+    hasher = MinHasher(num_perm=256)
+    a, b, c = hasher.signatures([BASE[0], BASE[0] + " today", BASE[2]])
+    assert (a == b).mean() > 0.7
+    assert (a == c).mean() < 0.1
+
+
+def test_lsh_bands_cover_num_perm():
+    for threshold in (0.5, 0.8, 0.9):
+        bands, rows = lsh_bands(threshold, 64)
+        assert bands * rows == 64
+
+
+def test_cluster_representative_is_lowest_index():
+    sigs = np.array([[1] * 64, [2] * 64, [1] * 64, [2] * 63 + [3], [5] * 64], dtype=np.uint32)
+    assert cluster_signatures(sigs, 0.8).tolist() == [0, 1, 0, 1, 4]
+
+
+def test_collapse_merges_metadata():
+    rows = kb()
+    records, report, rep = collapse_records(lambda: iter(rows), threshold=0.7, batch_size=2)
+    out = list(records)
+    assert (report.records_in, report.records_out, report.clusters, report.largest) == (7, 4, 2, 3)
+    assert rep.tolist() == [0, 1, 2, 3, 0, 1, 0]
+    assert [doc for doc, _ in out] == [doc for doc, _ in rows[:4]]
+
+    meta = out[0][1]
+    assert meta["source"] == "https://a.example/0"
+    assert meta["sources"] == "https://a.example/0 | https://b.example/0"
+    assert meta["duplicates"] == 2
+    assert [m["source"] for m in json.loads(meta["merged_from"])] == [
+        "https://a.example/0", "https://b.example/0", "https://a.example/0"]
+    assert out[1][1]["sources"] == "https://a.example/1 | https://c.example/1"
+    assert "sources" not in out[2][1]
+
+
+def test_merge_metadata_keeps_the_first_record():
+    merged = merge_metadata([{"source": "x", "row": 1}, None, {"source": "y", "row": 2}])
+    assert (merged["source"], merged["row"], merged["sources"], merged["duplicates"]) == ("x", 1, "x | y", 2)
+
+
+def test_nothing_to_collapse():
+    records, report, rep = collapse_records(lambda: iter([]))
+    assert list(records) == [] and report.records_in == 0 and report.shrink == 0.0
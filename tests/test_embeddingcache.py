@@ -0,0 +1,27 @@
+import numpy as np
+
+from embeddingcache import EmbeddingCache
+
+
+TEXTS = [f"Q: question {i}\nA: answer {i}" for i in range(10)]
+
+
+def test_only_new_entries_are_encoded(tmp_path, encoder):
+    cache = EmbeddingCache(str(tmp_path), "test-hashing")
+    first = cache.encode(encoder, TEXTS[:6])
+    assert np.array_equal(first, encoder.encode(TEXTS[:6]))
+
+    calls = []
+    counting = type("Counting", (), {"encode": lambda self, texts, **kw: calls.append(len(texts)) or encoder.encode(texts)})()
+    reopened = EmbeddingCache(str(tmp_path), "test-hashing")
+    assert np.array_equal(reopened.encode(counting, TEXTS), encoder.encode(TEXTS))
+    assert calls == [4]
+
+
+def test_progress_reports_rows_scanned_so_far(tmp_path, encoder):
+    cache = EmbeddingCache(str(tmp_path), "test-hashing")
+    cache.encode(encoder, TEXTS[:3])
+    events = []
+    cache.encode_rows(encoder, TEXTS, flush_every=3, progress=lambda *a, **kw: events.append((a, kw)))
+    # Rows 3..9 are new; flushes end after rows 6, 9 and 10
+    assert events == [((6, 3), {}), ((9, 6), {}), ((10, 7), {}), ((10, 7), {"final": True})]
@@ -0,0 +1,115 @@
+import numpy as np
+import pytest
+
+from indexartifact import HEADER_SPACE, ArtifactCollection, ArtifactError, IndexArtifact, write_artifact
+
+
+@pytest.fixture
+def data():
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(50, 16)).astype(np.float32)
+    ids = [f"id-{i}" for i in range(50)]
+    docs = [f"Q: question {i}\nA: answer é {i}" for i in range(50)]
+    metas = [{"source": "json", "row": i} for i in range(50)]
+    return vectors, ids, docs, metas
+
+
+@pytest.fixture
+def artifact_path(tmp_path, data):
+    path = str(tmp_path / "kb.ragidx")
+    write_artifact(path, *data, model="test-model", source={"kb_file": "kb.json"}, chunk_rows=16)
+    return path
+
+
+def test_roundtrip(artifact_path, data):
+    vectors, ids, docs, metas = data
+    art = IndexArtifact(artifact_path, verify=True)
+    assert (art.model, art.variant, art.dim, art.count, len(art)) == ("test-model", "test-model", 16, 50, 50)
+    assert art.source == {"kb_file": "kb.json"}
+    assert np.array_equal(art.vectors, vectors)
+    assert np.allclose(art.norms, np.linalg.norm(vectors, axis=1))
+    assert list(art.ids) == ids
+    assert art.documents[3] == docs[3] and art.documents[-1] == docs[-1]
+    assert art.documents[1:3] == docs[1:3]
+    assert list(art.metadatas) == metas
+    assert art.header["sections"]["vectors"]["offset"] % 4096 == 0
+    assert art.verify()
+
+
+def test_empty_artifact(tmp_path):
+    path = str(tmp_path / "empty.ragidx")
+    write_artifact(path, np.zeros((0, 0), dtype=np.float32), [], [], [], model="test-model")
+    art = IndexArtifact(path, verify=True)
+    assert art.count == 0 and list(art.documents) == []
+
+
+def test_column_length_mismatch_is_refused(tmp_path, data):
+    vectors, ids, docs, metas = data
+    with pytest.raises(ArtifactError, match="documents"):
+        write_artifact(str(tmp_path / "bad.ragidx"), vectors, ids, docs[:-1], metas, model="m")
+
+
+def corrupt(path, offset, data=b"\xff"):
+    with open(path, "r+b") as f:
+        f.seek(offset)
+        f.write(data)
+
+
+def test_corrupted_section_fails_verify(artifact_path):
+    art = IndexArtifact(artifact_path)
+    offset = art.header["sections"]["documents"]["offset"]
+    del art
+    corrupt(artifact_path, offset + 2)
+    IndexArtifact(artifact_path)  # header is intact: opening stays cheap
+    with pytest.raises(ArtifactError, match="'documents' checksum"):
+        IndexArtifact(artifact_path, verify=True)
+
+
+def test_corrupted_header_is_refused(artifact_path):
+    corrupt(artifact_path, 60)
+    with pytest.raises(ArtifactError, match="header checksum"):
+        IndexArtifact(artifact_path)
+
+
+def test_truncated_and_foreign_files_are_refused(tmp_path, artifact_path):
+    with open(artifact_path, "rb") as f:
+        data = f.read()
+    truncated = tmp_path / "truncated.ragidx"
+    truncated.write_bytes(data[:HEADER_SPACE + 100])
+    with pytest.raises(ArtifactError, match="truncated"):
+        IndexArtifact(str(truncated))
+    foreign = tmp_path / "foreign.ragidx"
+    foreign.write_bytes(b"PK\x03\x04" + b"\0" * 100)
+    with pytest.raises(ArtifactError, match="not an index artifact"):
+        IndexArtifact(str(foreign))
+
+
+def test_collection_query_matches_brute_force(artifact_path, data):
+    vectors, ids, docs, _ = data
+    coll = ArtifactCollection(IndexArtifact(artifact_path), chunk_rows=7)
+    q = vectors[[4, 9]] + 0.01
+    res = coll.query(q.tolist(), n_results=3)
+    for qi, row in enumerate(q):
+        dist = ((vectors - row) ** 2).sum(axis=1)
+        order = np.argsort(dist)[:3]
+        assert res["ids"][qi] == [ids[i] for i in order]
+        assert res["documents"][qi] == [docs[i] for i in order]
+        assert np.allclose(res["distances"][qi], dist[order], atol=1e-3)
+    assert coll.count() == 50
+    assert coll.get(ids=["id-7", "missing"])["documents"] == [docs[7]]
+    assert coll.get(limit=2, offset=48)["ids"] == ids[48:]
+
+
+def test_rag_agent_roundtrip(tmp_path, kb_file, encoder):
+    from modelregistry import registry
+    from RAGagentwithmeddialog import RAGAgent
+
+    registry.register("test-hashing", encoder)
+    agent = RAGAgent(kb_file, model_name="test-hashing", cache_dir=None)
+    path = str(tmp_path / "agent.ragidx")
+    agent.export_artifact(path)
+    loaded = RAGAgent.from_artifact(path, verify=True)
+    query = "pill after 3 days of unprotected sex"
+    assert loaded.retrieve(query) == agent.retrieve(query)
+    with pytest.raises(ValueError, match="read-only"):
+        loaded.add_entries(["Q: new\nA: entry"])
@@ -0,0 +1,51 @@
+import json
+
+import pytest
+
+from kbstream import iter_kb_rows
+
+ROWS = [
+    {"id": 1, "text": 'quoted "[brackets]" and {braces}, commas'},
+    {"id": 23456789, "text": "back\\slash \\\" ] still inside"},
+    {"id": 3, "values": [1.5, -20000, [], {"k": "]"}]},
+    12345678,
+    "plain string",
+]
+
+
+def _write(tmp_path, text):
+    path = tmp_path / "kb.json"
+    path.write_text(text, encoding="utf-8")
+    return str(path)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 64, 1 << 20])
+def test_json_array(tmp_path, chunk_size):
+    path = _write(tmp_path, "\n  " + json.dumps(ROWS, indent=2) + "\n")
+    assert list(iter_kb_rows(path, chunk_size=chunk_size)) == ROWS
+
+
+@pytest.mark.parametrize("chunk_size", [1, 5])
+def test_values_span_chunk_boundaries(tmp_path, chunk_size):
+    path = _write(tmp_path, "[123456789,987654321, 3.25e10]")
+    assert list(iter_kb_rows(path, chunk_size=chunk_size)) == [123456789, 987654321, 3.25e10]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 1 << 20])
+def test_empty_array(tmp_path, chunk_size):
+    assert list(iter_kb_rows(_write(tmp_path, "  \n [ ]  "), chunk_size=chunk_size)) == []
+
+
+def test_array_after_long_leading_whitespace(tmp_path):
+    path = _write(tmp_path, " " * 10000 + json.dumps(ROWS))
+    assert list(iter_kb_rows(path, chunk_size=16)) == ROWS
+
+
+def test_jsonl(tmp_path):
+    path = _write(tmp_path, "\n" + "\n\n".join(json.dumps(r) for r in ROWS) + "\n")
+    assert list(iter_kb_rows(path)) == ROWS
+
+
+def test_truncated_array_raises(tmp_path):
+    with pytest.raises(json.JSONDecodeError):
+        list(iter_kb_rows(_write(tmp_path, '[{"id": 1}, {"id": '), chunk_size=4))
@@ -0,0 +1,115 @@
+from Ragwithwebscraping import PageFetcher, fetch_chunks, fetch_page_text
+
+PAGE = "<html><body><nav>Home</nav><p>Take the pill within three days. It works best early.</p></body></html>"
+
+
+def fetcher(**kwargs):
+    kwargs.setdefault("backoff", 0.0)
+    kwargs.setdefault("timeout", 5)
+    return PageFetcher(**kwargs)
+
+
+def test_retries_5xx_then_succeeds(page_server):
+    base, scripts, hits = page_server
+    scripts["/flaky"] = [(503, ""), (500, ""), (200, PAGE)]
+    f = fetcher(retries=3)
+    assert f.fetch(base + "/flaky") == PAGE
+    assert hits["/flaky"] == 3
+    assert f.failed == {}
+
+
+def test_5xx_recorded_after_retries_run_out(page_server):
+    base, scripts, hits = page_server
+    scripts["/down"] = [(502, "")]
+    f = fetcher(retries=2)
+    assert f.fetch(base + "/down") is None
+    assert hits["/down"] == 3
+    assert f.failed == {base + "/down": "HTTP 502"}
+
+
+def test_4xx_is_not_retried(page_server):
+    base, scripts, hits = page_server
+    scripts["/gone"] = [(404, "")]
+    f = fetcher(retries=3)
+    assert f.fetch(base + "/gone") is None
+    assert hits["/gone"] == 1
+    assert "404" in f.failed[base + "/gone"]
+
+
+def test_429_is_retried(page_server):
+    base, scripts, hits = page_server
+    scripts["/busy"] = [(429, ""), (200, PAGE)]
+    f = fetcher(retries=1)
+    assert f.fetch(base + "/busy") == PAGE
+    assert hits["/busy"] == 2
+
+
+def test_fetch_chunks_skips_failed_urls(page_server):
+    base, scripts, _ = page_server
+    scripts["/a"] = [(200, PAGE)]
+    scripts["/b"] = [(500, "")]
+    f = fetcher(retries=1)
+    chunks = list(fetch_chunks([base + "/a", base + "/b", base + "/c"], f))
+    assert {url for url, _, _ in chunks} == {base + "/a"}
+    assert "Home" not in chunks[0][1]
+    assert "Take the pill within three days." in chunks[0][1]
+    assert set(f.failed) == {base + "/b", base + "/c"}
+
+
+def test_fetch_chunks_consumer_can_stop_early(page_server):
+    base, scripts, _ = page_server
+    urls = []
+    for i in range(8):
+        scripts[f"/p{i}"] = [(200, PAGE * 20)]
+        urls.append(f"{base}/p{i}")
+    gen = fetch_chunks(urls, fetcher(per_host=1), chunk_chars=80, queue_size=1)
+    next(gen)
+    gen.close()
+
+
+def test_fetch_page_text(page_server):
+    base, scripts, _ = page_server
+    scripts["/page"] = [(200, PAGE)]
+    assert fetch_page_text(base + "/page") == "Take the pill within three days. It works best early."
+    assert fetch_page_text(base + "/page", max_chars=8) == "Take the"
+    assert fetch_page_text(base + "/missing") is None
+
+
+def test_earlier_failure_does_not_poison_the_fetcher(page_server):
+    base, scripts, hits = page_server
+    scripts["/later"] = [(500, ""), (200, PAGE)]
+    f = fetcher(retries=0)
+    assert f.fetch(base + "/later") is None
+    assert base + "/later" in f.failed
+    assert f.fetch(base + "/later") == PAGE
+    assert hits["/later"] == 2
+    assert f.failed == {}
+
+
+def test_cut_pages_are_recorded(page_server, caplog):
+    base, scripts, _ = page_server
+    scripts["/long"] = [(200, PAGE)]
+    f = fetcher()
+    assert f.fetch(base + "/long", max_chars=len(PAGE)) == PAGE
+    assert f.truncated == {}
+    with caplog.at_level("WARNING", logger="rag.scrape"):
+        assert f.fetch(base + "/long", max_chars=20) == PAGE[:20]
+    assert f.truncated == {base + "/long": 20}
+    assert "page cut at 20" in caplog.text
+
+
+def test_large_pages_are_spooled_and_parsed_in_pieces(page_server):
+    base, scripts, _ = page_server
+    body = "<html><body>" + "".join(f"<p>Sentence number {i} is about the pill.</p>" for i in range(2000)) + "</body></html>"
+    scripts["/big"] = [(200, body)]
+    f = fetcher()
+    page = f.spool(base + "/big", memory_chars=4096)
+    assert page._rolled  # spilled to disk past memory_chars
+    assert page.read() == body
+    page.close()
+
+    chunks = list(fetch_chunks([base + "/big"], f, chunk_chars=400, overlap=0, spool_chars=4096))
+    text = " ".join(c for _, c, _ in chunks)
+    assert "Sentence number 0 is about the pill." in text
+    assert "Sentence number 1999 is about the pill." in text
+    assert all(len(c) <= 400 for _, c, _ in chunks)
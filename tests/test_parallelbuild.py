@@ -0,0 +1,69 @@
+import os
+from functools import partial
+
+import numpy as np
+import pytest
+
+from benchmark import HashingEncoder
+from modelregistry import registry
+from parallelbuild import ParallelEncoder, _shard_path
+
+TEXTS = [f"Q: question {i}\nA: answer {i % 7} " * (i % 3 + 1) for i in range(300)]
+
+
+def encoder(work_dir, dim=64, key=None, **kwargs):
+    return ParallelEncoder("test-hashing", workers=2, shard_size=100, work_dir=str(work_dir), keep_shards=True,
+                           loader=partial(HashingEncoder, dim), key=key or f"hashing-{dim}", **kwargs)
+
+
+def test_matches_in_process_encoding(tmp_path):
+    with encoder(tmp_path) as enc:
+        out = enc.encode(TEXTS)
+    assert np.array_equal(out, HashingEncoder(64).encode(TEXTS))
+    assert len(os.listdir(tmp_path)) == 3
+
+
+def test_shared_work_dir_keeps_models_apart(tmp_path):
+    with encoder(tmp_path, 64) as enc:
+        assert enc.encode(TEXTS).shape == (300, 64)
+    with encoder(tmp_path, 32) as enc:
+        assert enc.encode(TEXTS).shape == (300, 32)
+    assert len(os.listdir(tmp_path)) == 6
+
+
+def test_default_key_follows_backend_and_variant(tmp_path):
+    keys = set()
+    try:
+        for backend in ("torch", "onnx", "onnx-int8"):
+            registry.configure(backend=backend)
+            keys.add(ParallelEncoder("not-loaded-model", work_dir=str(tmp_path)).key)
+    finally:
+        registry.configure(backend="torch")
+    assert len(keys) == 3
+
+
+def test_wrong_shape_shard_is_redone(tmp_path):
+    with encoder(tmp_path, dim=64) as enc:
+        paths = [_shard_path(str(tmp_path), enc.key, TEXTS[a:b]) for a, b in enc._shards(len(TEXTS))]
+        # A leftover from the same key but with the wrong row count
+        np.save(paths[1], np.zeros((5, 64), dtype=np.float32))
+        out = enc.encode(TEXTS)
+    assert np.array_equal(out, HashingEncoder(64).encode(TEXTS))
+
+
+def test_wrong_dim_shard_is_redone_once_dim_is_known(tmp_path):
+    with encoder(tmp_path, dim=64) as enc:
+        enc.encode(TEXTS[:100])
+        paths = [_shard_path(str(tmp_path), enc.key, TEXTS[a:b]) for a, b in enc._shards(len(TEXTS))]
+        np.save(paths[2], np.zeros((100, 16), dtype=np.float32))
+        assert enc.encode(TEXTS).shape == (300, 64)
+
+
+def test_wrong_dim_shard_is_refused_then_redone(tmp_path):
+    with encoder(tmp_path, dim=64) as enc:
+        paths = [_shard_path(str(tmp_path), enc.key, TEXTS[a:b]) for a, b in enc._shards(len(TEXTS))]
+        np.save(paths[2], np.zeros((100, 16), dtype=np.float32))
+        with pytest.raises(ValueError, match="expected"):
+            enc.encode(TEXTS)
+        assert not os.path.exists(paths[2])
+        assert np.array_equal(enc.encode(TEXTS), HashingEncoder(64).encode(TEXTS))
@@ -0,0 +1,109 @@
+import asyncio
+import time
+
+import pytest
+
+from asyncllm import AsyncLLM
+from router import AgentRouter, normalize_hits, rrf_fuse
+
+STUB_TEXT = ("Stub answer. This information is for educational purposes only "
+             "and not a substitute for professional medical advice.")
+
+
+class StubAgent:
+    """retrieve() returns fixed (doc, meta, distance) hits after an optional delay."""
+
+    def __init__(self, hits, delay=0.0, error=None):
+        self.hits = hits
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+
+    def retrieve(self, query):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return self.hits
+
+
+def _hits(*texts):
+    return [(t, {"source": f"https://example.org/{t}"}, 0.1 * i) for i, t in enumerate(texts)]
+
+
+@pytest.fixture
+def make_router():
+    routers = []
+
+    def make(agents, **kwargs):
+        router = AgentRouter(agents, **kwargs)
+        routers.append(router)
+        return router
+
+    yield make
+    for router in routers:
+        router.close()
+
+
+def test_normalize_hits_maps_all_scores_to_unit_range():
+    out = normalize_hits([("a", {"source": "s"}, 0.0), ("b", None, 3.0)])
+    assert out == [("a", "s", 1.0), ("b", "", 0.25)]
+    assert normalize_hits([("c", 1.7)]) == [("c", "kb", 1.0)]
+    assert normalize_hits([("d", {}, 0.4)], score_kind="score") == [("d", "", 0.4)]
+
+
+def test_rrf_fuse_merges_agents_and_ranks_by_summed_rrf():
+    ranked = {
+        "a": [("x", "s", 0.9), ("y", "s", 0.8)],
+        "b": [("y", "s", 0.7), ("z", "s", 0.6)],
+    }
+    fused = rrf_fuse(ranked, k=60)
+    assert [h.text for h in fused] == ["y", "x", "z"]
+    assert fused[0].agents == ["a", "b"]
+    assert fused[0].rrf == pytest.approx(1 / 62 + 1 / 61)
+    assert fused[0].score == 0.8
+
+    weighted = rrf_fuse(ranked, k=60, weights={"b": 3.0})
+    assert [h.text for h in weighted] == ["y", "z", "x"]
+
+
+def test_slow_and_failing_agents_are_left_out(make_router):
+    agents = {
+        "fast": StubAgent(_hits("x", "y")),
+        "slow": StubAgent(_hits("z"), delay=1.0),
+        "broken": StubAgent([], error=RuntimeError("boom")),
+    }
+    router = make_router(agents, default_deadline=2.0, deadlines={"slow": 0.1}, use_llm=False)
+    t0 = time.perf_counter()
+    result = router.retrieve("q")
+    assert time.perf_counter() - t0 < 0.8
+    assert [h.text for h in result.hits] == ["x", "y"]
+    assert result.timed_out == ["slow"]
+    assert "boom" in result.failed["broken"]
+    assert set(result.timings) == {"fast"}
+
+
+def test_agents_run_concurrently(make_router):
+    agents = {name: StubAgent(_hits(name), delay=0.2) for name in "abcd"}
+    router = make_router(agents, use_llm=False)
+    t0 = time.perf_counter()
+    result = router.retrieve("q")
+    assert time.perf_counter() - t0 < 0.6
+    assert sorted(h.text for h in result.hits) == list("abcd")
+
+
+def test_answer_makes_one_llm_call_for_all_agents(make_router, llm_server):
+    url, handler = llm_server
+    agents = {"a": StubAgent(_hits("x", "y")), "b": StubAgent(_hits("y", "z"))}
+    router = make_router(agents, top_k=2, llm=AsyncLLM(max_concurrency=4, api_key="test", base_url=url))
+    result = router.answer("q")
+    assert result.answer == STUB_TEXT
+    assert [h.text for h in result.hits] == ["y", "x"]
+    assert len(handler.requests) == 1
+
+
+def test_no_hits_skip_the_llm(make_router, llm_server):
+    url, handler = llm_server
+    router = make_router({"a": StubAgent([])}, llm=AsyncLLM(max_concurrency=4, api_key="test", base_url=url))
+    assert asyncio.run(router.aanswer("q")).answer == "No relevant entries found."
+    assert handler.requests == []
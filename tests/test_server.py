@@ -0,0 +1,82 @@
+import asyncio
+import threading
+
+import pytest
+
+from server import Coalescer, Overloaded
+
+
+class BatchAgent:
+    """_lookup_batch() echoes its queries and records every batch it was given."""
+
+    def __init__(self, gate=None, error=None):
+        self.batches = []
+        self.gate = gate
+        self.error = error
+
+    def _lookup_batch(self, queries):
+        if self.gate is not None:
+            self.gate.wait(5)
+        self.batches.append(list(queries))
+        if self.error:
+            raise self.error
+        return [(None, [(q.upper(), {}, 0.0)], [q]) for q in queries]
+
+
+def _run(agent, queries, **kwargs):
+    async def main():
+        coalescer = Coalescer(agent, **kwargs)
+        coalescer.start()
+        try:
+            return await asyncio.gather(*(coalescer.lookup(q) for q in queries), return_exceptions=True)
+        finally:
+            await coalescer.stop()
+
+    return asyncio.run(main())
+
+
+def test_concurrent_lookups_share_one_batch():
+    agent = BatchAgent()
+    queries = [f"q{i}" for i in range(10)]
+    results = _run(agent, queries, max_wait=0.05)
+    assert agent.batches == [queries]
+    assert [ids for _, _, ids in results] == [[q] for q in queries]
+
+
+def test_batches_are_capped_at_max_batch():
+    agent = BatchAgent()
+    queries = [f"q{i}" for i in range(5)]
+    results = _run(agent, queries, max_batch=2, max_wait=0.05)
+    assert [len(b) for b in agent.batches] == [2, 2, 1]
+    assert [hits[0][0] for _, hits, _ in results] == [q.upper() for q in queries]
+
+
+def test_batch_errors_reach_every_caller():
+    results = _run(BatchAgent(error=RuntimeError("boom")), ["a", "b"], max_wait=0.05)
+    assert all(isinstance(r, RuntimeError) for r in results)
+
+
+def test_lookups_beyond_max_pending_are_rejected():
+    gate = threading.Event()
+    agent = BatchAgent(gate=gate)
+
+    async def main():
+        coalescer = Coalescer(agent, max_batch=1, max_wait=0.0, max_pending=2)
+        coalescer.start()
+        try:
+            waiting = [asyncio.create_task(coalescer.lookup(q)) for q in ("a", "b")]
+            await asyncio.sleep(0.05)
+            with pytest.raises(Overloaded):
+                await coalescer.lookup("c")
+            gate.set()
+            done = await asyncio.gather(*waiting)
+            # Room again once the backlog has drained
+            done.append(await coalescer.lookup("d"))
+            return done, coalescer.stats()
+        finally:
+            gate.set()
+            await coalescer.stop()
+
+    done, stats = asyncio.run(main())
+    assert [ids for _, _, ids in done] == [["a"], ["b"], ["d"]]
+    assert stats["pending"] == 0 and stats["batches"] == 3
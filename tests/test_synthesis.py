@@ -0,0 +1,132 @@
+import asyncio
+import time
+
+import pytest
+from openai import OpenAI
+
+from answercache import SemanticAnswerCache
+from asyncllm import AsyncLLM, RateLimiter
+from modelregistry import registry
+from RAGagentwithmeddialog import RAGAgent
+from synthesis import DISCLAIMER
+
+STUB_TEXT = "Stub answer. " + DISCLAIMER
+QUERIES = [f"Is the pill still effective after {i} days?" for i in range(1, 7)]
+
+
+@pytest.fixture
+def agent(kb_file, encoder, llm_server):
+    url, _ = llm_server
+    registry.register("test-hashing", encoder)
+    agent = RAGAgent(kb_file, model_name="test-hashing", cache_dir=None, use_llm=True, threshold=-1.0)
+    agent.llm = AsyncLLM(max_concurrency=8, api_key="test", base_url=url)
+    agent.client_llm = OpenAI(api_key="test", base_url=url)
+    yield agent
+    agent.close()
+
+
+def test_handle_and_aanswer_agree(agent, llm_server):
+    _, handler = llm_server
+    assert agent.handle(QUERIES[0]) == STUB_TEXT
+    assert asyncio.run(agent.aanswer(QUERIES[0])) == STUB_TEXT
+    assert len(handler.requests) == 2
+
+
+def test_answer_batch_keeps_order_and_runs_concurrently(agent, llm_server):
+    _, handler = llm_server
+    handler.delay = 0.2
+    t0 = time.perf_counter()
+    answers = agent.answer_batch(QUERIES)
+    elapsed = time.perf_counter() - t0
+    assert answers == [STUB_TEXT] * len(QUERIES)
+    assert len(handler.requests) == len(QUERIES)
+    assert elapsed < 0.2 * len(QUERIES) / 2
+
+
+def test_concurrency_is_bounded(agent, llm_server):
+    _, handler = llm_server
+    handler.delay = 0.1
+    agent.llm = AsyncLLM(max_concurrency=1, api_key="test", base_url=agent.llm.base_url)
+    t0 = time.perf_counter()
+    agent.answer_batch(QUERIES[:3])
+    assert time.perf_counter() - t0 >= 0.3
+
+
+def test_answer_cache_skips_the_llm(agent, llm_server):
+    _, handler = llm_server
+    agent.answer_cache = SemanticAnswerCache(threshold=0.99)
+    first = agent.handle(QUERIES[0])
+    assert asyncio.run(agent.aanswer(QUERIES[0])) == first
+    assert agent.handle(QUERIES[0]) == first
+    assert len(handler.requests) == 1
+
+
+def test_no_hits_never_calls_the_llm(agent, llm_server):
+    _, handler = llm_server
+    agent.threshold = 2.0
+    assert agent.answer_batch(QUERIES[:2]) == ["No relevant entries found."] * 2
+    assert handler.requests == []
+
+
+def test_rate_limiter_waits_for_the_next_request():
+    limiter = RateLimiter(rpm=60)
+    limiter._req = 1.0
+    assert limiter._wait_time(10) == 0.0
+    assert limiter._wait_time(10) == pytest.approx(1.0, abs=0.05)
+
+
+def test_rate_limiter_tokens_per_minute():
+    limiter = RateLimiter(tpm=600)
+    assert limiter._wait_time(500) == 0.0
+    # 100 tokens left, 300 needed: 200 more at 10 tokens/s
+    assert limiter._wait_time(300) == pytest.approx(20.0, abs=0.1)
+    # A request over the whole budget is capped at the budget
+    assert RateLimiter(tpm=100)._wait_time(1000) == 0.0
+
+
+def test_stream_matches_answer(agent):
+    assert "".join(agent.stream_answer(QUERIES[0])) == STUB_TEXT
+
+
+async def _collect(agen):
+    return "".join([piece async for piece in agen])
+
+
+@pytest.mark.parametrize("first", ["handle", "stream", "astream"])
+def test_cached_answers_get_one_footer(agent, llm_server, first):
+    _, handler = llm_server
+    agent.answer_cache = SemanticAnswerCache(threshold=0.99)
+    agent._sources = lambda hits: ["https://example.org/pill"]
+    footer = "\n\nSources:\n- https://example.org/pill"
+    fill = {
+        "handle": lambda: agent.handle(QUERIES[0]),
+        "stream": lambda: "".join(agent.stream_answer(QUERIES[0])),
+        "astream": lambda: asyncio.run(_collect(agent.astream_answer(QUERIES[0]))),
+    }
+    fill[first]()
+    # Whichever path filled the cache, answer() is bare and streams add the footer once
+    assert agent.handle(QUERIES[0]) == STUB_TEXT
+    assert "".join(agent.stream_answer(QUERIES[0])) == STUB_TEXT + footer
+    assert asyncio.run(_collect(agent.astream_answer(QUERIES[0]))) == STUB_TEXT + footer
+    assert len(handler.requests) == 1
+
+
+def test_answer_cache_is_scoped_to_model_and_token_limit(agent, llm_server):
+    _, handler = llm_server
+    agent.answer_cache = SemanticAnswerCache(threshold=0.99)
+    agent.handle(QUERIES[0])
+    agent.max_tokens = 50
+    agent.handle(QUERIES[0])
+    agent.llm_model = "other-model"
+    agent.handle(QUERIES[0])
+    agent.handle(QUERIES[0])
+    assert len(handler.requests) == 3
+
+
+def test_empty_stream_is_not_cached(agent, llm_server):
+    _, handler = llm_server
+    agent.answer_cache = SemanticAnswerCache(threshold=0.99)
+    q_vec, hits, ids = agent._lookup(QUERIES[0])
+    agent._stream_done([" ", "\n"], hits, q_vec, ids, agent.answer_cache, time.perf_counter())
+    assert agent.handle(QUERIES[0]) == STUB_TEXT
+    assert len(handler.requests) == 1
@@ -0,0 +1,80 @@
+import json
+
+import numpy as np
+import pytest
+
+from vectorindex import ExactIndex, index_report
+
+
+@pytest.fixture
+def kb():
+    rng = np.random.default_rng(0)
+    # Unnormalized rows, so the scan has to apply its inverse norms
+    vectors = rng.normal(size=(2000, 64)).astype(np.float32) * rng.uniform(0.5, 3.0, (2000, 1))
+    queries = vectors[rng.choice(2000, 50, replace=False)] + rng.normal(scale=0.3, size=(50, 64))
+    return vectors.astype(np.float32), queries.astype(np.float32)
+
+
+def brute_force(vectors, queries, k):
+    v = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    q = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+    return [np.argsort(-row)[:k] for row in q @ v.T]
+
+
+def test_float32_matches_brute_force(kb):
+    vectors, queries = kb
+    for (idx, scores), ref in zip(ExactIndex(vectors).search(queries, 10), brute_force(vectors, queries, 10)):
+        assert idx.tolist() == ref.tolist()
+        assert np.all(np.diff(scores) <= 0)
+
+
+@pytest.mark.parametrize("dtype,rescore,min_recall", [
+    ("float16", False, 0.99),
+    ("int8", False, 0.9),
+    ("float16", True, 1.0),
+    ("int8", True, 0.99),
+])
+def test_compact_recall_vs_float32(kb, dtype, rescore, min_recall):
+    vectors, queries = kb
+    report = index_report(ExactIndex(vectors, dtype=dtype, rescore=rescore), ExactIndex(vectors), queries, 10)
+    assert report["recall@10"] >= min_recall
+    assert report["saved_bytes"] > 0
+
+
+def test_rescored_scores_are_exact(kb):
+    vectors, queries = kb
+    exact = ExactIndex(vectors).search(queries, 5)
+    for (idx, scores), (ref_idx, ref_scores) in zip(ExactIndex(vectors, dtype="int8").search(queries, 5), exact):
+        common = np.intersect1d(idx, ref_idx)
+        got = dict(zip(idx.tolist(), scores.tolist()))
+        ref = dict(zip(ref_idx.tolist(), ref_scores.tolist()))
+        for i in common.tolist():
+            assert got[i] == pytest.approx(ref[i], abs=1e-5)
+
+
+def test_compact_sizes(kb):
+    vectors, _ = kb
+    assert ExactIndex(vectors, dtype="float16").nbytes == vectors.nbytes // 2
+    assert ExactIndex(vectors, dtype="int8").nbytes == vectors.nbytes // 4 + 4 * len(vectors)
+
+
+def test_threshold_and_zero_vectors():
+    vectors = np.array([[1, 0], [0, 1], [0, 0]], dtype=np.float32)
+    for dtype in ("float32", "float16", "int8"):
+        (idx, scores), = ExactIndex(vectors, dtype=dtype).search(np.array([[1, 0.1]], dtype=np.float32), 3, 0.5)
+        assert idx.tolist() == [0]
+
+
+def test_dropped_float32_error_names_the_condition(tmp_path, encoder):
+    from modelregistry import registry
+    from RAGagentwithmeddialog import RAGAgent
+
+    kb_file = tmp_path / "kb.json"
+    kb_file.write_text(json.dumps([{"input": f"question {i}", "answer_chatgpt": f"answer {i}"} for i in range(20)]))
+    registry.register("test-hashing", encoder)
+    agent = RAGAgent(str(kb_file), model_name="test-hashing", cache_dir=None, index_dtype="int8", rescore=False)
+    assert agent.embedded_kb is None
+    with pytest.raises(ValueError, match="rescore=False"):
+        agent.index_report(["question 1"])
+    with pytest.raises(ValueError, match="cache_dir"):
+        agent.add_entries(["Q: new\nA: entry"])
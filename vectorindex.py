@@ -0,0 +1,282 @@
+import json
+import os
+import numpy as np
+
+DTYPES = ("float32", "float16", "int8")
+BACKENDS = ("exact", "hnsw")
+
+
+def unit_rows(x) -> np.ndarray:
+    x = np.asarray(x, dtype=np.float32)
+    if x.ndim == 1:
+        x = x[None, :]
+    return x / np.maximum(np.linalg.norm(x, axis=1, keepdims=True), 1e-12)
+
+
+def top_candidates(scores, k: int) -> np.ndarray:
+    """Indices of the k largest scores, unordered, without a full sort."""
+    k = min(k, scores.shape[0])
+    if k == 0:
+        return np.zeros(0, dtype=np.int64)
+    return np.argpartition(-scores, k - 1)[:k]
+
+
+class ExactIndex:
+    """
+    Brute-force cosine search over the KB matrix.
+
+    dtype="float32" scans the original vectors (memmap-friendly, never copied).
+    "float16" keeps unit vectors in half precision; "int8" keeps them scalar-
+    quantized with one float32 scale per vector. The compact forms are scanned
+    directly, block by block; with rescore=True the top k * rescore_factor
+    candidates are re-ranked against the full-precision vectors. Passing
+    precomputed inv_norms (float32 only) skips the pass over the vectors.
+    Blocks are small enough to stay in cache while they are widened to float32;
+    numpy's half->single conversion is slow, so int8 is usually the faster scan.
+    """
+
+    def __init__(self, vectors, dtype: str = "float32", rescore: bool = True,
+                 rescore_factor: int = 4, chunk_rows: int = 1024, inv_norms=None):
+        if dtype not in DTYPES:
+            raise ValueError(f"dtype must be one of {DTYPES}, got {dtype!r}")
+        self.dtype = dtype
+        self.vectors = vectors
+        self.rescore = rescore and dtype != "float32" and vectors is not None
+        self.rescore_factor = rescore_factor
+        self.chunk_rows = chunk_rows
+
+        n = vectors.shape[0]
+        self.codes = None
+        self.scales = None
+        if inv_norms is not None and dtype == "float32":
+            self.inv_norms = np.asarray(inv_norms, dtype=np.float32)
+            return
+        self.inv_norms = np.empty(n, dtype=np.float32)
+        if dtype == "float16":
+            self.codes = np.empty(vectors.shape, dtype=np.float16)
+        elif dtype == "int8":
+            self.codes = np.empty(vectors.shape, dtype=np.int8)
+            self.scales = np.empty(n, dtype=np.float32)
+
+        # One pass over the (possibly memory-mapped) source, one block at a time
+        for s in range(0, n, chunk_rows):
+            block = np.asarray(vectors[s:s + chunk_rows], dtype=np.float32)
+            norms = np.linalg.norm(block, axis=1)
+            inv = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+            self.inv_norms[s:s + len(block)] = inv
+            if dtype == "float16":
+                self.codes[s:s + len(block)] = block * inv[:, None]
+            elif dtype == "int8":
+                unit = block * inv[:, None]
+                scale = np.abs(unit).max(axis=1) / 127.0
+                scale[scale == 0] = 1.0
+                self.codes[s:s + len(block)] = np.round(unit / scale[:, None]).astype(np.int8)
+                self.scales[s:s + len(block)] = scale
+
+    def __len__(self):
+        return self.inv_norms.shape[0]
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes of the representation that is scanned per query."""
+        if self.dtype == "float32":
+            return self.vectors.nbytes + self.inv_norms.nbytes
+        extra = self.scales.nbytes if self.scales is not None else 0
+        return self.codes.nbytes + extra
+
+    def scores(self, q_units) -> np.ndarray:
+        """Cosine similarity (approximate for compact dtypes) of unit queries vs every row."""
+        if self.dtype == "float32":
+            return (q_units @ self.vectors.T) * self.inv_norms
+        out = np.empty((q_units.shape[0], len(self)), dtype=np.float32)
+        for s in range(0, len(self), self.chunk_rows):
+            block = self.codes[s:s + self.chunk_rows].astype(np.float32)
+            out[:, s:s + len(block)] = q_units @ block.T
+            if self.scales is not None:
+                out[:, s:s + len(block)] *= self.scales[s:s + len(block)]
+        return out
+
+    def _exact(self, q_unit, idx):
+        order = np.argsort(idx)
+        rows = np.asarray(self.vectors[idx[order]], dtype=np.float32)
+        exact = np.empty(len(idx), dtype=np.float32)
+        exact[order] = (rows @ q_unit) * self.inv_norms[idx[order]]
+        return exact
+
+    def search(self, q_vecs, k: int, threshold: float | None = None):
+        """[(indices, scores)] per query: best first, at most k, scores >= threshold."""
+        q_units = unit_rows(q_vecs)
+        sims = self.scores(q_units)
+        results = []
+        for q_unit, row in zip(q_units, sims):
+            idx = top_candidates(row, k * self.rescore_factor if self.rescore else k)
+            scores = self._exact(q_unit, idx) if self.rescore else row[idx]
+            order = np.argsort(-scores)[:k]
+            idx, scores = idx[order], scores[order]
+            if threshold is not None:
+                keep = scores >= threshold
+                idx, scores = idx[keep], scores[keep]
+            results.append((idx, scores))
+        return results
+
+
+class HNSWIndex:
+    """
+    Approximate cosine search over an hnswlib HNSW graph.
+
+    Every vector carries a caller-chosen integer label (RAGAgent uses embedding
+    cache rows, which never move), so the graph can be saved next to the KB and
+    reused: sync() marks labels that left the KB as deleted, revives ones that
+    came back and inserts only the new ones. Search results are mapped back to
+    positions in the current KB, like ExactIndex. key is saved with the graph and a
+    saved graph is only reused if key_ok(saved_key) says its labels still mean
+    the same vectors.
+    M / ef_construction trade build time for graph quality; ef (raised to k when
+    needed) trades query latency for recall.
+    """
+
+    dtype = "float32"
+    rescore = False
+
+    def __init__(self, dim: int, path: str | None = None, key: str = "", key_ok=None, M: int = 16,
+                 ef_construction: int = 200, ef: int = 64):
+        import hnswlib
+
+        self.dim = dim
+        self.path = path
+        self.meta_path = f"{path}.json" if path else None
+        self.key = key
+        self.ef = ef
+        self.deleted = set()
+        self.dirty = False                            # graph differs from the saved copy
+        self.labels = np.zeros(0, dtype=np.int64)    # KB position -> label
+        self._pos = np.zeros(0, dtype=np.int64)      # label -> KB position (-1 = not in KB)
+
+        self.graph = hnswlib.Index(space="cosine", dim=dim)
+        meta = None
+        if path and os.path.exists(path) and os.path.exists(self.meta_path):
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        if meta and meta.get("dim") == dim and (key_ok or key.__eq__)(meta.get("key")):
+            self.graph.load_index(path, max_elements=meta["max_elements"])
+            self.deleted = set(meta["deleted"])
+        else:
+            self.graph.init_index(max_elements=1024, M=M, ef_construction=ef_construction)
+        self.graph.set_ef(ef)
+
+    def __len__(self):
+        return self.labels.shape[0]
+
+    @property
+    def live(self) -> int:
+        return self.graph.get_current_count() - len(self.deleted)
+
+    @property
+    def nbytes(self) -> int:
+        return self.graph.index_file_size()
+
+    def sync(self, vectors, labels) -> int:
+        """Make the graph hold exactly the given KB; returns how many vectors were inserted."""
+        labels = np.asarray(labels, dtype=np.int64)
+        stored = np.asarray(self.graph.get_ids_list(), dtype=np.int64)
+        gone = np.setdiff1d(stored, labels)
+        for label in gone.tolist():
+            if label not in self.deleted:
+                self.graph.mark_deleted(label)
+                self.deleted.add(label)
+                self.dirty = True
+        self.labels = np.zeros(0, dtype=np.int64)
+        self._pos = np.zeros(0, dtype=np.int64)
+        return self.add(vectors, labels)
+
+    def add(self, vectors, labels) -> int:
+        """Append vectors to the KB (positions continue after the current ones)."""
+        labels = np.asarray(labels, dtype=np.int64)
+        if len(labels) == 0:
+            return 0
+        start = len(self)
+        self.labels = np.concatenate([self.labels, labels])
+        if labels.max() >= self._pos.shape[0]:
+            grown = np.full(max(int(labels.max()) + 1, 2 * self._pos.shape[0]), -1, dtype=np.int64)
+            grown[:self._pos.shape[0]] = self._pos
+            self._pos = grown
+
+        stored = np.isin(labels, np.asarray(self.graph.get_ids_list(), dtype=np.int64))
+        for label in labels[stored].tolist():
+            if label in self.deleted:
+                self.graph.unmark_deleted(label)
+                self.deleted.discard(label)
+                self.dirty = True
+
+        # Duplicate KB entries share a label; the first position wins
+        new = ~stored
+        _, first = np.unique(labels, return_index=True)
+        fresh = np.zeros(len(labels), dtype=bool)
+        fresh[first] = True
+        new &= fresh
+        for i, label in enumerate(labels.tolist()):
+            if self._pos[label] < 0:
+                self._pos[label] = start + i
+
+        n_new = int(new.sum())
+        if n_new:
+            need = self.graph.get_current_count() + n_new
+            if need > self.graph.get_max_elements():
+                self.graph.resize_index(max(need, 2 * self.graph.get_max_elements()))
+            self.graph.add_items(np.asarray(vectors, dtype=np.float32)[new], labels[new])
+            self.dirty = True
+        return n_new
+
+    def save(self):
+        if not self.path:
+            return
+        self.graph.save_index(self.path)
+        with open(self.meta_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "dim": self.dim,
+                "key": self.key,
+                "max_elements": self.graph.get_max_elements(),
+                "deleted": sorted(self.deleted),
+            }, f)
+        self.dirty = False
+
+    def search(self, q_vecs, k: int, threshold: float | None = None):
+        """[(indices, scores)] per query: best first, at most k, scores >= threshold."""
+        q_vecs = np.asarray(q_vecs, dtype=np.float32)
+        if q_vecs.ndim == 1:
+            q_vecs = q_vecs[None, :]
+        k = min(k, self.live)
+        if k == 0:
+            empty = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32))
+            return [empty for _ in range(q_vecs.shape[0])]
+
+        self.graph.set_ef(max(self.ef, k))
+        labels, dists = self.graph.knn_query(q_vecs, k=k)
+        results = []
+        for row_labels, row_dists in zip(labels, dists):
+            idx = self._pos[row_labels.astype(np.int64)]
+            scores = (1.0 - row_dists).astype(np.float32)
+            keep = idx >= 0
+            if threshold is not None:
+                keep &= scores >= threshold
+            results.append((idx[keep], scores[keep]))
+        return results
+
+
+def index_report(index, baseline, q_vecs, k: int):
+    """Memory saved and recall@k of index against a float32 baseline on the same vectors."""
+    got = index.search(q_vecs, k)
+    ref = baseline.search(q_vecs, k)
+    recall = float(np.mean([
+        len(set(a.tolist()) & set(b.tolist())) / max(len(b), 1)
+        for (a, _), (b, _) in zip(got, ref)
+    ])) if len(ref) else 1.0
+    return {
+        "dtype": index.dtype,
+        "rescore": index.rescore,
+        "bytes": index.nbytes,
+        "float32_bytes": baseline.nbytes,
+        "saved_bytes": baseline.nbytes - index.nbytes,
+        "saved_pct": 100.0 * (1 - index.nbytes / baseline.nbytes) if baseline.nbytes else 0.0,
+        f"recall@{k}": recall,
+    }